@@ -10,6 +10,7 @@ Copyright (C) 2013 Inktank Storage, Inc.
 LGPL2.  See file COPYING.
 """
 from __future__ import print_function
+import atexit
 import copy
 import errno
 import json
@@ -20,6 +21,7 @@ import socket
 import stat
 import sys
 import threading
+import time
 import uuid
 
 
@@ -31,6 +33,11 @@ try:
 except NameError:
     basestring = str
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 class ArgumentError(Exception):
     """
@@ -727,6 +734,117 @@ def parse_funcsig(sig):
     return newsig
 
 
+class PrefixIndex(object):
+    """
+    Trie of the CephPrefix words the signatures in a sigdict start with,
+    so validate_command() only has to score the commands which can match
+    the arguments best rather than every command.
+    """
+    def __init__(self, sigdict):
+        self.order = {}
+        self.root = self.node()
+        for cmdtag, cmd in sigdict.items():
+            self.order[cmdtag] = len(self.order)
+            node = self.root
+            node['below'].append(cmdtag)
+            for desc in cmd['sig']:
+                if desc.t != CephPrefix:
+                    break
+                node = node['next'].setdefault(desc.instance.prefix,
+                                               self.node())
+                node['below'].append(cmdtag)
+            node['cmds'].append(cmdtag)
+
+    @staticmethod
+    def node():
+        # 'cmds' ends here, 'below' goes through here
+        return {'cmds': [], 'below': [], 'next': {}}
+
+    @staticmethod
+    def word(s):
+        # what CephPrefix.valid() compares, None if it can't match
+        try:
+            s = str(s)
+            if isinstance(s, bytes):
+                s = s.decode('ascii')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            return None
+        return s
+
+    def candidates(self, args):
+        """
+        Return the cmdtags, in sigdict order, of the commands whose
+        leading prefix words are all matched by args, and of those that
+        have as many of them matched as any command does.  As prefix
+        words are required, matchnum() scores every other command lower.
+        """
+        found = []
+        nodes = [self.root]
+        for i, arg in enumerate(args):
+            word = self.word(arg)
+            if word is None:
+                break
+            matched = []
+            for node in nodes:
+                if i == len(args) - 1:
+                    # matchnum() lets the last word match partially
+                    matched.extend(child for prefix, child
+                                   in node['next'].items()
+                                   if prefix.startswith(word))
+                elif word in node['next']:
+                    matched.append(node['next'][word])
+            if not matched:
+                break
+            for node in nodes:
+                found.extend(node['cmds'])
+            nodes = matched
+        for node in nodes:
+            found.extend(node['below'])
+        return sorted(set(found), key=self.order.get)
+
+
+class SigDict(dict):
+    """
+    dict of command signatures keyed by cmdtag, as returned by
+    parse_json_funcsigs(), which keeps a PrefixIndex of the commands
+    """
+    _prefix_index = None
+
+    @property
+    def prefix_index(self):
+        if self._prefix_index is None:
+            self._prefix_index = PrefixIndex(self)
+        return self._prefix_index
+
+    def __setitem__(self, key, value):
+        self._prefix_index = None
+        dict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self._prefix_index = None
+        dict.__delitem__(self, key)
+
+    def clear(self):
+        self._prefix_index = None
+        dict.clear(self)
+
+    def pop(self, *args):
+        self._prefix_index = None
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._prefix_index = None
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._prefix_index = None
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self._prefix_index = None
+        dict.update(self, *args, **kwargs)
+
+
 def parse_json_funcsigs(s, consumer):
     """
     A function signature is mostly an array of argdesc; it's represented
@@ -748,7 +866,7 @@ def parse_json_funcsigs(s, consumer):
       }
     }
 
-    Parse the string s and return a dict of dicts, keyed by opcode;
+    Parse the string s and return a SigDict of dicts, keyed by opcode;
     each dict contains 'sig' with the array of descriptors, and 'help'
     with the helptext, 'module' with the module name, 'perm' with a
     string representing required permissions in that module to execute
@@ -763,7 +881,7 @@ def parse_json_funcsigs(s, consumer):
     except Exception as e:
         print("Couldn't parse JSON {0}: {1}".format(s, e), file=sys.stderr)
         raise e
-    sigdict = {}
+    sigdict = SigDict()
     for cmdtag, cmd in overall.items():
         if 'sig' not in cmd:
             s = "JSON descriptor {0} has no 'sig'".format(cmdtag)
@@ -776,6 +894,8 @@ def parse_json_funcsigs(s, consumer):
         cmd['sig'] = parse_funcsig(cmd['sig'])
         # just take everything else as given
         sigdict[cmdtag] = cmd
+    # index before handing out, rather than on first use
+    sigdict.prefix_index
     return sigdict
 
 
@@ -803,11 +923,14 @@ def matchnum(args, signature, partial=False):
     matches (partial applies to string matches).
     """
     words = args[:]
-    mysig = copy.deepcopy(signature)
     matchcnt = 0
-    for desc in mysig:
-        setattr(desc, 'numseen', 0)
-        while desc.numseen < desc.n:
+    # rather than validate_one() on a copy of the signature, count what
+    # it would in locals: the only other state valid() leaves behind is
+    # the validated value, which nothing reads back from signature
+    for desc in signature:
+        numseen = 0
+        n = desc.n
+        while numseen < n:
             # if there are no more arguments, return
             if not words:
                 return matchcnt
@@ -817,7 +940,10 @@ def matchnum(args, signature, partial=False):
                 # only allow partial matching if we're on the last supplied
                 # word; avoid matching foo bar and foot bar just because
                 # partial is set
-                validate_one(word, desc, partial and (len(words) == 0))
+                desc.instance.valid(word, partial and (len(words) == 0))
+                numseen += 1
+                if desc.N:
+                    n = numseen + 1
                 valid = True
             except ArgumentError:
                 # matchnum doesn't care about type of error
@@ -1011,9 +1137,14 @@ def validate_command(sigdict, args, verbose=False):
     if args:
         # look for best match, accumulate possibles in bestcmds
         # (so we can maybe give a more-useful error message)
+        if isinstance(sigdict, SigDict):
+            index = sigdict.prefix_index
+        else:
+            index = PrefixIndex(sigdict)
         best_match_cnt = 0
         bestcmds = []
-        for cmdtag, cmd in sigdict.items():
+        for cmdtag in index.candidates(args):
+            cmd = sigdict[cmdtag]
             sig = cmd['sig']
             matched = matchnum(args, sig, partial=True)
             if matched > best_match_cnt:
@@ -1146,61 +1277,267 @@ def find_cmd_target(childargs):
     return 'mon', ''
 
 
-class RadosThread(threading.Thread):
-    def __init__(self, target, *args, **kwargs):
-        self.args = args
-        self.kwargs = kwargs
-        self.target = target
+class RadosFuture(object):
+    """
+    Outcome of a call submitted to a RadosExecutor
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.retval = None
         self.exception = None
-        threading.Thread.__init__(self)
 
-    def run(self):
-        try:
-            self.retval = self.target(*self.args, **self.kwargs)
-        except Exception as e:
-            self.exception = e
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the call to finish, or for timeout seconds if given.
+        SIGINT still raises KeyboardInterrupt in the main thread.
+
+        :returns: True if the call finished
+        """
+        if sys.version_info[0] >= 3:
+            return self.event.wait(timeout)
+        # python 2 only delivers signals while waiting with a timeout
+        deadline = timeout and time.time() + timeout
+        while not self.event.is_set():
+            if deadline:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.event.wait(min(remaining, POLL_TIME_INCR))
+            else:
+                self.event.wait(POLL_TIME_INCR)
+        return self.event.is_set()
 
 
-# time in seconds between each call to t.join() for child thread
+class RadosExecutor(object):
+    """
+    Daemon threads which make the blocking librados calls of
+    run_in_thread(), started as calls need them and then kept to take
+    the next ones until idle for idle_timeout seconds.
+
+    There is no limit on the threads, as a call may itself wait for
+    another one, like json_command() run in a thread does.
+    """
+    def __init__(self, idle_timeout=60):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.calls = queue.Queue()
+        self.workers = 0
+        # submitted and not finished yet
+        self.busy = 0
+
+    def submit(self, target, *args, **kwargs):
+        """
+        Call target(*args, **kwargs) in a worker thread
+
+        :returns: RadosFuture
+        """
+        future = RadosFuture()
+        with self.lock:
+            self.busy += 1
+            if self.busy > self.workers:
+                t = threading.Thread(target=self.work)
+                # allow the main thread to exit while a call is blocked,
+                # see run_in_thread()
+                t.daemon = True
+                t.start()
+                self.workers += 1
+        self.calls.put((future, target, args, kwargs))
+        return future
+
+    def work(self):
+        while True:
+            try:
+                call = self.calls.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self.lock:
+                    # unless a call came in meanwhile that needs us
+                    if self.busy < self.workers:
+                        self.workers -= 1
+                        return
+                continue
+            future, target, args, kwargs = call
+            try:
+                future.retval = target(*args, **kwargs)
+            except BaseException as e:
+                # SystemExit and the like too, for the waiter to raise
+                future.exception = e
+            finally:
+                with self.lock:
+                    self.busy -= 1
+                future.event.set()
+
+
+# time in seconds between checks for signals while waiting on python 2
 POLL_TIME_INCR = 0.5
 
+rados_executor = RadosExecutor()
 
-def run_in_thread(target, *args, **kwargs):
-    interrupt = False
-    timeout = kwargs.pop('timeout', 0)
-    countdown = timeout
-    t = RadosThread(target, *args, **kwargs)
 
-    # allow the main thread to exit (presumably, avoid a join() on this
-    # subthread) before this thread terminates.  This allows SIGINT
-    # exit of a blocked call.  See below.
-    t.daemon = True
+def run_in_thread(target, *args, **kwargs):
+    """
+    Call target(*args, **kwargs) in a worker thread, which unlike the
+    main thread may block in librados, and return what it returns.
+    A 'timeout' keyword gives the seconds to wait for the call at most.
 
-    t.start()
+    On SIGINT or timeout, return (-EINTR, None, 'Interrupted!') and leave
+    the call to finish, or not, in the background.
+    """
+    timeout = kwargs.pop('timeout', 0)
+    future = rados_executor.submit(target, *args, **kwargs)
     try:
-        # poll for thread exit
-        while t.is_alive():
-            t.join(POLL_TIME_INCR)
-            if timeout and t.is_alive():
-                countdown = countdown - POLL_TIME_INCR
-                if countdown <= 0:
-                    raise KeyboardInterrupt
-
-        t.join()        # in case t exits before reaching the join() above
+        if not future.wait(timeout or None):
+            raise KeyboardInterrupt
     except KeyboardInterrupt:
-        # ..but allow SIGINT to terminate the waiting.  Note: this
-        # relies on the Linux kernel behavior of delivering the signal
-        # to the main thread in preference to any subthread (all that's
-        # strictly guaranteed is that *some* thread that has the signal
-        # unblocked will receive it).  But there doesn't seem to be
-        # any interface to create t with SIGINT blocked.
-        interrupt = True
+        # Note: getting ^C relies on the Linux kernel behavior of
+        # delivering the signal to the main thread in preference to any
+        # subthread (all that's strictly guaranteed is that *some*
+        # thread that has the signal unblocked will receive it).  But
+        # there doesn't seem to be any interface to create the workers
+        # with SIGINT blocked.
+        return -errno.EINTR, None, 'Interrupted!'
+    if future.exception:
+        raise future.exception
+    return future.retval
+
+
+class MDSClient(object):
+    """
+    LibCephFS handle of an MDSClientCache
+    """
+    def __init__(self, cluster, filesystem):
+        self.cluster = cluster
+        self.filesystem = filesystem
+        self.users = 0
+        self.last_used = time.time()
+
+
+# mds_command() errors after which a session is not worth keeping
+MDS_SESSION_ERRORS = (errno.ENOTCONN, errno.ESHUTDOWN, errno.ECONNRESET,
+                      errno.ECONNREFUSED, errno.ETIMEDOUT)
+
+
+class MDSClientCache(object):
+    """
+    LibCephFS handles, one per cluster handle, that send_command() keeps
+    to send MDS commands over an established session.  Each is set up on
+    first use and shut down once unused for idle_timeout seconds, or
+    when its cluster handle has been shut down.
+    """
+    def __init__(self, idle_timeout=60):
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.clients = {}
+        self.reaper = None
 
-    if interrupt:
-        t.retval = -errno.EINTR, None, 'Interrupted!'
-    if t.exception:
-        raise t.exception
-    return t.retval
+    def get(self, cluster):
+        with self.lock:
+            client = self.clients.get(id(cluster))
+            if client is not None:
+                client.users += 1
+                return client
+
+        try:
+            from cephfs import LibCephFS
+        except ImportError:
+            raise RuntimeError("CephFS unavailable, have you installed libcephfs?")
+
+        # setting up a session takes round trips to the cluster, so it is
+        # done without holding up the commands sent over other handles
+        filesystem = LibCephFS(cluster.conf_defaults, cluster.conffile)
+        try:
+            filesystem.conf_parse_argv(cluster.parsed_args)
+            filesystem.init()
+        except:
+            filesystem.shutdown()
+            raise
+
+        with self.lock:
+            client = self.clients.get(id(cluster))
+            if client is None:
+                # holding on to cluster keeps its id() from being reused
+                client = MDSClient(cluster, filesystem)
+                self.clients[id(cluster)] = client
+                filesystem = None
+            client.users += 1
+            if self.reaper is None:
+                self.reaper = threading.Thread(target=self.reap)
+                self.reaper.daemon = True
+                self.reaper.start()
+        if filesystem is not None:
+            # set up concurrently by another caller
+            filesystem.shutdown()
+        return client
+
+    def put(self, client, broken=False):
+        key = id(client.cluster)
+        with self.lock:
+            client.users -= 1
+            client.last_used = time.time()
+            if broken and self.clients.get(key) is client:
+                del self.clients[key]
+            # the last user of a dropped handle closes it
+            close = self.clients.get(key) is not client and not client.users
+        if close:
+            client.filesystem.shutdown()
+
+    def mds_command(self, cluster, mds_spec, cmd, inbuf):
+        """
+        LibCephFS.mds_command() on the handle kept for cluster
+        """
+        client = self.get(cluster)
+        try:
+            ret = client.filesystem.mds_command(mds_spec, cmd, inbuf)
+        except Exception:
+            # start over with a new session next time
+            self.put(client, broken=True)
+            raise
+        # an evicted or blocklisted session keeps failing rather than
+        # raising, and would otherwise be kept alive by every attempt
+        self.put(client, broken=-ret[0] in MDS_SESSION_ERRORS)
+        return ret
+
+    def expire(self, everything=False):
+        """
+        Shut down the handles due for it, or all of the unused ones
+
+        :returns: seconds until the next one is due, or None if none are
+                  left
+        """
+        now = time.time()
+        with self.lock:
+            expired = [key for key, client in self.clients.items()
+                       if not client.users and
+                       (everything or
+                        now - client.last_used >= self.idle_timeout or
+                        client.cluster.state == 'shutdown')]
+            closing = [self.clients.pop(key) for key in expired]
+            due = None
+            if self.clients:
+                due = min(client.last_used for client
+                          in self.clients.values()) + self.idle_timeout - now
+        for client in closing:
+            client.filesystem.shutdown()
+        return due
+
+    def reap(self):
+        while True:
+            due = self.expire()
+            with self.lock:
+                if due is None and not self.clients:
+                    self.reaper = None
+                    return
+            # a handle in use may be overdue, don't spin on it
+            time.sleep(max(due or 0, 1))
+
+    def clear(self):
+        self.expire(everything=True)
+
+
+mds_clients = MDSClientCache()
+atexit.register(mds_clients.clear)
 
 
 def send_command_retry(*args, **kwargs):
@@ -1275,18 +1612,8 @@ def send_command(cluster, target=('mon', ''), cmd=None, inbuf=b'', timeout=0,
                 print('submit {0} to mds.{1}'.format(cmd, mds_spec),
                       file=sys.stderr)
 
-            try:
-                from cephfs import LibCephFS
-            except ImportError:
-                raise RuntimeError("CephFS unavailable, have you installed libcephfs?")
-
-            filesystem = LibCephFS(cluster.conf_defaults, cluster.conffile)
-            filesystem.conf_parse_argv(cluster.parsed_args)
-
-            filesystem.init()
             ret, outbuf, outs = \
-                filesystem.mds_command(mds_spec, cmd, inbuf)
-            filesystem.shutdown()
+                mds_clients.mds_command(cluster, mds_spec, cmd, inbuf)
         else:
             raise ArgumentValid("Bad target type '{0}'".format(target[0]))
 
@@ -3,6 +3,7 @@ This module is a thin wrapper around libcephfs.
 """
 
 from cpython cimport PyObject, ref, exc
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_WRITABLE
 from libc cimport errno
 from libc.stdint cimport *
 from libc.stdlib cimport malloc, realloc, free
@@ -12,8 +13,15 @@ cimport rados
 from collections import namedtuple
 from datetime import datetime
 import errno
+import io
 import os
 import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # Are we running Python 2.x
 if sys.version_info[0] < 3:
@@ -95,6 +103,9 @@ cdef extern from "cephfs/libcephfs.h" nogil:
     cdef struct ceph_dir_result:
         pass
 
+    cdef struct Inode:
+        pass
+
     ctypedef void* rados_t
 
     const char *ceph_version(int *major, int *minor, int *patch)
@@ -134,10 +145,14 @@ cdef extern from "cephfs/libcephfs.h" nogil:
     int ceph_open(ceph_mount_info *cmount, const char *path, int flags, mode_t mode)
     int ceph_mkdir(ceph_mount_info *cmount, const char *path, mode_t mode)
     int ceph_mkdirs(ceph_mount_info *cmount, const char *path, mode_t mode)
+    int ceph_chmod(ceph_mount_info *cmount, const char *path, mode_t mode)
     int ceph_closedir(ceph_mount_info *cmount, ceph_dir_result *dirp)
     int ceph_opendir(ceph_mount_info *cmount, const char *name, ceph_dir_result **dirpp)
     int ceph_chdir(ceph_mount_info *cmount, const char *path)
     dirent * ceph_readdir(ceph_mount_info *cmount, ceph_dir_result *dirp)
+    int ceph_readdirplus_r(ceph_mount_info *cmount, ceph_dir_result *dirp,
+                           dirent *de, statx *stx, unsigned want,
+                           unsigned flags, Inode **out)
     int ceph_rmdir(ceph_mount_info *cmount, const char *path)
     const char* ceph_getcwd(ceph_mount_info *cmount)
     int ceph_sync_fs(ceph_mount_info *cmount)
@@ -268,6 +283,65 @@ StatResult = namedtuple('StatResult',
                          "st_gid", "st_rdev", "st_size", "st_blksize",
                          "st_blocks", "st_atime", "st_mtime", "st_ctime"])
 
+
+class ScandirEntry(object):
+    """
+    Directory entry returned by :meth:`LibCephFS.scandir`
+
+    Modelled on :class:`os.DirEntry`, except that the attributes were
+    fetched along with the entry, so :meth:`stat` does not need another
+    round trip to the MDS.
+    """
+    __slots__ = ('name', 'path', 'd_ino', 'd_type', 'statx')
+
+    def __init__(self, name, path, d_ino, d_type, statx):
+        self.name = name
+        self.path = path
+        self.d_ino = d_ino
+        self.d_type = d_type
+        self.statx = statx
+
+    def __repr__(self):
+        return '<ScandirEntry %r>' % self.name
+
+    def inode(self):
+        return self.d_ino
+
+    def is_dir(self):
+        return self.d_type == DirEntry.DT_DIR
+
+    def is_file(self):
+        return self.d_type == DirEntry.DT_REG
+
+    def is_symlink(self):
+        return self.d_type == DirEntry.DT_LNK
+
+    def stat(self):
+        """
+        :returns: :class:`StatResult` - the attributes requested from
+                  :meth:`LibCephFS.scandir`, the others being zero
+        """
+        return self.statx
+
+
+cdef make_stat_result(statx *stx):
+    return StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
+                      st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
+                      st_uid=stx.stx_uid, st_gid=stx.stx_gid,
+                      st_rdev=stx.stx_rdev, st_size=stx.stx_size,
+                      st_blksize=stx.stx_blksize,
+                      st_blocks=stx.stx_blocks,
+                      st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
+                      st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
+                      st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+
+
+CEPH_STATX_MODE = 0x1
+CEPH_STATX_SIZE = 0x200
+CEPH_STATX_BASIC_STATS = 0x7ff
+AT_NO_ATTR_SYNC = 0x4000
+
+
 cdef class DirResult(object):
     cdef ceph_dir_result *handler
 
@@ -604,6 +678,32 @@ cdef class LibCephFS(object):
                         d_type=dirent.d_type,
                         d_name=dirent.d_name)
 
+    def scandir(self, path, want=CEPH_STATX_BASIC_STATS, flags=0,
+                batch_size=256):
+        """
+        Iterate over the entries of a directory along with their attributes
+
+        Entries and attributes are fetched together with ceph_readdirplus_r,
+        ``batch_size`` entries at a time with the GIL released, which saves
+        the stat call per entry of a readdir based walk.  The '.' and '..'
+        entries are skipped.
+
+        :param path: the directory to list
+        :type path: str
+        :param want: mask of CEPH_STATX_* attributes to fetch
+        :type want: int
+        :param flags: AT_NO_ATTR_SYNC to accept possibly stale cached
+                      attributes instead of asking the MDS
+        :type flags: int
+        :param batch_size: number of entries fetched at a time
+        :type batch_size: int
+        :returns: :class:`ScandirIterator` yielding :class:`ScandirEntry`
+        """
+        self.require_state("mounted")
+        if batch_size < 1:
+            raise InvalidValue(errno.EINVAL, "batch_size must be positive")
+        return ScandirIterator(self, path, want, flags, batch_size)
+
     def closedir(self, DirResult dir_handler):
         self.require_state("mounted")
         cdef:
@@ -641,6 +741,19 @@ cdef class LibCephFS(object):
         if ret < 0:
             raise make_ex(ret, "error in mkdirs '%s'" % path)
 
+    def chmod(self, path, mode):
+        self.require_state("mounted")
+        path = cstr(path, 'path')
+        if not isinstance(mode, int):
+            raise TypeError('mode must be an int')
+        cdef:
+            char* _path = path
+            int _mode = mode
+        with nogil:
+            ret = ceph_chmod(self.cluster, _path, _mode)
+        if ret < 0:
+            raise make_ex(ret, "error in chmod '%s'" % path)
+
     def rmdir(self, path):
         self.require_state("mounted")
         path = cstr(path, 'path')
@@ -696,6 +809,84 @@ cdef class LibCephFS(object):
             raise make_ex(ret, "error in open '%s'" % path)
         return ret
 
+    def open_file(self, path, mode='r', buffering=-1, encoding=None,
+                  errors=None, newline=None):
+        """
+        Open a file and return it as a Python file object
+
+        ``mode`` and the other arguments are interpreted as by
+        :func:`io.open`, so the result can be handed to standard library
+        code such as :mod:`tarfile`, :mod:`csv` or
+        :func:`shutil.copyfileobj`.  Reads are done ``buffering`` bytes at
+        a time, which acts as readahead, and small writes are coalesced
+        into writes of up to ``buffering`` bytes; the default is
+        :data:`FILE_BUFFER_SIZE`.  ``buffering=0`` returns the unbuffered
+        :class:`CephFileIO` itself, which supports ``readinto``.
+
+        :param path: the path of the file
+        :type path: str
+        :param mode: one of 'r', 'w', 'a' or 'x', optionally followed by
+                     '+' and 'b' or 't'
+        :type mode: str
+        :param buffering: buffer size in bytes, 0 for raw binary I/O, or 1
+                          for line buffered text
+        :type buffering: int
+        :returns: a :class:`CephFileIO`, a buffered reader, writer or
+                  random access object, or a text wrapper around one
+        """
+        self.require_state("mounted")
+        modes = set(mode)
+        if (modes - set('rwax+bt') or len(modes) != len(mode) or
+                len(modes & set('rwax')) != 1 or
+                ('b' in modes and 't' in modes)):
+            raise ValueError('invalid mode: %r' % mode)
+        binary = 'b' in modes
+        if binary and (encoding is not None or errors is not None or
+                       newline is not None):
+            raise ValueError("binary mode doesn't take an encoding, errors "
+                             "or newline argument")
+        if buffering == 0 and not binary:
+            raise ValueError("can't have unbuffered text I/O")
+
+        readable = 'r' in modes or '+' in modes
+        writable = 'r' not in modes or '+' in modes
+        if readable and writable:
+            flags = os.O_RDWR
+        elif readable:
+            flags = os.O_RDONLY
+        else:
+            flags = os.O_WRONLY
+        if 'w' in modes:
+            flags |= os.O_CREAT | os.O_TRUNC
+        elif 'a' in modes:
+            flags |= os.O_CREAT | os.O_APPEND
+        elif 'x' in modes:
+            flags |= os.O_CREAT | os.O_EXCL
+
+        fd = self.open(path, flags, 0o666)
+        try:
+            raw = CephFileIO(self, fd, path, mode, readable, writable,
+                             'a' in modes)
+        except:
+            self.close(fd)
+            raise
+        if buffering == 0:
+            return raw
+
+        line_buffering = buffering == 1 and not binary
+        if buffering < 0 or buffering == 1:
+            buffering = FILE_BUFFER_SIZE
+        if readable and writable:
+            buffered = io.BufferedRandom(raw, buffering)
+        elif readable:
+            buffered = io.BufferedReader(raw, buffering)
+        else:
+            buffered = io.BufferedWriter(raw, buffering)
+        if binary:
+            return buffered
+        return io.TextIOWrapper(buffered, encoding, errors, newline,
+                                line_buffering)
+
     def close(self, fd):
         self.require_state("mounted")
         if not isinstance(fd, int):
@@ -741,6 +932,37 @@ cdef class LibCephFS(object):
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    def readinto(self, fd, buf, offset):
+        """
+        Read from a file into a caller-supplied buffer
+
+        Up to ``len(buf)`` bytes are read directly into ``buf``, which
+        may be any writable, contiguous object supporting the buffer
+        protocol (bytearray, memoryview, mmap, ...).
+
+        :returns: int - the number of bytes read
+        """
+        self.require_state("mounted")
+        if not isinstance(offset, int):
+            raise TypeError('offset must be an int')
+        if not isinstance(fd, int):
+            raise TypeError('fd must be an int')
+        cdef:
+            int _fd = fd
+            int64_t _offset = offset
+            Py_buffer view
+
+        PyObject_GetBuffer(buf, &view, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = ceph_read(self.cluster, _fd, <char *>view.buf, view.len,
+                                _offset)
+            if ret < 0:
+                raise make_ex(ret, "error in read")
+            return ret
+        finally:
+            PyBuffer_Release(&view)
+
     def write(self, fd, buf, offset):
         self.require_state("mounted")
         if not isinstance(fd, int):
@@ -843,15 +1065,7 @@ cdef class LibCephFS(object):
             ret = ceph_statx(self.cluster, _path, &stx, 0x7ffu, 0)
         if ret < 0:
             raise make_ex(ret, "error in stat: %s" % path)
-        return StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
-                          st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
-                          st_uid=stx.stx_uid, st_gid=stx.stx_gid,
-                          st_rdev=stx.stx_rdev, st_size=stx.stx_size,
-                          st_blksize=stx.stx_blksize,
-                          st_blocks=stx.stx_blocks,
-                          st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
-                          st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
-                          st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+        return make_stat_result(&stx)
 
     def fstat(self, fd):
         self.require_state("mounted")
@@ -867,15 +1081,7 @@ cdef class LibCephFS(object):
             ret = ceph_fstatx(self.cluster, _fd, &stx, 0x7ffu, 0)
         if ret < 0:
             raise make_ex(ret, "error in fsat")
-        return StatResult(st_dev=stx.stx_dev, st_ino=stx.stx_ino,
-                          st_mode=stx.stx_mode, st_nlink=stx.stx_nlink,
-                          st_uid=stx.stx_uid, st_gid=stx.stx_gid,
-                          st_rdev=stx.stx_rdev, st_size=stx.stx_size,
-                          st_blksize=stx.stx_blksize,
-                          st_blocks=stx.stx_blocks,
-                          st_atime=datetime.fromtimestamp(stx.stx_atime.tv_sec),
-                          st_mtime=datetime.fromtimestamp(stx.stx_mtime.tv_sec),
-                          st_ctime=datetime.fromtimestamp(stx.stx_ctime.tv_sec))
+        return make_stat_result(&stx)
 
     def symlink(self, existing, newname):
         self.require_state("mounted")
@@ -918,7 +1124,7 @@ cdef class LibCephFS(object):
                 ret = ceph_readlink(self.cluster, _path, buf, _size)
             if ret < 0:
                 raise make_ex(ret, "error in readlink")
-            return buf
+            return buf[:ret]
         finally:
             free(buf)
 
@@ -986,3 +1192,485 @@ cdef class LibCephFS(object):
                 return (ret, b"", "")
         finally:
             free(_cmd)
+
+
+# Default buffer size of the file objects returned by LibCephFS.open_file(),
+# the size of a file object in the default layout
+FILE_BUFFER_SIZE = 4 << 20
+
+
+class CephFileIO(io.RawIOBase):
+    """
+    Unbuffered binary file object over a file opened through libcephfs
+
+    Every call is a single read or write at the current position, which
+    is tracked here.  Use :meth:`LibCephFS.open_file` to create one,
+    usually wrapped in a buffered object.
+    """
+    def __init__(self, fs, fd, name, mode, readable, writable, append=False):
+        io.RawIOBase.__init__(self)
+        self.fs = fs
+        self.fd = fd
+        self.name = name
+        self.mode = mode
+        self.can_read = readable
+        self.can_write = writable
+        self.pos = fs.fstat(fd).st_size if append else 0
+
+    def __check_open(self):
+        if self.closed:
+            raise ValueError('I/O operation on closed file')
+
+    def readable(self):
+        self.__check_open()
+        return self.can_read
+
+    def writable(self):
+        self.__check_open()
+        return self.can_write
+
+    def seekable(self):
+        self.__check_open()
+        return True
+
+    def readinto(self, b):
+        """
+        Read up to ``len(b)`` bytes into a writable buffer
+
+        :returns: int - the number of bytes read, 0 at end of file
+        """
+        self.__check_open()
+        if not self.can_read:
+            raise io.UnsupportedOperation('not readable')
+        ret = self.fs.readinto(self.fd, b, self.pos)
+        self.pos += ret
+        return ret
+
+    def readall(self):
+        self.__check_open()
+        if not self.can_read:
+            raise io.UnsupportedOperation('not readable')
+        chunks = []
+        length = max(self.fs.fstat(self.fd).st_size - self.pos, 0) + 1
+        while True:
+            data = self.fs.read(self.fd, self.pos, max(length, FILE_BUFFER_SIZE))
+            if not data:
+                return b''.join(chunks)
+            self.pos += len(data)
+            chunks.append(data)
+
+    def write(self, b):
+        self.__check_open()
+        if not self.can_write:
+            raise io.UnsupportedOperation('not writable')
+        ret = self.fs.write(self.fd, memoryview(b).tobytes(), self.pos)
+        self.pos += ret
+        return ret
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self.__check_open()
+        if whence == os.SEEK_SET:
+            pos = offset
+        elif whence == os.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == os.SEEK_END:
+            pos = self.fs.fstat(self.fd).st_size + offset
+        else:
+            raise ValueError('invalid whence (%r)' % whence)
+        if pos < 0:
+            raise ValueError('negative seek position %d' % pos)
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        self.__check_open()
+        return self.pos
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            io.RawIOBase.close(self)
+        finally:
+            self.fs.close(self.fd)
+
+
+cdef class ScandirIterator(object):
+    """
+    Iterator over the entries of a directory, created by
+    :meth:`LibCephFS.scandir`
+
+    The directory stays open until it has been fully read, or
+    :meth:`close` is called.
+    """
+    cdef:
+        LibCephFS fs
+        ceph_dir_result *handle
+        dirent *dirents
+        statx *stats
+        int batch_size
+        unsigned want
+        unsigned flags
+        object prefix
+        list entries
+        object error
+
+    def __cinit__(self, LibCephFS fs, path, unsigned want, unsigned flags,
+                  int batch_size):
+        self.fs = fs
+        self.want = want
+        self.flags = flags
+        self.batch_size = batch_size
+        self.entries = []
+        self.dirents = <dirent *>realloc_chk(NULL, sizeof(dirent) * batch_size)
+        self.stats = <statx *>realloc_chk(NULL, sizeof(statx) * batch_size)
+
+        path = cstr(path, 'path')
+        self.prefix = path if path.endswith(b'/') else path + b'/'
+        cdef:
+            char *_path = path
+            ceph_dir_result *handle = NULL
+        with nogil:
+            ret = ceph_opendir(fs.cluster, _path, &handle)
+        if ret < 0:
+            raise make_ex(ret, "error in scandir '%s'" % path)
+        self.handle = handle
+
+    def __dealloc__(self):
+        self.close()
+        free(self.dirents)
+        free(self.stats)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+        return False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self.entries:
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            self.fetch()
+        return self.entries.pop()
+
+    cdef fetch(self):
+        if self.handle == NULL:
+            raise StopIteration
+        self.fs.require_state("mounted")
+        cdef:
+            ceph_mount_info *cluster = self.fs.cluster
+            ceph_dir_result *handle = self.handle
+            dirent *dirents = self.dirents
+            statx *stats = self.stats
+            unsigned want = self.want
+            unsigned flags = self.flags
+            int batch_size = self.batch_size
+            int count = 0
+            int i
+            int ret = 0
+        with nogil:
+            while count < batch_size:
+                ret = ceph_readdirplus_r(cluster, handle, &dirents[count],
+                                         &stats[count], want, flags, NULL)
+                if ret <= 0:
+                    break
+                count += 1
+
+        entries = []
+        for i in range(count):
+            name = dirents[i].d_name
+            if name == b'.' or name == b'..':
+                continue
+            entries.append(ScandirEntry(name, self.prefix + name,
+                                        dirents[i].d_ino, dirents[i].d_type,
+                                        make_stat_result(&stats[i])))
+        if ret <= 0:
+            self.close()
+            if ret < 0:
+                # raised once the entries read before it have been returned
+                self.error = make_ex(ret, "error in scandir '%s'" %
+                                     self.prefix)
+        # handed out from the end
+        entries.reverse()
+        self.entries = entries
+
+    def close(self):
+        """
+        Close the directory, ending the iteration
+        """
+        if self.handle == NULL:
+            return
+        cdef ceph_dir_result *handle = self.handle
+        self.handle = NULL
+        if self.fs.state == "mounted":
+            with nogil:
+                ceph_closedir(self.fs.cluster, handle)
+
+
+class TreeWalker(object):
+    """
+    Walk directory trees with a pool of threads
+
+    Directories are listed with :meth:`LibCephFS.scandir` by up to
+    ``parallel`` threads at a time, libcephfs calls being made without the
+    GIL, so that MDS round trips for different directories overlap.
+    Symbolic links are not followed.
+
+    :param fs: a mounted file system
+    :type fs: :class:`LibCephFS`
+    :param parallel: number of worker threads
+    :type parallel: int
+    :param batch_size: directory entries fetched at a time
+    :type batch_size: int
+    """
+    def __init__(self, fs, parallel=8, batch_size=256):
+        if parallel < 1:
+            raise InvalidValue(errno.EINVAL, "parallel must be positive")
+        self.fs = fs
+        self.parallel = parallel
+        self.batch_size = batch_size
+
+    def walk(self, top, on_entry=None, on_dir_done=None, prune=None,
+             want=CEPH_STATX_BASIC_STATS):
+        """
+        Walk the tree below a directory
+
+        Callbacks are invoked from the worker threads, concurrently for
+        entries of different directories, and must be thread safe.  The
+        walk stops at the first exception raised by a callback or by
+        libcephfs, which is then raised here.
+
+        :param top: the directory to walk
+        :type top: str
+        :param on_entry: called with each :class:`ScandirEntry`, and for a
+                         directory before anything below it is listed
+        :type on_entry: callable
+        :param on_dir_done: called with the path of each directory,
+                            ``top`` included, once everything below it has
+                            been walked
+        :type on_dir_done: callable
+        :param prune: called with the entry of each subdirectory found,
+                      but not with other entries; returning True stops
+                      the walk from descending into that directory
+        :type prune: callable
+        :param want: mask of CEPH_STATX_* attributes to fetch
+        :type want: int
+        """
+        top = cstr(top, 'top')
+        pending = queue.Queue()
+        lock = threading.Lock()
+        errors = []
+        # unfinished work per directory: listing it, and each subdirectory
+        remaining = {top: 1}
+        parents = {}
+
+        def stop():
+            for _ in range(self.parallel):
+                pending.put(None)
+
+        def finish(path):
+            while True:
+                if on_dir_done is not None:
+                    on_dir_done(path)
+                with lock:
+                    del remaining[path]
+                    parent = parents.pop(path, None)
+                    if parent is not None:
+                        remaining[parent] -= 1
+                        if remaining[parent]:
+                            return
+                if parent is None:
+                    stop()
+                    return
+                path = parent
+
+        def process(path):
+            subdirs = []
+            with self.fs.scandir(path, want, batch_size=self.batch_size) as it:
+                for entry in it:
+                    if errors:
+                        return
+                    if on_entry is not None:
+                        on_entry(entry)
+                    if entry.is_dir() and (prune is None or not prune(entry)):
+                        subdirs.append(entry.path)
+            with lock:
+                for subdir in subdirs:
+                    parents[subdir] = path
+                    remaining[subdir] = 1
+                remaining[path] += len(subdirs) - 1
+                done = remaining[path] == 0
+            for subdir in subdirs:
+                pending.put(subdir)
+            if done:
+                finish(path)
+
+        def worker():
+            while True:
+                path = pending.get()
+                if path is None:
+                    return
+                if errors:
+                    continue
+                try:
+                    process(path)
+                except BaseException as e:
+                    # anything escaping would leave the other workers
+                    # waiting for this directory forever
+                    with lock:
+                        first = not errors
+                        errors.append(e)
+                    if first:
+                        stop()
+
+        pending.put(top)
+        threads = [threading.Thread(target=worker)
+                   for _ in range(self.parallel)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+
+DiskUsage = namedtuple('DiskUsage', ['bytes', 'files', 'directories'])
+
+
+def du(fs, path, parallel=8):
+    """
+    Add up the sizes of the files below a directory
+
+    Unlike the recursive statistics the MDS maintains (``ceph.dir.rbytes``),
+    this is exact at the time each directory is listed.
+
+    :param fs: a mounted file system
+    :type fs: :class:`LibCephFS`
+    :param path: the directory to measure
+    :type path: str
+    :param parallel: number of worker threads
+    :type parallel: int
+    :returns: :class:`DiskUsage` - total size of the files, number of
+              files and number of directories below ``path``
+    """
+    lock = threading.Lock()
+    totals = [0, 0, 0]
+
+    def on_entry(entry):
+        with lock:
+            if entry.is_dir():
+                totals[2] += 1
+            else:
+                totals[0] += entry.stat().st_size
+                totals[1] += 1
+
+    TreeWalker(fs, parallel).walk(path, on_entry,
+                                  want=CEPH_STATX_MODE | CEPH_STATX_SIZE)
+    return DiskUsage(*totals)
+
+
+def rmtree(fs, path, parallel=8):
+    """
+    Delete a directory and everything below it
+
+    Files are unlinked as they are listed and each directory is removed
+    once it is empty.
+
+    :param fs: a mounted file system
+    :type fs: :class:`LibCephFS`
+    :param path: the directory to delete
+    :type path: str
+    :param parallel: number of worker threads
+    :type parallel: int
+    """
+    def on_entry(entry):
+        if not entry.is_dir():
+            fs.unlink(entry.path)
+
+    TreeWalker(fs, parallel).walk(path, on_entry, fs.rmdir,
+                                  want=CEPH_STATX_MODE)
+
+
+def copyfile(fs, src, dst, mode=0o644, chunk_size=FILE_BUFFER_SIZE):
+    """
+    Copy the contents of a file, creating or truncating ``dst``
+
+    :param fs: a mounted file system
+    :type fs: :class:`LibCephFS`
+    :param src: the file to copy
+    :type src: str
+    :param dst: where to copy it
+    :type dst: str
+    :param mode: permissions of ``dst`` if it is created
+    :type mode: int
+    """
+    src_fd = fs.open(src, os.O_RDONLY)
+    try:
+        dst_fd = fs.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+        try:
+            offset = 0
+            while True:
+                data = fs.read(src_fd, offset, chunk_size)
+                if not data:
+                    break
+                fs.write(dst_fd, data, offset)
+                offset += len(data)
+        finally:
+            fs.close(dst_fd)
+    finally:
+        fs.close(src_fd)
+
+
+def copytree(fs, src, dst, parallel=8):
+    """
+    Copy a directory tree
+
+    ``dst`` must not exist.  Directories and files keep their permission
+    bits and symbolic links are copied as links; ownership and times are
+    not preserved.  Directories are created accessible to their owner and
+    get their permissions once everything below them has been copied, so
+    read-only directories can be copied too.
+
+    :param fs: a mounted file system
+    :type fs: :class:`LibCephFS`
+    :param src: the directory to copy
+    :type src: str
+    :param dst: where to copy it
+    :type dst: str
+    :param parallel: number of worker threads
+    :type parallel: int
+    """
+    src = cstr(src, 'src').rstrip(b'/')
+    dst = cstr(dst, 'dst').rstrip(b'/')
+    lock = threading.Lock()
+    # final modes of the directories, applied bottom-up like shutil.copytree
+    # does with copystat, as a read-only one could not be copied into
+    modes = {src or b'/': fs.stat(src or b'/').st_mode & 0o7777}
+    fs.mkdir(dst, 0o700)
+
+    def on_entry(entry):
+        target = dst + entry.path[len(src):]
+        mode = entry.stat().st_mode & 0o7777
+        if entry.is_dir():
+            fs.mkdir(target, 0o700)
+            with lock:
+                modes[entry.path] = mode
+        elif entry.is_symlink():
+            fs.symlink(fs.readlink(entry.path, entry.stat().st_size), target)
+        else:
+            copyfile(fs, entry.path, target, mode)
+
+    def on_dir_done(path):
+        with lock:
+            mode = modes.pop(path)
+        fs.chmod(dst + path[len(src):], mode)
+
+    TreeWalker(fs, parallel).walk(src or b'/', on_entry, on_dir_done,
+                                  want=CEPH_STATX_MODE | CEPH_STATX_SIZE)
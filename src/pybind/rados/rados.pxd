@@ -4,6 +4,8 @@
 #
 # Copyright 2016 Mehdi Abaakouk <sileht@redhat.com>
 
+from cpython.buffer cimport Py_buffer
+
 
 cdef extern from "rados/librados.h" nogil:
     ctypedef void* rados_t
@@ -25,14 +27,13 @@ cdef class Rados(object):
 cdef class Ioctx(object):
     cdef:
         rados_ioctx_t io
+        public Rados rados
         public char *name
         public object state
         public object locator_key
         public object nspace
+        public object watches
+
 
-        # TODO(sileht): we need to track leaving completion objects
-        # I guess we can do that in a lighter ways, but keep code simple
-        # as before for now
-        public object safe_completions
-        public object complete_completions
-        public object lock
+cdef Py_buffer * get_buffer_views(list buffers, int flags) except NULL
+cdef void release_buffer_views(Py_buffer *views, size_t num)
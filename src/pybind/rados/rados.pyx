@@ -13,21 +13,35 @@ method.
 # Copyright 2015 Hector Martin <marcan@marcan.st>
 # Copyright 2016 Mehdi Abaakouk <sileht@redhat.com>
 
+cimport cython
 from cpython cimport PyObject, ref
+from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
+                             PyBUF_SIMPLE, PyBUF_WRITABLE)
 from cpython.pycapsule cimport *
 from libc cimport errno
 from libc.stdint cimport *
-from libc.stdlib cimport malloc, realloc, free
+from libc.stdlib cimport malloc, calloc, realloc, free
 
 import sys
 import threading
 import time
+import traceback
 
 from collections import Callable
 from datetime import datetime
 from functools import partial, wraps
 from itertools import chain
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 # Are we running Python 2.x
 if sys.version_info[0] < 3:
     str_type = basestring
@@ -91,11 +105,14 @@ cdef extern from "rados/librados.h" nogil:
     ctypedef void* rados_xattrs_iter_t
     ctypedef void* rados_omap_iter_t
     ctypedef void* rados_list_ctx_t
+    ctypedef void* rados_object_list_cursor
     ctypedef uint64_t rados_snap_t
     ctypedef void *rados_write_op_t
     ctypedef void *rados_read_op_t
     ctypedef void *rados_completion_t
     ctypedef void (*rados_callback_t)(rados_completion_t cb, void *arg)
+    ctypedef void (*rados_watchcb2_t)(void *arg, uint64_t notify_id, uint64_t handle, uint64_t notifier_id, void *data, size_t data_len)
+    ctypedef void (*rados_watcherrcb_t)(void *pre, uint64_t cookie, int err)
     ctypedef void (*rados_log_callback_t)(void *arg, const char *line, const char *who,
                                           uint64_t sec, uint64_t nsec, uint64_t seq, const char *level, const char *msg)
 
@@ -200,6 +217,23 @@ cdef extern from "rados/librados.h" nogil:
     int rados_nobjects_list_next(rados_list_ctx_t ctx, const char **entry, const char **key, const char **nspace)
     void rados_nobjects_list_close(rados_list_ctx_t ctx)
 
+    ctypedef struct rados_object_list_item:
+        size_t oid_length
+        char *oid
+        size_t nspace_length
+        char *nspace
+        size_t locator_length
+        char *locator
+
+    rados_object_list_cursor rados_object_list_begin(rados_ioctx_t io)
+    rados_object_list_cursor rados_object_list_end(rados_ioctx_t io)
+    int rados_object_list_is_end(rados_ioctx_t io, rados_object_list_cursor cur)
+    void rados_object_list_cursor_free(rados_ioctx_t io, rados_object_list_cursor cur)
+    int rados_object_list_cursor_cmp(rados_ioctx_t io, rados_object_list_cursor lhs, rados_object_list_cursor rhs)
+    int rados_object_list(rados_ioctx_t io, const rados_object_list_cursor start, const rados_object_list_cursor finish, const size_t result_size, const char *filter_buf, const size_t filter_buf_len, rados_object_list_item *results, rados_object_list_cursor *next)
+    void rados_object_list_free(const size_t result_size, rados_object_list_item *results)
+    void rados_object_list_slice(rados_ioctx_t io, const rados_object_list_cursor start, const rados_object_list_cursor finish, const size_t n, const size_t m, rados_object_list_cursor *split_start, rados_object_list_cursor *split_finish)
+
     int rados_ioctx_snap_rollback(rados_ioctx_t io, const char * oid, const char * snapname)
     int rados_ioctx_snap_create(rados_ioctx_t io, const char * snapname)
     int rados_ioctx_snap_remove(rados_ioctx_t io, const char * snapname)
@@ -231,8 +265,21 @@ cdef extern from "rados/librados.h" nogil:
     int rados_aio_write_full(rados_ioctx_t io, const char * oid, rados_completion_t completion, const char * buf, size_t len)
     int rados_aio_remove(rados_ioctx_t io, const char * oid, rados_completion_t completion)
     int rados_aio_read(rados_ioctx_t io, const char * oid, rados_completion_t completion, char * buf, size_t len, uint64_t off)
+    int rados_aio_getxattr(rados_ioctx_t io, const char *o, rados_completion_t completion, const char *name, char *buf, size_t len)
     int rados_aio_flush(rados_ioctx_t io)
 
+    rados_t rados_ioctx_get_cluster(rados_ioctx_t io)
+    int rados_watch2(rados_ioctx_t io, const char *o, uint64_t *cookie, rados_watchcb2_t watchcb, rados_watcherrcb_t watcherrcb, void *arg)
+    int rados_watch3(rados_ioctx_t io, const char *o, uint64_t *cookie, rados_watchcb2_t watchcb, rados_watcherrcb_t watcherrcb, uint32_t timeout, void *arg)
+    int rados_aio_watch(rados_ioctx_t io, const char *o, rados_completion_t completion, uint64_t *handle, rados_watchcb2_t watchcb, rados_watcherrcb_t watcherrcb, void *arg)
+    int rados_aio_watch2(rados_ioctx_t io, const char *o, rados_completion_t completion, uint64_t *handle, rados_watchcb2_t watchcb, rados_watcherrcb_t watcherrcb, uint32_t timeout, void *arg)
+    int rados_watch_check(rados_ioctx_t io, uint64_t cookie)
+    int rados_unwatch2(rados_ioctx_t io, uint64_t cookie)
+    int rados_notify2(rados_ioctx_t io, const char *o, const char *buf, int buf_len, uint64_t timeout_ms, char **reply_buffer, size_t *reply_buffer_len)
+    int rados_aio_notify(rados_ioctx_t io, const char *o, rados_completion_t completion, const char *buf, int buf_len, uint64_t timeout_ms, char **reply_buffer, size_t *reply_buffer_len)
+    int rados_notify_ack(rados_ioctx_t io, const char *o, uint64_t notify_id, uint64_t cookie, const char *buf, int buf_len)
+    int rados_watch_flush(rados_t cluster)
+
     int rados_aio_get_return_value(rados_completion_t c)
     int rados_aio_wait_for_complete_and_cb(rados_completion_t c)
     int rados_aio_wait_for_safe_and_cb(rados_completion_t c)
@@ -262,11 +309,13 @@ cdef extern from "rados/librados.h" nogil:
     void rados_write_op_zero(rados_write_op_t write_op, uint64_t offset, uint64_t len)
 
     void rados_read_op_omap_get_vals(rados_read_op_t read_op, const char * start_after, const char * filter_prefix, uint64_t max_return, rados_omap_iter_t * iter, int * prval)
+    void rados_read_op_omap_get_vals2(rados_read_op_t read_op, const char * start_after, const char * filter_prefix, uint64_t max_return, rados_omap_iter_t * iter, unsigned char * pmore, int * prval)
     void rados_read_op_omap_get_keys(rados_read_op_t read_op, const char * start_after, uint64_t max_return, rados_omap_iter_t * iter, int * prval)
     void rados_read_op_omap_get_vals_by_keys(rados_read_op_t read_op, const char * const* keys, size_t keys_len, rados_omap_iter_t * iter, int * prval)
     int rados_read_op_operate(rados_read_op_t read_op, rados_ioctx_t io, const char * oid, int flags)
     int rados_aio_read_op_operate(rados_read_op_t read_op, rados_ioctx_t io, rados_completion_t completion, const char *oid, int flags)
     void rados_read_op_set_flags(rados_read_op_t read_op, int flags)
+    void rados_read_op_read(rados_read_op_t read_op, uint64_t offset, size_t len, char *buf, size_t *bytes_read, int *prval)
     int rados_omap_get_next(rados_omap_iter_t iter, const char * const* key, const char * const* val, size_t * len)
     void rados_omap_get_end(rados_omap_iter_t iter)
 
@@ -440,44 +489,66 @@ def opt(cls):
     return (cls, None)
 
 
+cdef validate_args(tuple checks, tuple args, dict kwargs):
+    cdef Py_ssize_t i, nargs = len(args) - 1
+
+    # ignore the `self` arg
+    for i in range(len(checks)):
+        arg_name, arg_types, allow_none, msg = checks[i]
+        if i < nargs:
+            val = args[i + 1]
+        elif kwargs and arg_name in kwargs:
+            val = kwargs[arg_name]
+        else:
+            continue
+        if not (isinstance(val, arg_types) or (allow_none and val is None)):
+            raise TypeError(msg)
+
+
 # validate argument types of an instance method
 # kwargs is an un-ordered dict, so use args instead
 def requires(*types):
-    def is_type_of(v, t):
-        if t is None:
-            return v is None
-        else:
-            return isinstance(v, t)
-
-    def check_type(val, arg_name, arg_type):
+    # build the checks once, so that each call only pays for isinstance()
+    checks = []
+    for arg_name, arg_type in types:
         if isinstance(arg_type, tuple):
-            if any(is_type_of(val, t) for t in arg_type):
-                return
             type_names = ' or '.join('None' if t is None else t.__name__
                                      for t in arg_type)
-            raise TypeError('%s must be %s' % (arg_name, type_names))
+            arg_types = tuple(t for t in arg_type if t is not None)
+            allow_none = None in arg_type
         else:
-            if is_type_of(val, arg_type):
-                return
             assert(arg_type is not None)
-            raise TypeError('%s must be %s' % (arg_name, arg_type.__name__))
+            type_names = arg_type.__name__
+            arg_types = arg_type
+            allow_none = False
+        checks.append((arg_name, arg_types, allow_none,
+                       '%s must be %s' % (arg_name, type_names)))
+    checks = tuple(checks)
 
     def wrapper(f):
         # FIXME(sileht): this stop with
         # AttributeError: 'method_descriptor' object has no attribute '__module__'
         # @wraps(f)
         def validate_func(*args, **kwargs):
-            # ignore the `self` arg
-            pos_args = zip(args[1:], types)
-            named_args = ((kwargs[name], (name, spec)) for name, spec in types
-                          if name in kwargs)
-            for arg_val, (arg_name, arg_type) in chain(pos_args, named_args):
-                check_type(arg_val, arg_name, arg_type)
+            validate_args(checks, args, kwargs)
             return f(*args, **kwargs)
         return validate_func
     return wrapper
 
 
+cdef inline validate_arg(val, name, arg_type, bint allow_none=False):
+    """
+    Inline equivalent of ``requires((name, arg_type))``, or of
+    ``requires((name, opt(arg_type)))`` with allow_none, for the hot methods
+    which do not go through the generic wrapper
+    """
+    if allow_none and val is None:
+        return
+    if not isinstance(val, arg_type):
+        raise TypeError('%s must be %s%s' % (name, arg_type.__name__,
+                                             ' or None' if allow_none else ''))
+
+
 def cstr(val, name, encoding="utf-8", opt=False):
     """
     Create a byte string from a Python string
@@ -548,6 +619,35 @@ cdef char ** to_bytes_array(list_bytes):
 
 
 
+cdef Py_buffer * get_buffer_views(list buffers, int flags) except NULL:
+    """
+    Acquire a buffer view on each object of a list
+
+    The returned array must be released with release_buffer_views().
+    """
+    cdef:
+        size_t i
+        size_t num = len(buffers)
+        Py_buffer *views = <Py_buffer *>calloc(num if num else 1,
+                                               sizeof(Py_buffer))
+    if views == NULL:
+        raise MemoryError("calloc failed")
+    try:
+        for i in xrange(num):
+            PyObject_GetBuffer(buffers[i], &views[i], flags)
+    except:
+        release_buffer_views(views, num)
+        raise
+    return views
+
+
+cdef void release_buffer_views(Py_buffer *views, size_t num):
+    cdef size_t i
+    for i in xrange(num):
+        PyBuffer_Release(&views[i])
+    free(views)
+
+
 cdef int __monitor_callback(void *arg, const char *line, const char *who,
                              uint64_t sec, uint64_t nsec, uint64_t seq,
                              const char *level, const char *msg) with gil:
@@ -1161,6 +1261,7 @@ Rados object in state %s." % self.state)
             raise make_ex(ret, "error opening pool '%s'" % ioctx_name)
         io = Ioctx(ioctx_name)
         io.io = ioctx
+        io.rados = self
         return io
 
     def mon_command(self, cmd, inbuf, timeout=0, target=None):
@@ -1443,6 +1544,143 @@ cdef class OmapIterator(object):
             rados_omap_get_end(self.ctx)
 
 
+cdef class OmapPageIterator(object):
+    """
+    Paged iterator over the key/value pairs of an object's omap
+
+    Each iteration returns the next page as a list of ``(key, value)``
+    pairs. Pages are requested with ``start_after`` set to the last key of
+    the previous page, and when ``prefetch`` is set the request for the
+    next page is already in flight while the current one is consumed.
+    """
+
+    cdef public Ioctx ioctx
+    cdef public object oid
+    cdef object start_after
+    cdef object filter_prefix
+    cdef uint64_t page_size
+    cdef bint prefetch
+    cdef bint has_more
+
+    cdef rados_read_op_t read_op
+    cdef rados_completion_t completion
+    cdef rados_omap_iter_t omap_iter
+    cdef unsigned char more
+    cdef int prval
+
+    def __cinit__(self, Ioctx ioctx, oid, start_after, filter_prefix,
+                  page_size, prefetch):
+        self.ioctx = ioctx
+        self.oid = cstr(oid, 'oid')
+        self.start_after = cstr(start_after, 'start_after') if start_after else None
+        self.filter_prefix = cstr(filter_prefix, 'filter_prefix') if filter_prefix else None
+        if page_size < 1:
+            raise Error("OmapPageIterator(): page_size must be positive")
+        self.page_size = page_size
+        self.prefetch = prefetch
+        self.has_more = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        Get the next page of key/value pairs in the object
+
+        :raises: StopIteration
+        :returns: list - of (key, value) pairs
+        """
+        if self.completion == NULL:
+            if not self.has_more:
+                raise StopIteration()
+            self.submit()
+        page = self.reap()
+        if not page:
+            # only the last page can be empty, when there is nothing left
+            raise StopIteration()
+        if self.has_more and self.prefetch:
+            self.submit()
+        return page
+
+    cdef submit(self):
+        cdef:
+            rados_ioctx_t _io = self.ioctx.io
+            char *_oid = self.oid
+            char *_start_after = opt_str(self.start_after)
+            char *_filter_prefix = opt_str(self.filter_prefix)
+            int ret
+
+        with nogil:
+            ret = rados_aio_create_completion(NULL, NULL, NULL, &self.completion)
+        if ret < 0:
+            self.completion = NULL
+            raise make_ex(ret, "error getting a completion")
+        with nogil:
+            self.read_op = rados_create_read_op()
+            rados_read_op_omap_get_vals2(self.read_op, _start_after,
+                                         _filter_prefix, self.page_size,
+                                         &self.omap_iter, &self.more,
+                                         &self.prval)
+            ret = rados_aio_read_op_operate(self.read_op, _io, self.completion,
+                                            _oid, 0)
+        if ret < 0:
+            self.release()
+            raise make_ex(ret, "Failed to read omap of %s" % self.oid)
+
+    cdef list reap(self):
+        cdef:
+            char *key_ = NULL
+            char *val_ = NULL
+            size_t len_
+            list page = []
+
+        with nogil:
+            rados_aio_wait_for_complete(self.completion)
+            ret = rados_aio_get_return_value(self.completion)
+        if ret >= 0:
+            ret = self.prval
+        self.release()
+        if ret < 0:
+            self.has_more = False
+            raise make_ex(ret, "Failed to read omap of %s" % self.oid)
+
+        # decode the whole page at once rather than one pair per call
+        last = None
+        while True:
+            ret = rados_omap_get_next(self.omap_iter, &key_, &val_, &len_)
+            if ret != 0:
+                raise make_ex(ret, "error iterating over the omap")
+            if key_ == NULL:
+                break
+            last = <bytes>key_
+            page.append((decode_cstr(last), val_[:len_] if val_ != NULL else None))
+        rados_omap_get_end(self.omap_iter)
+        self.omap_iter = NULL
+
+        self.has_more = bool(self.more) and last is not None
+        if last is not None:
+            self.start_after = last
+        return page
+
+    cdef release(self):
+        # wait for an in-flight request before freeing what it writes to
+        if self.completion != NULL:
+            with nogil:
+                rados_aio_wait_for_complete(self.completion)
+                rados_aio_release(self.completion)
+            self.completion = NULL
+        if self.read_op != NULL:
+            with nogil:
+                rados_release_read_op(self.read_op)
+            self.read_op = NULL
+
+    def __dealloc__(self):
+        self.release()
+        if self.omap_iter != NULL:
+            with nogil:
+                rados_omap_get_end(self.omap_iter)
+
+
 cdef class ObjectIterator(object):
     """rados.Ioctx Object iterator"""
 
@@ -1490,6 +1728,120 @@ cdef class ObjectIterator(object):
             rados_nobjects_list_close(self.ctx)
 
 
+cdef class ObjectRangeIterator(object):
+    """
+    rados.Ioctx Object iterator over one shard of the pool
+
+    The hash space of the pool is split into ``num_shards`` contiguous
+    ranges and only the objects falling into range ``shard`` are listed.
+    Objects are fetched ``batch_size`` at a time.  Iterators over distinct
+    shards of the same pool may be driven concurrently.
+    """
+
+    cdef rados_ioctx_t io
+    cdef rados_object_list_cursor cursor
+    cdef rados_object_list_cursor finish
+    cdef rados_object_list_cursor next_cursor
+    cdef rados_object_list_item *items
+    cdef size_t batch_size
+    cdef size_t num_items
+    cdef size_t pos
+
+    cdef public object ioctx
+
+    def __cinit__(self, Ioctx ioctx, size_t shard, size_t num_shards,
+                  size_t batch_size):
+        if num_shards == 0 or shard >= num_shards:
+            raise Error("ObjectRangeIterator(): shard %d out of range for "
+                        "%d shards" % (shard, num_shards))
+        if batch_size == 0:
+            raise Error("ObjectRangeIterator(): batch_size must be positive")
+
+        self.ioctx = ioctx
+        self.io = ioctx.io
+        self.batch_size = batch_size
+        self.items = <rados_object_list_item *>calloc(
+            batch_size, sizeof(rados_object_list_item))
+        if self.items == NULL:
+            raise MemoryError("calloc failed")
+
+        cdef:
+            rados_object_list_cursor begin
+            rados_object_list_cursor end
+
+        with nogil:
+            begin = rados_object_list_begin(self.io)
+            end = rados_object_list_end(self.io)
+            self.cursor = rados_object_list_begin(self.io)
+            self.finish = rados_object_list_begin(self.io)
+            self.next_cursor = rados_object_list_begin(self.io)
+            rados_object_list_slice(self.io, begin, end, shard, num_shards,
+                                    &self.cursor, &self.finish)
+            rados_object_list_cursor_free(self.io, begin)
+            rados_object_list_cursor_free(self.io, end)
+
+    def __iter__(self):
+        return self
+
+    cdef fetch(self):
+        cdef:
+            rados_object_list_cursor tmp
+            int ret
+
+        rados_object_list_free(self.num_items, self.items)
+        self.num_items = self.pos = 0
+        if (rados_object_list_is_end(self.io, self.cursor) or
+                rados_object_list_cursor_cmp(self.io, self.cursor,
+                                             self.finish) >= 0):
+            raise StopIteration()
+
+        with nogil:
+            ret = rados_object_list(self.io, self.cursor, self.finish,
+                                    self.batch_size, NULL, 0, self.items,
+                                    &self.next_cursor)
+        if ret < 0:
+            raise make_ex(ret, "error iterating over the objects in ioctx '%s'"
+                          % self.ioctx.name)
+        self.num_items = ret
+        tmp = self.cursor
+        self.cursor = self.next_cursor
+        self.next_cursor = tmp
+
+    def __next__(self):
+        """
+        Get the next object in the shard
+
+        :raises: StopIteration
+        :returns: next rados.Ioctx Object
+        """
+        cdef rados_object_list_item *item
+
+        while self.pos == self.num_items:
+            self.fetch()
+
+        item = &self.items[self.pos]
+        self.pos += 1
+        key = decode_cstr(item.oid[:item.oid_length])
+        locator = None
+        if item.locator_length > 0:
+            locator = decode_cstr(item.locator[:item.locator_length])
+        nspace = None
+        if item.nspace_length > 0:
+            nspace = decode_cstr(item.nspace[:item.nspace_length])
+        return Object(self.ioctx, key, locator, nspace)
+
+    def __dealloc__(self):
+        if self.items != NULL:
+            rados_object_list_free(self.num_items, self.items)
+            free(self.items)
+        if self.cursor != NULL:
+            rados_object_list_cursor_free(self.io, self.cursor)
+        if self.finish != NULL:
+            rados_object_list_cursor_free(self.io, self.finish)
+        if self.next_cursor != NULL:
+            rados_object_list_cursor_free(self.io, self.next_cursor)
+
+
 cdef class XattrIterator(object):
     """Extended attribute iterator"""
 
@@ -1641,6 +1993,7 @@ cdef class Snap(object):
         return datetime.fromtimestamp(snap_time)
 
 
+@cython.freelist(128)
 cdef class Completion(object):
     """completion object"""
 
@@ -1654,6 +2007,7 @@ cdef class Completion(object):
          rados_callback_t safe_cb
          rados_completion_t rados_comp
          PyObject* buf
+         Py_buffer buf_view
 
     def __cinit__(self, Ioctx ioctx, object oncomplete, object onsafe):
         self.oncomplete = oncomplete
@@ -1743,29 +2097,29 @@ cdef class Completion(object):
         """
         ref.Py_XDECREF(self.buf)
         self.buf = NULL
+        PyBuffer_Release(&self.buf_view)
         if self.rados_comp != NULL:
             with nogil:
                 rados_aio_release(self.rados_comp)
                 self.rados_comp = NULL
 
     def _complete(self):
-        self.oncomplete(self)
-        with self.ioctx.lock:
-            if self.oncomplete:
-                self.ioctx.complete_completions.remove(self)
+        try:
+            self.oncomplete(self)
+        finally:
+            ref.Py_DECREF(self)
 
     def _safe(self):
-        self.onsafe(self)
-        with self.ioctx.lock:
-            if self.onsafe:
-                self.ioctx.safe_completions.remove(self)
+        try:
+            self.onsafe(self)
+        finally:
+            ref.Py_DECREF(self)
 
     def _cleanup(self):
-        with self.ioctx.lock:
-            if self.oncomplete:
-                self.ioctx.complete_completions.remove(self)
-            if self.onsafe:
-                self.ioctx.safe_completions.remove(self)
+        if self.oncomplete:
+            ref.Py_DECREF(self)
+        if self.onsafe:
+            ref.Py_DECREF(self)
 
 
 class OpCtx(object):
@@ -1870,6 +2224,35 @@ cdef class WriteOp(object):
         with nogil:
             rados_write_op_write(self.write_op, _to_write, length, _offset)
 
+    @requires(('offset', int))
+    def writev(self, buffers, offset=0):
+        """
+        Write a sequence of buffers back to back starting at offset.
+
+        Each buffer may be any object supporting the buffer protocol; they
+        are added to the operation without being joined first.
+        :param buffers: data to write
+        :type buffers: sequence of bytes-like objects
+        :param offset: byte offset in the object to begin writing at
+        :type offset: int
+        """
+
+        buffers = list(buffers)
+        cdef:
+            uint64_t _offset = offset
+            size_t i
+            size_t num = len(buffers)
+            Py_buffer *views = get_buffer_views(buffers, PyBUF_SIMPLE)
+
+        try:
+            with nogil:
+                for i in xrange(num):
+                    rados_write_op_write(self.write_op, <const char *>views[i].buf,
+                                         views[i].len, _offset)
+                    _offset += views[i].len
+        finally:
+            release_buffer_views(views, num)
+
     @requires(('offset', int), ('length', int))
     def zero(self, offset, length):
         """
@@ -1955,6 +2338,209 @@ cdef int __aio_complete_cb(rados_completion_t completion, void *args) with gil:
     return 0
 
 
+cdef void __watch_notify_cb(void *arg, uint64_t notify_id, uint64_t cookie,
+                            uint64_t notifier_id, void *data,
+                            size_t data_len) with gil:
+    """
+    Callback queueing a notify received on a watched object
+    """
+    cdef Watch watch = <object>arg
+    watch.deliver((notify_id, notifier_id, (<char *>data)[:data_len], 0))
+
+
+cdef void __watch_error_cb(void *arg, uint64_t cookie, int err) with gil:
+    """
+    Callback queueing an error of the watch session
+    """
+    cdef Watch watch = <object>arg
+    watch.deliver((None, None, None, err))
+
+
+cdef class Watch(object):
+    """
+    Watch on a rados object
+
+    librados invokes watch callbacks from its own finisher thread, so
+    notifies and errors are only queued there and the user callbacks run
+    on a dedicated dispatcher thread, or on ``loop`` if an asyncio event
+    loop is given.  A slow callback thus never stalls librados.
+
+    ``callback(notify_id, notifier_id, watch_id, data)`` is called for
+    every notify; its return value, if any, is sent back to the notifier
+    as the acknowledgement payload.  ``error_callback(watch_id, error)``
+    is called when the watch session fails, after which the watch should
+    be closed and, if still needed, registered again.
+
+    Use :meth:`Ioctx.watch` or :meth:`Ioctx.aio_watch` to create one.
+    """
+
+    cdef:
+        uint64_t cookie
+        object events
+        object dispatcher
+
+    cdef public:
+        Ioctx ioctx
+        object oid
+        object callback
+        object error_callback
+        object loop
+        object state
+
+    def __init__(self, Ioctx ioctx, oid, callback, error_callback=None,
+                 loop=None):
+        self.ioctx = ioctx
+        self.oid = cstr(oid, 'oid')
+        self.callback = callback
+        self.error_callback = error_callback
+        self.loop = loop
+        self.state = "new"
+        if loop is None:
+            self.events = queue.Queue()
+            self.dispatcher = threading.Thread(target=self.__dispatch_events)
+            self.dispatcher.daemon = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.close()
+        return False
+
+    @property
+    def id(self):
+        """The watch handle, also passed as ``watch_id`` to callbacks"""
+        return self.cookie
+
+    cdef register(self, Completion completion, timeout):
+        cdef:
+            char *_oid = self.oid
+            uint32_t _timeout = timeout if timeout is not None else 0
+            void *_arg = <void *>self
+            rados_completion_t _comp = NULL
+            int ret
+
+        if completion is not None:
+            _comp = completion.rados_comp
+        if self.dispatcher is not None:
+            self.dispatcher.start()
+        self.ioctx.watches[id(self)] = self
+        with nogil:
+            if _comp != NULL:
+                ret = rados_aio_watch2(self.ioctx.io, _oid, _comp,
+                                       &self.cookie, &__watch_notify_cb,
+                                       &__watch_error_cb, _timeout, _arg)
+            else:
+                ret = rados_watch3(self.ioctx.io, _oid, &self.cookie,
+                                   &__watch_notify_cb, &__watch_error_cb,
+                                   _timeout, _arg)
+        if ret < 0:
+            self.release()
+            raise make_ex(ret, "Failed to watch %s" % self.oid)
+        self.state = "open"
+
+    cdef release(self):
+        self.state = "closed"
+        self.ioctx.watches.pop(id(self), None)
+        if self.dispatcher is not None and self.dispatcher.is_alive():
+            self.events.put(None)
+            if self.dispatcher is not threading.current_thread():
+                self.dispatcher.join()
+
+    cdef deliver(self, event):
+        if self.loop is None:
+            self.events.put(event)
+            return
+        _call_soon_threadsafe(self.loop, self.__dispatch, event)
+
+    def __dispatch_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            try:
+                self.__dispatch(event)
+            except Exception:
+                traceback.print_exc()
+
+    def __dispatch(self, event):
+        notify_id, notifier_id, data, err = event
+        if self.state == "closed":
+            return
+        if err:
+            if self.error_callback is not None:
+                self.error_callback(self.cookie,
+                                    make_ex(err, "watch %s failed" % self.oid))
+            return
+
+        try:
+            reply = self.callback(notify_id, notifier_id, self.cookie, data)
+            reply = cstr(reply, 'reply', opt=True)
+        except:
+            # the notifier still gets an answer, while the error is
+            # reported by whoever dispatched the event
+            self.ack(notify_id)
+            raise
+        self.ack(notify_id, reply)
+
+    def ack(self, notify_id, reply=None):
+        """
+        Acknowledge a notify, optionally sending a payload to the notifier
+
+        This is done automatically once the callback returns.
+
+        :param notify_id: the notify being acknowledged
+        :type notify_id: int
+        :param reply: payload returned to the notifier
+        :type reply: bytes
+        """
+        if self.state != "open":
+            return
+        reply = cstr(reply, 'reply', opt=True) or b''
+        cdef:
+            char *_oid = self.oid
+            uint64_t _notify_id = notify_id
+            char *_reply = reply
+            int _reply_len = len(reply)
+
+        with nogil:
+            rados_notify_ack(self.ioctx.io, _oid, _notify_id, self.cookie,
+                             _reply, _reply_len)
+
+    def check(self):
+        """
+        Check on the status of the watch
+
+        :raises: :class:`Error` if the watch session failed
+        :returns: int - milliseconds since the watch was last confirmed
+        """
+        if self.state != "open":
+            raise LogicError("watch %s is %s" % (self.oid, self.state))
+        with nogil:
+            ret = rados_watch_check(self.ioctx.io, self.cookie)
+        if ret < 0:
+            raise make_ex(ret, "watch %s failed" % self.oid)
+        return ret
+
+    def close(self):
+        """
+        Unregister the watch
+
+        Returns once no more callbacks are pending for it.
+
+        :raises: :class:`Error`
+        """
+        if self.state != "open":
+            return
+        self.state = "closing"
+        with nogil:
+            ret = rados_unwatch2(self.ioctx.io, self.cookie)
+            rados_watch_flush(rados_ioctx_get_cluster(self.ioctx.io))
+        self.release()
+        if ret < 0 and ret != -errno.ENOTCONN:
+            raise make_ex(ret, "Failed to unwatch %s" % self.oid)
+
+
 cdef class Ioctx(object):
     """rados.Ioctx object"""
     # NOTE(sileht): attributes declared in .pyd
@@ -1965,9 +2551,7 @@ cdef class Ioctx(object):
 
         self.locator_key = ""
         self.nspace = ""
-        self.lock = threading.Lock()
-        self.safe_completions = []
-        self.complete_completions = []
+        self.watches = {}
 
     def __enter__(self):
         return self
@@ -1980,12 +2564,14 @@ cdef class Ioctx(object):
         self.close()
 
     def __track_completion(self, completion_obj):
+        # librados only holds a borrowed pointer to the completion: take a
+        # reference for each callback it will invoke, dropped by
+        # Completion._complete/_safe, or by Completion._cleanup if the
+        # operation could not be submitted
         if completion_obj.oncomplete:
-            with self.lock:
-                self.complete_completions.append(completion_obj)
+            ref.Py_INCREF(completion_obj)
         if completion_obj.onsafe:
-            with self.lock:
-                self.safe_completions.append(completion_obj)
+            ref.Py_INCREF(completion_obj)
 
     def __get_completion(self, oncomplete, onsafe):
         """
@@ -2024,7 +2610,6 @@ cdef class Ioctx(object):
         completion_obj.rados_comp = completion
         return completion_obj
 
-    @requires(('object_name', str_type), ('oncomplete', opt(Callable)))
     def aio_stat(self, object_name, oncomplete):
         """
         Asynchronously get object stats (size/mtime)
@@ -2043,6 +2628,8 @@ cdef class Ioctx(object):
         :returns: completion object
         """
 
+        validate_arg(object_name, 'object_name', str_type)
+        validate_arg(oncomplete, 'oncomplete', Callable, True)
         object_name = cstr(object_name, 'object_name')
 
         cdef:
@@ -2251,7 +2838,7 @@ cdef class Ioctx(object):
         def oncomplete_(completion_v):
             cdef Completion _completion_v = completion_v
             return_value = _completion_v.get_return_value()
-            if return_value > 0 and return_value != length:
+            if return_value >= 0 and return_value != length:
                 _PyBytes_Resize(&_completion_v.buf, return_value)
             return oncomplete(_completion_v, <object>_completion_v.buf if return_value >= 0 else None)
 
@@ -2267,6 +2854,59 @@ cdef class Ioctx(object):
             raise make_ex(ret, "error reading %s" % object_name)
         return completion
 
+    @requires(('object_name', str_type), ('offset', int), ('oncomplete', opt(Callable)))
+    def aio_readinto(self, object_name, buf, offset, oncomplete):
+        """
+        Asychronously read data from an object into a caller-supplied buffer
+
+        Up to ``len(buf)`` bytes are read directly into ``buf``, which may
+        be any writable, contiguous object supporting the buffer protocol
+        (bytearray, memoryview, mmap, ...). ``buf`` must not be resized or
+        released until the read completes.
+
+        oncomplete will be called with the number of bytes read as
+        well as the completion:
+
+        oncomplete(completion, bytes_read)
+
+        :param object_name: name of the object to read from
+        :type object_name: str
+        :param buf: writable buffer to read into
+        :type buf: bytearray, memoryview or other writable buffer
+        :param offset: byte offset in the object to begin reading from
+        :type offset: int
+        :param oncomplete: what to do when the read is complete
+        :type oncomplete: completion
+
+        :raises: :class:`Error`
+        :returns: completion object
+        """
+
+        object_name = cstr(object_name, 'object_name')
+
+        cdef:
+            Completion completion
+            char* _object_name = object_name
+            uint64_t _offset = offset
+
+        def oncomplete_(completion_v):
+            cdef Completion _completion_v = completion_v
+            return_value = _completion_v.get_return_value()
+            PyBuffer_Release(&_completion_v.buf_view)
+            return oncomplete(_completion_v, return_value if return_value >= 0 else None)
+
+        completion = self.__get_completion(oncomplete_, None)
+        PyObject_GetBuffer(buf, &completion.buf_view, PyBUF_WRITABLE)
+        self.__track_completion(completion)
+        with nogil:
+            ret = rados_aio_read(self.io, _object_name, completion.rados_comp,
+                                 <char *>completion.buf_view.buf,
+                                 completion.buf_view.len, _offset)
+        if ret < 0:
+            completion._cleanup()
+            raise make_ex(ret, "error reading %s" % object_name)
+        return completion
+
     @requires(('object_name', str_type), ('cls', str_type), ('method', str_type),
               ('data', bytes), ('length', int),
               ('oncomplete', opt(Callable)), ('onsafe', opt(Callable)))
@@ -2338,7 +2978,6 @@ cdef class Ioctx(object):
             raise make_ex(ret, "error executing %s::%s on %s" % (cls, method, object_name))
         return completion
 
-    @requires(('object_name', str_type), ('oncomplete', opt(Callable)), ('onsafe', opt(Callable)))
     def aio_remove(self, object_name, oncomplete=None, onsafe=None):
         """
         Asychronously remove an object
@@ -2355,6 +2994,9 @@ cdef class Ioctx(object):
         :raises: :class:`Error`
         :returns: completion object
         """
+        validate_arg(object_name, 'object_name', str_type)
+        validate_arg(oncomplete, 'oncomplete', Callable, True)
+        validate_arg(onsafe, 'onsafe', Callable, True)
         object_name = cstr(object_name, 'object_name')
 
         cdef:
@@ -2371,21 +3013,526 @@ cdef class Ioctx(object):
             raise make_ex(ret, "error removing %s" % object_name)
         return completion
 
-    def require_ioctx_open(self):
+    @requires(('object_name', str_type), ('xattr_name', str_type),
+              ('oncomplete', opt(Callable)), ('length', int))
+    def aio_get_xattr(self, object_name, xattr_name, oncomplete, length=4096):
         """
-        Checks if the rados.Ioctx object state is 'open'
+        Asynchronously get the value of an extended attribute on an object
 
-        :raises: IoctxStateError
-        """
-        if self.state != "open":
-            raise IoctxStateError("The pool is %s" % self.state)
+        oncomplete will be called with the value of the xattr as well as
+        the completion:
 
-    def change_auid(self, auid):
-        """
-        Attempt to change an io context's associated auid "owner."
+        oncomplete(completion, xattr_value)
 
-        Requires that you have write permission on both the current and new
-        auid.
+        :param object_name: name of the object
+        :type object_name: str
+        :param xattr_name: which extended attribute to read
+        :type xattr_name: str
+        :param oncomplete: what to do when the getxattr is complete
+        :type oncomplete: completion
+        :param length: size of the value buffer in bytes (default=4096)
+        :type length: int
+
+        :raises: :class:`Error`
+        :returns: completion object
+        """
+
+        object_name = cstr(object_name, 'object_name')
+        xattr_name = cstr(xattr_name, 'xattr_name')
+
+        cdef:
+            Completion completion
+            char *_object_name = object_name
+            char *_xattr_name = xattr_name
+            size_t _length = length
+
+        def oncomplete_(completion_v):
+            cdef Completion _completion_v = completion_v
+            return_value = _completion_v.get_return_value()
+            if return_value >= 0 and return_value != length:
+                _PyBytes_Resize(&_completion_v.buf, return_value)
+            return oncomplete(_completion_v, <object>_completion_v.buf if return_value >= 0 else None)
+
+        completion = self.__get_completion(oncomplete_, None)
+        completion.buf = PyBytes_FromStringAndSize(NULL, length)
+        ret_buf = PyBytes_AsString(completion.buf)
+        self.__track_completion(completion)
+        with nogil:
+            ret = rados_aio_getxattr(self.io, _object_name,
+                                     completion.rados_comp, _xattr_name,
+                                     ret_buf, _length)
+        if ret < 0:
+            completion._cleanup()
+            raise make_ex(ret, "Failed to get xattr %r" % xattr_name)
+        return completion
+
+    def watch(self, obj, callback, error_callback=None, timeout=None,
+              loop=None):
+        """
+        Register an interest in an object
+
+        ``callback(notify_id, notifier_id, watch_id, data)`` is called for
+        every notify sent to the object, and its return value is sent back
+        to the notifier.  Callbacks run on a dispatcher thread owned by the
+        watch, or on ``loop`` if an asyncio event loop is given.
+
+        :param obj: name of the object to watch
+        :type obj: str
+        :param callback: what to do when a notify is received
+        :type callback: callable
+        :param error_callback: what to do when the watch session fails
+        :type error_callback: callable
+        :param timeout: seconds after which the OSDs drop the watch of a
+                        disconnected client (default: OSD setting)
+        :type timeout: int
+        :param loop: event loop to run the callbacks on
+        :type loop: :class:`asyncio.AbstractEventLoop`
+
+        :raises: :class:`Error`
+        :returns: :class:`Watch`
+        """
+        self.require_ioctx_open()
+        cdef Watch watch = Watch(self, obj, callback, error_callback, loop)
+        watch.register(None, timeout)
+        return watch
+
+    def aio_watch(self, obj, callback, error_callback=None, timeout=None,
+                  loop=None, oncomplete=None):
+        """
+        Asynchronously register an interest in an object
+
+        oncomplete will be called with the watch as well as the completion:
+
+        oncomplete(completion, watch)
+
+        If registration failed, as reported by the return value of the
+        completion, the watch is already closed.
+
+        :param obj: name of the object to watch
+        :type obj: str
+        :param callback: what to do when a notify is received
+        :type callback: callable
+        :param error_callback: what to do when the watch session fails
+        :type error_callback: callable
+        :param timeout: seconds after which the OSDs drop the watch of a
+                        disconnected client (default: OSD setting)
+        :type timeout: int
+        :param loop: event loop to run the callbacks on
+        :type loop: :class:`asyncio.AbstractEventLoop`
+        :param oncomplete: what to do when the watch is registered
+        :type oncomplete: completion
+
+        :raises: :class:`Error`
+        :returns: completion object
+        """
+        self.require_ioctx_open()
+        cdef:
+            Completion completion
+            Watch watch = Watch(self, obj, callback, error_callback, loop)
+
+        def oncomplete_(completion_v):
+            cdef Completion _completion_v = completion_v
+            if _completion_v.get_return_value() < 0:
+                # librados has already torn the failed watch down
+                watch.release()
+            if oncomplete:
+                return oncomplete(_completion_v, watch)
+
+        completion = self.__get_completion(oncomplete_, None)
+        self.__track_completion(completion)
+        try:
+            watch.register(completion, timeout)
+        except Error:
+            completion._cleanup()
+            raise
+        return completion
+
+    def notify(self, obj, msg=b'', timeout_ms=5000):
+        """
+        Send a notify to the watchers of an object and wait for them to
+        acknowledge it
+
+        :param obj: name of the object to notify
+        :type obj: str
+        :param msg: payload sent to the watchers
+        :type msg: bytes
+        :param timeout_ms: how long to wait for acknowledgements (ms)
+        :type timeout_ms: int
+
+        :raises: :class:`TimedOut` if some watchers did not acknowledge
+        :returns: True on success
+        """
+        self.require_ioctx_open()
+        obj = cstr(obj, 'obj')
+        msg = cstr(msg, 'msg')
+        cdef:
+            char *_obj = obj
+            char *_msg = msg
+            int _msglen = len(msg)
+            uint64_t _timeout_ms = timeout_ms
+
+        with nogil:
+            ret = rados_notify2(self.io, _obj, _msg, _msglen, _timeout_ms,
+                                NULL, NULL)
+        if ret < 0:
+            raise make_ex(ret, "Failed to notify %r" % obj)
+        return True
+
+    def aio_notify(self, obj, msg=b'', timeout_ms=5000, oncomplete=None):
+        """
+        Asynchronously send a notify to the watchers of an object
+
+        oncomplete(completion) is called once all watchers acknowledged
+        the notify or the timeout expired, in which case the return value
+        of the completion is -ETIMEDOUT.
+
+        :param obj: name of the object to notify
+        :type obj: str
+        :param msg: payload sent to the watchers
+        :type msg: bytes
+        :param timeout_ms: how long to wait for acknowledgements (ms)
+        :type timeout_ms: int
+        :param oncomplete: what to do when the notify is complete
+        :type oncomplete: completion
+
+        :raises: :class:`Error`
+        :returns: completion object
+        """
+        self.require_ioctx_open()
+        obj = cstr(obj, 'obj')
+        msg = cstr(msg, 'msg')
+        cdef:
+            Completion completion
+            char *_obj = obj
+            char *_msg = msg
+            int _msglen = len(msg)
+            uint64_t _timeout_ms = timeout_ms
+
+        completion = self.__get_completion(oncomplete, None)
+        self.__track_completion(completion)
+        with nogil:
+            ret = rados_aio_notify(self.io, _obj, completion.rados_comp,
+                                   _msg, _msglen, _timeout_ms, NULL, NULL)
+        if ret < 0:
+            completion._cleanup()
+            raise make_ex(ret, "Failed to notify %r" % obj)
+        return completion
+
+    def __aio_write_buffer(self, object_name, buf, offset, oncomplete):
+        """
+        Like aio_write(), but writes straight from any contiguous object
+        supporting the buffer protocol, calling oncomplete(completion)
+        once the buffer is no longer needed
+        """
+        object_name = cstr(object_name, 'object_name')
+
+        cdef:
+            Completion completion
+            char* _object_name = object_name
+            uint64_t _offset = offset
+
+        def oncomplete_(completion_v):
+            cdef Completion _completion_v = completion_v
+            PyBuffer_Release(&_completion_v.buf_view)
+            return oncomplete(_completion_v)
+
+        completion = self.__get_completion(oncomplete_, None)
+        PyObject_GetBuffer(buf, &completion.buf_view, PyBUF_SIMPLE)
+        self.__track_completion(completion)
+        with nogil:
+            ret = rados_aio_write(self.io, _object_name, completion.rados_comp,
+                                  <const char *>completion.buf_view.buf,
+                                  completion.buf_view.len, _offset)
+        if ret < 0:
+            completion._cleanup()
+            raise make_ex(ret, "error writing object %s" % object_name)
+        return completion
+
+    def upload_file(self, oid, path, chunk_size=4 * 1024 * 1024, parallel=8):
+        """
+        Write the contents of a local file to an object
+
+        The file is read with readinto() in ``chunk_size`` pieces into a
+        fixed set of ``parallel`` buffers, and every chunk is written with
+        an asynchronous write as soon as it is read, so up to ``parallel``
+        chunks are in flight and memory use does not depend on the size of
+        the file.  The object is truncated first: until the upload
+        completes, readers may see it partially written.
+
+        :param oid: name of the object
+        :type oid: str
+        :param path: path of the local file to read
+        :type path: str
+        :param chunk_size: size of each write in bytes
+        :type chunk_size: int
+        :param parallel: maximum number of writes in flight
+        :type parallel: int
+
+        :raises: :class:`Error`
+        :returns: int - number of bytes written
+        """
+        self.require_ioctx_open()
+        if chunk_size <= 0 or parallel <= 0:
+            raise Error("Ioctx.upload_file(%s): chunk_size and parallel must "
+                        "be positive" % self.name)
+
+        idle = [bytearray(chunk_size) for _ in range(parallel)]
+        done = queue.Queue()
+        in_flight = 0
+        offset = 0
+        eof = False
+        error = None
+
+        def oncomplete(buf):
+            return lambda completion: done.put(
+                (buf, completion.get_return_value()))
+
+        with open(path, 'rb') as f:
+            self.write_full(oid, b'')
+            while True:
+                while idle and not eof and error is None:
+                    buf = idle.pop()
+                    length = f.readinto(buf)
+                    if not length:
+                        idle.append(buf)
+                        eof = True
+                        break
+                    view = buf
+                    if length < chunk_size:
+                        view = memoryview(buf)[:length]
+                    try:
+                        self.__aio_write_buffer(oid, view, offset,
+                                                oncomplete(buf))
+                    except Error as e:
+                        idle.append(buf)
+                        error = e
+                        break
+                    in_flight += 1
+                    offset += length
+                if not in_flight:
+                    break
+                buf, ret = done.get()
+                in_flight -= 1
+                idle.append(buf)
+                if ret < 0 and error is None:
+                    error = make_ex(ret, "Ioctx.upload_file(%s): failed to "
+                                    "write %s" % (self.name, oid))
+        if error is not None:
+            raise error
+        return offset
+
+    def download_file(self, oid, path, chunk_size=4 * 1024 * 1024,
+                      parallel=8):
+        """
+        Copy the contents of an object to a local file
+
+        Up to ``parallel`` chunks of ``chunk_size`` bytes are read at once
+        with aio_readinto() into a fixed set of buffers, and written to the
+        file as they complete, so memory use does not depend on the size of
+        the object.  ``path`` is created or truncated.
+
+        Chunks are read until one comes back short, rather than up to the
+        size the object had when the copy started, so data appended in the
+        meantime is included and a shrunk object is copied up to its new
+        end.  The copy is not atomic with respect to other writers.
+
+        :param oid: name of the object
+        :type oid: str
+        :param path: path of the local file to write
+        :type path: str
+        :param chunk_size: size of each read in bytes
+        :type chunk_size: int
+        :param parallel: maximum number of reads in flight
+        :type parallel: int
+
+        :raises: :class:`Error`
+        :returns: int - number of bytes read
+        """
+        self.require_ioctx_open()
+        if chunk_size <= 0 or parallel <= 0:
+            raise Error("Ioctx.download_file(%s): chunk_size and parallel "
+                        "must be positive" % self.name)
+
+        idle = [bytearray(chunk_size) for _ in range(parallel)]
+        done = queue.Queue()
+        in_flight = 0
+        offset = 0
+        end = None
+        error = None
+
+        def oncomplete(buf, offset):
+            return lambda completion, length: done.put(
+                (buf, offset, completion.get_return_value()))
+
+        with open(path, 'wb') as f:
+            while True:
+                # reads past the end of the object return nothing, which
+                # is how the end is found
+                while idle and end is None and error is None:
+                    buf = idle.pop()
+                    try:
+                        self.aio_readinto(oid, buf, offset,
+                                          oncomplete(buf, offset))
+                    except Error as e:
+                        idle.append(buf)
+                        error = e
+                        break
+                    in_flight += 1
+                    offset += chunk_size
+                if not in_flight:
+                    break
+                buf, chunk_offset, ret = done.get()
+                in_flight -= 1
+                if ret < 0:
+                    if error is None:
+                        error = make_ex(ret, "Ioctx.download_file(%s): failed "
+                                        "to read %s" % (self.name, oid))
+                elif error is None:
+                    if ret > 0:
+                        f.seek(chunk_offset)
+                        f.write(buf if ret == chunk_size
+                                else memoryview(buf)[:ret])
+                    if ret < chunk_size and (end is None or
+                                             chunk_offset + ret < end):
+                        end = chunk_offset + ret
+                idle.append(buf)
+            if error is None:
+                # drop whatever was read past a shrunk object's new end
+                f.truncate(end)
+        if error is not None:
+            raise error
+        return end
+
+    def batch(self, ops, window=64):
+        """
+        Run many small operations concurrently and collect their results
+
+        Each descriptor in ``ops`` is a tuple ``(oid, op, *args)`` where
+        ``op`` names the operation and ``args`` are its arguments:
+
+        - ``('stat',)`` returns ``(size, mtime)``
+        - ``('read', length=8192, offset=0)`` returns the data read
+        - ``('get_xattr', xattr_name)`` returns the xattr value
+        - ``('write', data, offset=0)``, ``('write_full', data)`` and
+          ``('append', data)`` return 0
+        - ``('remove',)`` returns True
+        - ``('execute', cls, method, data, length=8192)`` returns the
+          method output
+
+        The operations are submitted as asynchronous requests, with at
+        most ``window`` of them in flight, so that a batch of N small
+        operations costs roughly one round-trip of wall time. Failures
+        do not abort the batch: the exception of a failed operation is
+        returned in its slot instead of a result.
+
+        :param ops: operation descriptors
+        :type ops: list of tuples
+        :param window: maximum number of operations in flight
+        :type window: int
+
+        :raises: :class:`Error` if a descriptor is malformed
+        :returns: list - a result or an :class:`Error` per descriptor,
+                  in the order of ``ops``
+        """
+        self.require_ioctx_open()
+        if window < 1:
+            raise Error("Ioctx.batch(%s): window must be positive" % self.name)
+
+        submitters = {
+            'stat': (self.aio_stat, lambda size, mtime: (size, mtime)),
+            'read': (self.aio_read, lambda data: data),
+            'get_xattr': (self.aio_get_xattr, lambda value: value),
+            'write': (self.aio_write, lambda: 0),
+            'write_full': (self.aio_write_full, lambda: 0),
+            'append': (self.aio_append, lambda: 0),
+            'remove': (self.aio_remove, lambda: True),
+            'execute': (self.aio_execute, lambda data: data),
+        }
+        defaults = {
+            'read': (8192, 0),
+            'write': (None, 0),
+            'execute': (None, None, None, 8192),
+        }
+        # (least, most) arguments each operation takes
+        arity = {
+            'stat': (0, 0),
+            'read': (0, 2),
+            'get_xattr': (1, 1),
+            'write': (1, 2),
+            'write_full': (1, 1),
+            'append': (1, 1),
+            'remove': (0, 0),
+            'execute': (3, 4),
+        }
+
+        # check every descriptor before anything is submitted
+        requests = []
+        for desc in ops:
+            if not isinstance(desc, (tuple, list)) or len(desc) < 2:
+                raise Error("Ioctx.batch(%s): malformed operation %r" %
+                            (self.name, desc))
+            oid, op = desc[0], desc[1]
+            if op not in submitters:
+                raise Error("Ioctx.batch(%s): unknown operation %r" %
+                            (self.name, op))
+            args = tuple(desc[2:])
+            least, most = arity[op]
+            if not least <= len(args) <= most:
+                raise Error("Ioctx.batch(%s): %s takes %d to %d arguments, "
+                            "not %d" % (self.name, op, least, most, len(args)))
+            default = defaults.get(op, ())
+            args = args + default[len(args):]
+            requests.append((oid, op, args))
+
+        results = [None] * len(requests)
+        slots = threading.BoundedSemaphore(window)
+
+        def make_oncomplete(index, oid, op, convert):
+            def oncomplete(completion, *result):
+                ret = completion.get_return_value()
+                if ret < 0:
+                    results[index] = make_ex(ret, "Ioctx.batch(%s): %s of %s failed"
+                                             % (self.name, op, oid))
+                else:
+                    results[index] = convert(*result)
+                slots.release()
+            return oncomplete
+
+        try:
+            for index, (oid, op, args) in enumerate(requests):
+                submit, convert = submitters[op]
+                slots.acquire()
+                try:
+                    submit(oid, *(args + (make_oncomplete(index, oid, op, convert),)))
+                except Error as e:
+                    results[index] = e
+                    slots.release()
+                except:
+                    # e.g. a TypeError for an argument; give the slot back
+                    slots.release()
+                    raise
+        finally:
+            # wait for the in-flight operations to drain, even when an
+            # argument turned out to be unusable halfway through
+            for _ in xrange(window):
+                slots.acquire()
+        return results
+
+    def require_ioctx_open(self):
+        """
+        Checks if the rados.Ioctx object state is 'open'
+
+        :raises: IoctxStateError
+        """
+        if self.state != "open":
+            raise IoctxStateError("The pool is %s" % self.state)
+
+    def change_auid(self, auid):
+        """
+        Attempt to change an io context's associated auid "owner."
+
+        Requires that you have write permission on both the current and new
+        auid.
 
         :raises: :class:`Error`
         """
@@ -2491,12 +3638,14 @@ cdef class Ioctx(object):
         """
         if self.state == "open":
             self.require_ioctx_open()
+            if self.watches:
+                for watch in list(self.watches.values()):
+                    watch.close()
             with nogil:
                 rados_ioctx_destroy(self.io)
             self.state = "closed"
 
 
-    @requires(('key', str_type), ('data', bytes))
     def write(self, key, data, offset=0):
         """
         Write data to an object synchronously
@@ -2512,6 +3661,8 @@ cdef class Ioctx(object):
         :raises: :class:`LogicError`
         :returns: int - 0 on success
         """
+        validate_arg(key, 'key', str_type)
+        validate_arg(data, 'data', bytes)
         self.require_ioctx_open()
 
         key = cstr(key, 'key')
@@ -2532,7 +3683,44 @@ cdef class Ioctx(object):
             raise LogicError("Ioctx.write(%s): rados_write \
 returned %d, but should return zero on success." % (self.name, ret))
 
-    @requires(('key', str_type), ('data', bytes))
+    @requires(('key', str_type), ('offset', int))
+    def writev(self, key, buffers, offset=0):
+        """
+        Write a sequence of buffers to an object synchronously
+
+        The buffers are written back to back starting at offset, as a
+        single operation, without being joined in Python first.
+
+        :param key: name of the object
+        :type key: str
+        :param buffers: data to write
+        :type buffers: sequence of bytes-like objects
+        :param offset: byte offset in the object to begin writing at
+        :type offset: int
+
+        :raises: :class:`TypeError`
+        :raises: :class:`Error`
+        :returns: int - 0 on success
+        """
+        self.require_ioctx_open()
+
+        key = cstr(key, 'key')
+        cdef:
+            char *_key = key
+            WriteOp write_op = WriteOp().create()
+
+        try:
+            write_op.writev(buffers, offset)
+            with nogil:
+                ret = rados_write_op_operate(write_op.write_op, self.io, _key,
+                                             NULL, 0)
+            if ret < 0:
+                raise make_ex(ret, "Ioctx.writev(%s): failed to write %s"
+                              % (self.name, key))
+            return ret
+        finally:
+            write_op.release()
+
     def write_full(self, key, data):
         """
         Write an entire object synchronously.
@@ -2549,6 +3737,8 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: int - 0 on success
         """
+        validate_arg(key, 'key', str_type)
+        validate_arg(data, 'data', bytes)
         self.require_ioctx_open()
         key = cstr(key, 'key')
         cdef:
@@ -2567,7 +3757,6 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise LogicError("Ioctx.write_full(%s): rados_write_full \
 returned %d, but should return zero on success." % (self.name, ret))
 
-    @requires(('key', str_type), ('data', bytes))
     def append(self, key, data):
         """
         Append data to an object synchronously
@@ -2581,6 +3770,8 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`LogicError`
         :returns: int - 0 on success
         """
+        validate_arg(key, 'key', str_type)
+        validate_arg(data, 'data', bytes)
         self.require_ioctx_open()
         key = cstr(key, 'key')
         cdef:
@@ -2599,7 +3790,6 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise LogicError("Ioctx.append(%s): rados_append \
 returned %d, but should return zero on success." % (self.name, ret))
 
-    @requires(('key', str_type))
     def read(self, key, length=8192, offset=0):
         """
         Read data from an object synchronously
@@ -2615,6 +3805,7 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: str - data read from object
         """
+        validate_arg(key, 'key', str_type)
         self.require_ioctx_open()
         key = cstr(key, 'key')
         cdef:
@@ -2643,6 +3834,107 @@ returned %d, but should return zero on success." % (self.name, ret))
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    @requires(('key', str_type), ('offset', int))
+    def readinto(self, key, buf, offset=0):
+        """
+        Read data from an object synchronously into a caller-supplied buffer
+
+        Up to ``len(buf)`` bytes are read directly into ``buf``, which may
+        be any writable, contiguous object supporting the buffer protocol
+        (bytearray, memoryview, mmap, ...), avoiding the allocation of a
+        new bytes object per call.
+
+        :param key: name of the object
+        :type key: str
+        :param buf: writable buffer to read into
+        :type buf: bytearray, memoryview or other writable buffer
+        :param offset: byte offset in the object to begin reading at
+        :type offset: int
+
+        :raises: :class:`TypeError`
+        :raises: :class:`Error`
+        :returns: int - number of bytes read
+        """
+        self.require_ioctx_open()
+        key = cstr(key, 'key')
+        cdef:
+            char *_key = key
+            uint64_t _offset = offset
+            Py_buffer view
+
+        PyObject_GetBuffer(buf, &view, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = rados_read(self.io, _key, <char *>view.buf, view.len,
+                                 _offset)
+            if ret < 0:
+                raise make_ex(ret, "Ioctx.readinto(%s): failed to read %s" % (self.name, key))
+            return ret
+        finally:
+            PyBuffer_Release(&view)
+
+    @requires(('key', str_type), ('offset', int))
+    def readv(self, key, buffers, offset=0):
+        """
+        Read data from an object synchronously into a sequence of buffers
+
+        The buffers are filled back to back starting at offset, as a
+        single operation. Each buffer may be any writable, contiguous
+        object supporting the buffer protocol.
+
+        :param key: name of the object
+        :type key: str
+        :param buffers: writable buffers to read into
+        :type buffers: sequence of bytearray, memoryview or other buffers
+        :param offset: byte offset in the object to begin reading at
+        :type offset: int
+
+        :raises: :class:`TypeError`
+        :raises: :class:`Error`
+        :returns: int - total number of bytes read
+        """
+        self.require_ioctx_open()
+        key = cstr(key, 'key')
+        buffers = list(buffers)
+        cdef:
+            char *_key = key
+            uint64_t _offset = offset
+            size_t i
+            size_t num = len(buffers)
+            size_t total = 0
+            size_t *bytes_read = NULL
+            int *prvals = NULL
+            Py_buffer *views = get_buffer_views(buffers, PyBUF_WRITABLE)
+            ReadOp read_op = ReadOp().create()
+
+        try:
+            bytes_read = <size_t *>calloc(num if num else 1, sizeof(size_t))
+            prvals = <int *>calloc(num if num else 1, sizeof(int))
+            if bytes_read == NULL or prvals == NULL:
+                raise MemoryError("calloc failed")
+            with nogil:
+                for i in xrange(num):
+                    rados_read_op_read(read_op.read_op, _offset, views[i].len,
+                                       <char *>views[i].buf, &bytes_read[i],
+                                       &prvals[i])
+                    _offset += views[i].len
+                ret = rados_read_op_operate(read_op.read_op, self.io, _key, 0)
+            if ret < 0:
+                raise make_ex(ret, "Ioctx.readv(%s): failed to read %s" % (self.name, key))
+            for i in xrange(num):
+                # a buffer may have been left partly filled by its own read
+                if prvals[i] < 0:
+                    raise make_ex(prvals[i],
+                                  "Ioctx.readv(%s): failed to read %s into "
+                                  "buffer %d" % (self.name, key, i))
+                total += bytes_read[i]
+            return total
+        finally:
+            read_op.release()
+            free(bytes_read)
+            free(prvals)
+            release_buffer_views(views, num)
+
     @requires(('key', str_type), ('cls', str_type), ('method', str_type), ('data', bytes))
     def execute(self, key, cls, method, data, length=8192):
         """
@@ -2749,7 +4041,6 @@ returned %d, but should return zero on success." % (self.name, ret))
                 "num_wr": stats.num_wr,
                 "num_wr_kb": stats.num_wr_kb}
 
-    @requires(('key', str_type))
     def remove_object(self, key):
         """
         Delete an object
@@ -2763,6 +4054,7 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: bool - True on success
         """
+        validate_arg(key, 'key', str_type)
         self.require_ioctx_open()
         key = cstr(key, 'key')
         cdef:
@@ -2804,7 +4096,6 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise make_ex(ret, "Ioctx.trunc(%s): failed to truncate %s" % (self.name, key))
         return ret
 
-    @requires(('key', str_type))
     def stat(self, key):
         """
         Get object stats (size/mtime)
@@ -2816,6 +4107,7 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: (size,timestamp)
         """
+        validate_arg(key, 'key', str_type)
         self.require_ioctx_open()
 
         key = cstr(key, 'key')
@@ -2830,7 +4122,6 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise make_ex(ret, "Failed to stat %r" % key)
         return psize, time.localtime(pmtime)
 
-    @requires(('key', str_type), ('xattr_name', str_type))
     def get_xattr(self, key, xattr_name):
         """
         Get the value of an extended attribute on an object.
@@ -2844,6 +4135,8 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: str - value of the xattr
         """
+        validate_arg(key, 'key', str_type)
+        validate_arg(xattr_name, 'xattr_name', str_type)
         self.require_ioctx_open()
 
         key = cstr(key, 'key')
@@ -2884,7 +4177,6 @@ returned %d, but should return zero on success." % (self.name, ret))
         self.require_ioctx_open()
         return XattrIterator(self, oid)
 
-    @requires(('key', str_type), ('xattr_name', str_type), ('xattr_value', bytes))
     def set_xattr(self, key, xattr_name, xattr_value):
         """
         Set an extended attribute on an object.
@@ -2900,6 +4192,9 @@ returned %d, but should return zero on success." % (self.name, ret))
         :raises: :class:`Error`
         :returns: bool - True on success, otherwise raise an error
         """
+        validate_arg(key, 'key', str_type)
+        validate_arg(xattr_name, 'xattr_name', str_type)
+        validate_arg(xattr_value, 'xattr_value', bytes)
         self.require_ioctx_open()
 
         key = cstr(key, 'key')
@@ -2946,14 +4241,103 @@ returned %d, but should return zero on success." % (self.name, ret))
                           (key, xattr_name))
         return True
 
-    def list_objects(self):
+    @requires(('parallel', (int, long, None)), ('batch_size', (int, long)))
+    def list_objects(self, parallel=None, batch_size=1024):
         """
         Get ObjectIterator on rados.Ioctx object.
 
-        :returns: ObjectIterator
+        With ``parallel`` set, the hash space of the pool is split into
+        that many shards which are listed concurrently by worker threads,
+        and objects are yielded as the shards return them.  The order in
+        which objects are returned is then unspecified.
+
+        :param parallel: number of shards to list concurrently
+        :type parallel: int
+        :param batch_size: number of objects fetched per request in
+                           parallel mode
+        :type batch_size: int
+
+        :raises: :class:`TypeError`, :class:`Error`
+        :returns: ObjectIterator, or a generator of Object when ``parallel``
+                  is set
         """
         self.require_ioctx_open()
-        return ObjectIterator(self)
+        if parallel is None:
+            return ObjectIterator(self)
+        if parallel <= 0:
+            raise Error("Ioctx.list_objects(%s): parallel must be positive" %
+                        self.name)
+        return self.__list_objects_parallel(parallel, batch_size)
+
+    def __list_objects_parallel(self, parallel, batch_size):
+        shards = [ObjectRangeIterator(self, shard, parallel, batch_size)
+                  for shard in range(parallel)]
+        results = queue.Queue(2 * parallel)
+        stop = threading.Event()
+        done = object()
+
+        def worker(it):
+            batch = []
+            try:
+                for obj in it:
+                    if stop.is_set():
+                        return
+                    batch.append(obj)
+                    if len(batch) == batch_size:
+                        results.put(batch)
+                        batch = []
+                if batch:
+                    results.put(batch)
+            except Exception as e:
+                results.put(e)
+            finally:
+                results.put(done)
+
+        for it in shards:
+            t = threading.Thread(target=worker, args=(it,))
+            t.daemon = True
+            t.start()
+
+        remaining = parallel
+        try:
+            while remaining:
+                item = results.get()
+                if item is done:
+                    remaining -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    for obj in item:
+                        yield obj
+        finally:
+            # let workers blocked on a full queue run to completion
+            stop.set()
+            while remaining:
+                if results.get() is done:
+                    remaining -= 1
+
+    @requires(('shard', int), ('num_shards', int), ('batch_size', int))
+    def list_objects_shard(self, shard, num_shards, batch_size=1024):
+        """
+        Get an iterator over one shard of the objects in the pool.
+
+        The hash space of the pool is split into ``num_shards`` ranges of
+        roughly equal size; this lists the objects of range ``shard``.
+        Iterating over all shards from ``0`` to ``num_shards - 1``, possibly
+        from different threads or processes, lists every object once.
+
+        :param shard: index of the shard to list, starting at 0
+        :type shard: int
+        :param num_shards: number of shards to split the pool into
+        :type num_shards: int
+        :param batch_size: number of objects fetched per request
+        :type batch_size: int
+
+        :raises: :class:`Error`
+        :returns: ObjectRangeIterator
+        """
+        self.require_ioctx_open()
+        return ObjectRangeIterator(self, shard, num_shards, batch_size)
 
     def list_snaps(self):
         """
@@ -3341,6 +4725,59 @@ returned %d, but should return zero on success." % (self.name, ret))
         finally:
             free(_keys)
 
+    @requires(('oid', str_type), ('start_after', str_type), ('filter_prefix', str_type),
+              ('page_size', int))
+    def get_omap_pages(self, oid, start_after="", filter_prefix="",
+                       page_size=1000, prefetch=True):
+        """
+        Iterate over the omap of an object one page at a time
+
+        Unlike get_omap_vals, this is not limited to a single window of
+        ``max_return`` keys: the whole omap is scanned by requesting
+        successive pages, and the next page is prefetched asynchronously
+        while the current one is being consumed.
+
+        :para oid: object name
+        :type oid: str
+        :para start_after: list keys starting after start_after
+        :type start_after: str
+        :para filter_prefix: list only keys beginning with filter_prefix
+        :type filter_prefix: str
+        :para page_size: maximum number of key/value pairs per page
+        :type page_size: int
+        :para prefetch: whether to request the next page in advance
+        :type prefetch: bool
+        :returns: OmapPageIterator - yields lists of (key, value) pairs
+        """
+        self.require_ioctx_open()
+        return OmapPageIterator(self, oid, start_after, filter_prefix,
+                                page_size, prefetch)
+
+    @requires(('oid', str_type), ('start_after', str_type), ('filter_prefix', str_type),
+              ('page_size', int))
+    def iterate_omap(self, oid, start_after="", filter_prefix="",
+                     page_size=1000, prefetch=True):
+        """
+        Iterate over all key/value pairs of an object's omap
+
+        This is a flattened view of get_omap_pages.
+
+        :para oid: object name
+        :type oid: str
+        :para start_after: list keys starting after start_after
+        :type start_after: str
+        :para filter_prefix: list only keys beginning with filter_prefix
+        :type filter_prefix: str
+        :para page_size: number of key/value pairs fetched per request
+        :type page_size: int
+        :para prefetch: whether to request the next page in advance
+        :type prefetch: bool
+        :returns: an iterator over (key, value) pairs
+        """
+        return chain.from_iterable(self.get_omap_pages(oid, start_after,
+                                                       filter_prefix,
+                                                       page_size, prefetch))
+
     @requires(('write_op', WriteOp), ('keys', tuple))
     def remove_omap_keys(self, write_op, keys):
         """
@@ -3515,6 +4952,309 @@ returned %d, but should return zero on success." % (self.name, ret))
             raise make_ex(ret, "Ioctx.rados_lock_exclusive(%s): failed to set lock %s on %s" % (self.name, name, key))
 
 
+def _call_soon_threadsafe(loop, callback, *args):
+    """
+    Schedule ``callback(*args)`` on ``loop`` from a librados thread
+
+    The call is dropped if the loop has already been closed, since
+    nobody is left waiting for it.
+    """
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        pass
+
+
+class _AsyncSubmitter(object):
+    """
+    Base class of the asyncio front-ends of the bindings
+
+    :meth:`_submit` issues an ``aio_*`` call of the wrapped object and
+    resolves a future on ``loop`` with the result of its completion.
+    No more than ``max_in_flight`` operations are outstanding at any
+    time; a slot is held until the operation completes, even if the
+    coroutine waiting for it has been cancelled.
+    """
+    def __init__(self, loop, max_in_flight):
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.max_in_flight = max_in_flight
+        self.throttle = None
+
+    def _make_ex(self, ret, msg):
+        return make_ex(ret, msg)
+
+    def _require_open(self):
+        pass
+
+    def _resolve(self, future, completion, result, msg, args):
+        self.throttle.release()
+        if future.cancelled():
+            return
+        ret = completion.get_return_value()
+        if ret < 0:
+            future.set_exception(self._make_ex(ret, msg))
+        else:
+            future.set_result(result)
+
+    async def _submit(self, aio_func, msg, *args):
+        """
+        Submit ``aio_func(*args, oncomplete)`` and wait for it to complete
+
+        :returns: tuple - the arguments passed to oncomplete after the
+            completion itself
+        """
+        if self.throttle is None:
+            # created lazily so that it binds to the running loop
+            self.throttle = asyncio.Semaphore(self.max_in_flight)
+        await self.throttle.acquire()
+        try:
+            self._require_open()
+            future = self.loop.create_future()
+
+            # oncomplete passes args on, so any data being written stays
+            # referenced until the operation has completed even if the
+            # waiter is cancelled in the meantime
+            def oncomplete(completion, *result):
+                _call_soon_threadsafe(self.loop, self._resolve, future,
+                                      completion, result, msg, args)
+
+            aio_func(*(args + (oncomplete,)))
+        except:
+            self.throttle.release()
+            raise
+        return await future
+
+
+class AsyncIoctx(_AsyncSubmitter):
+    """
+    asyncio front-end for a rados.Ioctx
+
+    Every method submits the matching ``Ioctx.aio_*`` operation and
+    returns a coroutine which resolves on ``loop`` once librados has
+    completed it, so a single event loop thread can keep many
+    operations in flight without per-operation Python threads.
+
+    No more than ``max_in_flight`` operations are submitted at any
+    time; further callers wait until a slot is released.
+
+    :param ioctx: the io context to issue operations on
+    :type ioctx: :class:`Ioctx`
+    :param loop: the event loop results are delivered on, defaults to
+        the current event loop
+    :type loop: :class:`asyncio.AbstractEventLoop`
+    :param max_in_flight: maximum number of outstanding operations
+    :type max_in_flight: int
+
+    :raises: :class:`LogicError` if asyncio is not available
+    """
+    def __init__(self, ioctx, loop=None, max_in_flight=128):
+        if asyncio is None:
+            raise LogicError("AsyncIoctx requires asyncio")
+        if max_in_flight < 1:
+            raise Error("AsyncIoctx(): max_in_flight must be positive")
+        super(AsyncIoctx, self).__init__(loop, max_in_flight)
+        self.ioctx = ioctx
+
+    def _require_open(self):
+        self.ioctx.require_ioctx_open()
+
+    async def read(self, key, length=8192, offset=0):
+        """
+        Read data from an object
+
+        :param key: name of the object
+        :type key: str
+        :param length: the number of bytes to read (default=8192)
+        :type length: int
+        :param offset: byte offset in the object to begin reading at
+        :type offset: int
+
+        :raises: :class:`Error`
+        :returns: bytes - data read from object
+        """
+        data, = await self._submit(self.ioctx.aio_read,
+                                   "error reading %s" % key,
+                                   key, length, offset)
+        return data
+
+    async def readinto(self, key, buf, offset=0):
+        """
+        Read data from an object into a caller-supplied writable buffer
+
+        :param key: name of the object
+        :type key: str
+        :param buf: writable buffer to read into
+        :type buf: bytearray, memoryview or other writable buffer
+        :param offset: byte offset in the object to begin reading at
+        :type offset: int
+
+        :raises: :class:`Error`
+        :returns: int - number of bytes read
+        """
+        nread, = await self._submit(self.ioctx.aio_readinto,
+                                    "error reading %s" % key,
+                                    key, buf, offset)
+        return nread
+
+    async def write(self, key, data, offset=0):
+        """
+        Write data to an object
+
+        :param key: name of the object
+        :type key: str
+        :param data: data to write
+        :type data: bytes
+        :param offset: byte offset in the object to begin writing at
+        :type offset: int
+
+        :raises: :class:`Error`
+        :returns: int - 0 on success
+        """
+        await self._submit(self.ioctx.aio_write,
+                           "error writing object %s" % key,
+                           key, data, offset)
+        return 0
+
+    async def write_full(self, key, data):
+        """
+        Write an entire object, atomically replacing it
+
+        :param key: name of the object
+        :type key: str
+        :param data: data to write
+        :type data: bytes
+
+        :raises: :class:`Error`
+        :returns: int - 0 on success
+        """
+        await self._submit(self.ioctx.aio_write_full,
+                           "error writing object %s" % key, key, data)
+        return 0
+
+    async def append(self, key, data):
+        """
+        Append data to an object
+
+        :param key: name of the object
+        :type key: str
+        :param data: data to append
+        :type data: bytes
+
+        :raises: :class:`Error`
+        :returns: int - 0 on success
+        """
+        await self._submit(self.ioctx.aio_append,
+                           "error appending object %s" % key, key, data)
+        return 0
+
+    async def stat(self, key):
+        """
+        Get object stats (size/mtime)
+
+        :param key: the name of the object to get stats from
+        :type key: str
+
+        :raises: :class:`Error`
+        :returns: (size,timestamp)
+        """
+        size, mtime = await self._submit(self.ioctx.aio_stat,
+                                         "Failed to stat %r" % key, key)
+        return size, mtime
+
+    async def remove_object(self, key):
+        """
+        Delete an object
+
+        :param key: the name of the object to delete
+        :type key: str
+
+        :raises: :class:`Error`
+        :returns: bool - True on success
+        """
+        await self._submit(self.ioctx.aio_remove,
+                           "Failed to remove '%s'" % key, key)
+        return True
+
+    async def execute(self, key, cls, method, data, length=8192):
+        """
+        Execute an OSD class method on an object
+
+        :param key: name of the object
+        :type key: str
+        :param cls: name of the object class
+        :type cls: str
+        :param method: name of the method
+        :type method: str
+        :param data: input data
+        :type data: bytes
+        :param length: size of output buffer in bytes (default=8192)
+        :type length: int
+
+        :raises: :class:`Error`
+        :returns: bytes - method output
+        """
+        out, = await self._submit(self.ioctx.aio_execute,
+                                  "error executing %s::%s on %s" %
+                                  (cls, method, key),
+                                  key, cls, method, data, length)
+        return out
+
+    async def watch(self, obj, callback, error_callback=None, timeout=None):
+        """
+        Register an interest in an object
+
+        The callbacks are run on the event loop; see :meth:`Ioctx.watch`.
+
+        :param obj: name of the object to watch
+        :type obj: str
+        :param callback: what to do when a notify is received
+        :type callback: callable
+        :param error_callback: what to do when the watch session fails
+        :type error_callback: callable
+        :param timeout: seconds after which the OSDs drop the watch of a
+                        disconnected client (default: OSD setting)
+        :type timeout: int
+
+        :raises: :class:`Error`
+        :returns: :class:`Watch`
+        """
+        watch, = await self._submit(self.ioctx.aio_watch,
+                                    "Failed to watch %s" % obj,
+                                    obj, callback, error_callback, timeout,
+                                    self.loop)
+        return watch
+
+    async def notify(self, obj, msg=b'', timeout_ms=5000):
+        """
+        Send a notify to the watchers of an object and wait for them to
+        acknowledge it
+
+        :param obj: name of the object to notify
+        :type obj: str
+        :param msg: payload sent to the watchers
+        :type msg: bytes
+        :param timeout_ms: how long to wait for acknowledgements (ms)
+        :type timeout_ms: int
+
+        :raises: :class:`TimedOut` if some watchers did not acknowledge
+        :returns: True on success
+        """
+        await self._submit(self.ioctx.aio_notify,
+                           "Failed to notify %r" % obj,
+                           obj, msg, timeout_ms)
+        return True
+
+    async def flush(self):
+        """
+        Wait until all pending writes in the io context are safe
+
+        The blocking flush runs in the loop's default executor.
+
+        :raises: :class:`Error`
+        """
+        await self.loop.run_in_executor(None, self.ioctx.aio_flush)
+
+
 def set_object_locator(func):
     def retfunc(self, *args, **kwargs):
         if self.locator_key is not None:
@@ -15,18 +15,37 @@ method.
 # Copyright 2015 Hector Martin <marcan@marcan.st>
 
 import cython
+import hashlib
+import struct
 import sys
+import threading
+import time
+import traceback
 
 from cpython cimport PyObject, ref, exc
+from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
+                             PyBUF_SIMPLE, PyBUF_WRITABLE)
 from libc cimport errno
 from libc.stdint cimport *
-from libc.stdlib cimport realloc, free
+from libc.stdlib cimport calloc, realloc, free
 from libc.string cimport strdup
 
-from collections import Iterable
+from collections import Iterable, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 cimport rados
+from rados import _AsyncSubmitter
 
 
 cdef extern from "Python.h":
@@ -47,6 +66,11 @@ cdef extern from "time.h":
 cdef extern from "limits.h":
     cdef uint64_t INT64_MAX
 
+cdef extern from "sys/uio.h":
+    cdef struct iovec:
+        void *iov_base
+        size_t iov_len
+
 cdef extern from "rbd/librbd.h" nogil:
     enum:
         _RBD_FEATURE_LAYERING "RBD_FEATURE_LAYERING"
@@ -245,6 +269,10 @@ cdef extern from "rbd/librbd.h" nogil:
     int rbd_discard(rbd_image_t image, uint64_t ofs, uint64_t len)
     int rbd_copy3(rbd_image_t src, rados_ioctx_t dest_io_ctx,
                   const char *destname, rbd_image_options_t dest_opts)
+    int rbd_copy_with_progress3(rbd_image_t image, rados_ioctx_t dest_p,
+                                const char *destname,
+                                rbd_image_options_t dest_opts,
+                                librbd_progress_fn_t cb, void *cbdata)
     int rbd_snap_list(rbd_image_t image, rbd_snap_info_t *snaps,
                       int *max_snaps)
     void rbd_snap_list_end(rbd_snap_info_t *snaps)
@@ -264,6 +292,8 @@ cdef extern from "rbd/librbd.h" nogil:
     int rbd_snap_get_timestamp(rbd_image_t image, uint64_t snap_id, timespec *timestamp)
     int rbd_snap_set(rbd_image_t image, const char *snapname)
     int rbd_flatten(rbd_image_t image)
+    int rbd_flatten_with_progress(rbd_image_t image, librbd_progress_fn_t cb,
+                                  void *cbdata)
     int rbd_rebuild_object_map(rbd_image_t image, librbd_progress_fn_t cb,
                                void *cbdata)
     ssize_t rbd_list_children(rbd_image_t image, char *pools, size_t *pools_len,
@@ -321,6 +351,10 @@ cdef extern from "rbd/librbd.h" nogil:
                       char *buf, rbd_completion_t c, int op_flags)
     int rbd_aio_discard(rbd_image_t image, uint64_t off, uint64_t len,
                         rbd_completion_t c)
+    int rbd_aio_writev(rbd_image_t image, const iovec *iov, int iovcnt,
+                       uint64_t off, rbd_completion_t c)
+    int rbd_aio_readv(rbd_image_t image, const iovec *iov, int iovcnt,
+                      uint64_t off, rbd_completion_t c)
 
     int rbd_aio_create_completion(void *cb_arg, rbd_callback_t complete_cb,
                                   rbd_completion_t *c)
@@ -498,6 +532,35 @@ cdef rados_ioctx_t convert_ioctx(rados.Ioctx ioctx) except? NULL:
 cdef int no_op_progress_callback(uint64_t offset, uint64_t total, void* ptr) nogil:
     return 0
 
+cdef int progress_callback(uint64_t offset, uint64_t total, void* ptr) with gil:
+    return (<object>ptr)(offset, total)
+
+
+class ProgressCallback(object):
+    """
+    Adapts a Python callable to a librbd progress callback
+
+    librbd reports progress from its own threads and ignores the value
+    returned by the callback, so an exception cannot stop the operation.
+    It is kept instead, and raised by :meth:`check` once the operation
+    has completed.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+        self.error = None
+
+    def __call__(self, offset, total):
+        if self.error is None:
+            try:
+                self.callback(offset, total)
+            except BaseException as e:
+                self.error = e
+        return 0
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
 def cstr(val, name, encoding="utf-8", opt=False):
     """
     Create a byte string from a Python string
@@ -542,6 +605,41 @@ cdef void* realloc_chk(void* ptr, size_t size) except NULL:
         raise MemoryError("realloc failed")
     return ret
 
+cdef ssize_t vectored_io(rbd_image_t image, Py_buffer *views, int iovcnt,
+                         uint64_t offset, bint write) except? -1:
+    """
+    Submit a vectored read or write and wait for it to complete
+
+    :returns: the return value of the completion
+    """
+    cdef:
+        int i
+        iovec *iov = <iovec *>calloc(iovcnt if iovcnt else 1, sizeof(iovec))
+        rbd_completion_t comp
+        ssize_t ret
+    if iov == NULL:
+        raise MemoryError("calloc failed")
+    try:
+        for i in xrange(iovcnt):
+            iov[i].iov_base = views[i].buf
+            iov[i].iov_len = views[i].len
+        with nogil:
+            ret = rbd_aio_create_completion(NULL, NULL, &comp)
+        if ret < 0:
+            raise make_ex(ret, "error getting a completion")
+        with nogil:
+            if write:
+                ret = rbd_aio_writev(image, iov, iovcnt, offset, comp)
+            else:
+                ret = rbd_aio_readv(image, iov, iovcnt, offset, comp)
+            if ret == 0:
+                rbd_aio_wait_for_complete(comp)
+                ret = rbd_aio_get_return_value(comp)
+            rbd_aio_release(comp)
+        return ret
+    finally:
+        free(iov)
+
 cdef class Completion
 
 cdef void __aio_complete_cb(rbd_completion_t completion, void *args) with gil:
@@ -649,6 +747,41 @@ cdef class Completion(object):
             self.persisted = False
 
 
+IMAGE_STAT_FIELDS = frozenset(['size', 'obj_size', 'num_objs', 'order',
+                               'block_name_prefix'])
+IMAGE_INFO_FIELDS = IMAGE_STAT_FIELDS | frozenset(['id', 'old_format',
+                                                   'features', 'flags',
+                                                   'parent', 'num_snaps'])
+
+
+def _image_info(image, fields):
+    info = {}
+    stat_fields = fields & IMAGE_STAT_FIELDS
+    if stat_fields:
+        stat = image.stat()
+        for field in stat_fields:
+            info[field] = stat[field]
+    if 'id' in fields or 'old_format' in fields:
+        old_format = image.old_format()
+        if 'old_format' in fields:
+            info['old_format'] = old_format
+        if 'id' in fields:
+            info['id'] = None if old_format else image.id()
+    if 'features' in fields:
+        info['features'] = image.features()
+    if 'flags' in fields:
+        info['flags'] = image.flags()
+    if 'parent' in fields:
+        try:
+            pool, name, snap = image.parent_info()
+            info['parent'] = {'pool': pool, 'image': name, 'snap': snap}
+        except ImageNotFound:
+            info['parent'] = None
+    if 'num_snaps' in fields:
+        info['num_snaps'] = sum(1 for _ in image.list_snaps())
+    return info
+
+
 class RBD(object):
     """
     This class wraps librbd CRUD functions.
@@ -840,6 +973,92 @@ class RBD(object):
         finally:
             free(c_names)
 
+    def list_info(self, ioctx, names=None, fields=None, parallel=16):
+        """
+        List images along with metadata read from their headers.
+
+        Every image is opened read-only, which does not register a watch on
+        its header, and up to ``parallel`` images are opened at a time.
+        Images removed while the listing is in progress are skipped.
+
+        ``fields`` selects the keys reported besides ``name``, by default
+        all of them:
+
+            * ``size``, ``obj_size``, ``num_objs``, ``order`` and
+              ``block_name_prefix`` - as returned by :meth:`Image.stat`
+
+            * ``id`` (str) - image id, or None for old format images
+
+            * ``old_format`` (bool) - see :meth:`Image.old_format`
+
+            * ``features`` (int) - see :meth:`Image.features`
+
+            * ``flags`` (int) - see :meth:`Image.flags`
+
+            * ``parent`` (dict) - ``pool``, ``image`` and ``snap`` names of
+              the parent of a clone, or None
+
+            * ``num_snaps`` (int) - the number of snapshots
+
+        :param ioctx: determines which RADOS pool is read
+        :type ioctx: :class:`rados.Ioctx`
+        :param names: images to report on, defaults to all images
+        :type names: list of str
+        :param fields: keys to report
+        :type fields: list of str
+        :param parallel: maximum number of images open at a time
+        :type parallel: int
+        :returns: list -- a dict per image, in the order of ``names`` or
+                  :meth:`list`
+        :raises: :class:`InvalidArgument`
+        """
+        if fields is None:
+            fields = IMAGE_INFO_FIELDS
+        else:
+            fields = frozenset(fields)
+            if not fields <= IMAGE_INFO_FIELDS:
+                raise InvalidArgument(errno.EINVAL, 'unknown fields: %s' %
+                                      ', '.join(sorted(fields - IMAGE_INFO_FIELDS)))
+        if parallel <= 0:
+            raise InvalidArgument(errno.EINVAL, 'parallel must be positive')
+        if names is None:
+            names = self.list(ioctx)
+        else:
+            names = list(names)
+
+        results = [None] * len(names)
+        pending = queue.Queue()
+        for i in range(len(names)):
+            pending.put(i)
+        errors = []
+
+        def worker():
+            while not errors:
+                try:
+                    i = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    with Image(ioctx, names[i], read_only=True) as image:
+                        results[i] = _image_info(image, fields)
+                except ImageNotFound:
+                    continue
+                except Exception as e:
+                    errors.append(e)
+                    return
+                results[i]['name'] = names[i]
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(min(parallel, len(names)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return [info for info in results if info is not None]
+
     def remove(self, ioctx, name):
         """
         Delete an RBD image. This may take a long time, since it does
@@ -1329,6 +1548,53 @@ cdef int diff_iterate_cb(uint64_t offset, size_t length, int write, void *cb) \
     return ret
 
 
+ctypedef struct diff_extent_t:
+    uint64_t offset
+    uint64_t length
+    uint8_t exists
+
+ctypedef struct diff_batch_t:
+    diff_extent_t *extents
+    size_t count
+    size_t capacity
+    # callable taking a list of (offset, length, exists) tuples and
+    # returning 0 to go on or a negative error code to stop; it must not
+    # raise
+    void *deliver
+
+cdef int flush_diff_batch(diff_batch_t *batch) except? -9000 with gil:
+    cdef:
+        size_t i
+        diff_extent_t *extent
+    # like diff_iterate_cb, stop calling back once a callback has failed
+    if exc.PyErr_Occurred():
+        return -9000
+    extents = []
+    for i in range(batch.count):
+        extent = &batch.extents[i]
+        extents.append((extent.offset, extent.length, bool(extent.exists)))
+    batch.count = 0
+    ret = (<object>batch.deliver)(extents)
+    if ret is None:
+        return 0
+    return ret
+
+cdef int diff_iterate_batch_cb(uint64_t offset, size_t length, int write,
+                               void *arg) except? -9000 nogil:
+    # accumulate extents without the GIL, and only take it to hand a full
+    # batch over to Python
+    cdef:
+        diff_batch_t *batch = <diff_batch_t *>arg
+        diff_extent_t *extent = &batch.extents[batch.count]
+    extent.offset = offset
+    extent.length = length
+    extent.exists = write != 0
+    batch.count += 1
+    if batch.count == batch.capacity:
+        return flush_diff_batch(batch)
+    return 0
+
+
 cdef class Image(object):
     """
     This class represents an RBD image. It is used to perform I/O on
@@ -1706,10 +1972,15 @@ cdef class Image(object):
         return owner == 1
 
     def copy(self, dest_ioctx, dest_name, features=None, order=None,
-             stripe_unit=None, stripe_count=None, data_pool=None):
+             stripe_unit=None, stripe_count=None, data_pool=None,
+             on_progress=None):
         """
         Copy the image to another location.
 
+        ``on_progress(offset, total)`` is called from librbd threads as the
+        copy proceeds.  It cannot abort the copy: an exception it raises is
+        propagated once the copy has completed.
+
         :param dest_ioctx: determines which pool to copy into
         :type dest_ioctx: :class:`rados.Ioctx`
         :param dest_name: the name of the copy
@@ -1724,6 +1995,8 @@ cdef class Image(object):
         :type stripe_count: int
         :param data_pool: optional separate pool for data blocks
         :type data_pool: str
+        :param on_progress: progress callback
+        :type on_progress: callable
         :raises: :class:`TypeError`
         :raises: :class:`InvalidArgument`
         :raises: :class:`ImageExists`
@@ -1731,10 +2004,12 @@ cdef class Image(object):
         :raises: :class:`ArgumentOutOfRange`
         """
         dest_name = cstr(dest_name, 'dest_name')
+        progress = ProgressCallback(on_progress) if on_progress else None
         cdef:
             rados_ioctx_t _dest_ioctx = convert_ioctx(dest_ioctx)
             char *_dest_name = dest_name
             rbd_image_options_t opts
+            void *_progress = <void *>progress
 
         rbd_image_options_create(&opts)
         try:
@@ -1753,12 +2028,21 @@ cdef class Image(object):
             if data_pool is not None:
                 rbd_image_options_set_string(opts, RBD_IMAGE_OPTION_DATA_POOL,
                                              data_pool)
-            with nogil:
-                ret = rbd_copy3(self.image, _dest_ioctx, _dest_name, opts)
+            if progress is None:
+                with nogil:
+                    ret = rbd_copy3(self.image, _dest_ioctx, _dest_name, opts)
+            else:
+                with nogil:
+                    ret = rbd_copy_with_progress3(self.image, _dest_ioctx,
+                                                  _dest_name, opts,
+                                                  &progress_callback,
+                                                  _progress)
         finally:
             rbd_image_options_destroy(opts)
         if ret < 0:
             raise make_ex(ret, 'error copying image %s to %s' % (self.name, dest_name))
+        if progress is not None:
+            progress.check()
 
     def list_snaps(self):
         """
@@ -2019,6 +2303,42 @@ cdef class Image(object):
             # itself and set ret_s to NULL, hence XDECREF).
             ref.Py_XDECREF(ret_s)
 
+    def readinto(self, buf, offset, fadvise_flags=0):
+        """
+        Read data from the image into a caller-supplied buffer. Raises
+        :class:`InvalidArgument` if part of the range specified is
+        outside the image.
+
+        Up to ``len(buf)`` bytes are read directly into ``buf``, which
+        may be any writable, contiguous object supporting the buffer
+        protocol (bytearray, memoryview, mmap, ...).
+
+        :param buf: writable buffer to read into
+        :type buf: bytearray, memoryview or other writable buffer
+        :param offset: the offset to start reading at
+        :type offset: int
+        :param fadvise_flags: fadvise flags for this read
+        :type fadvise_flags: int
+        :returns: int - the number of bytes read
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        cdef:
+            uint64_t _offset = offset
+            int _fadvise_flags = fadvise_flags
+            Py_buffer view
+
+        PyObject_GetBuffer(buf, &view, PyBUF_WRITABLE)
+        try:
+            with nogil:
+                ret = rbd_read2(self.image, _offset, view.len,
+                                <char *>view.buf, _fadvise_flags)
+            if ret < 0:
+                raise make_ex(ret, 'error reading %s %ld~%ld' %
+                              (self.name, offset, view.len))
+            return ret
+        finally:
+            PyBuffer_Release(&view)
+
     def diff_iterate(self, offset, length, from_snapshot, iterate_cb,
                      include_parent = True, whole_object = False):
         """
@@ -2077,6 +2397,163 @@ cdef class Image(object):
             msg = 'error generating diff from snapshot %s' % from_snapshot
             raise make_ex(ret, msg)
 
+    def __diff_iterate_batched(self, offset, length, from_snapshot,
+                               include_parent, whole_object, batch_size,
+                               deliver):
+        if batch_size <= 0:
+            raise InvalidArgument(errno.EINVAL, 'batch_size must be positive')
+        from_snapshot = cstr(from_snapshot, 'from_snapshot', opt=True)
+        cdef:
+            char *_from_snapshot = opt_str(from_snapshot)
+            uint64_t _offset = offset, _length = length
+            uint8_t _include_parent = include_parent
+            uint8_t _whole_object = whole_object
+            diff_batch_t batch
+            int ret
+
+        batch.extents = <diff_extent_t *>calloc(batch_size,
+                                                sizeof(diff_extent_t))
+        if batch.extents == NULL:
+            raise MemoryError("calloc failed")
+        batch.count = 0
+        batch.capacity = batch_size
+        batch.deliver = <void *>deliver
+        try:
+            with nogil:
+                ret = rbd_diff_iterate2(self.image, _from_snapshot, _offset,
+                                        _length, _include_parent,
+                                        _whole_object, &diff_iterate_batch_cb,
+                                        <void *>&batch)
+                if ret >= 0 and batch.count > 0:
+                    ret = flush_diff_batch(&batch)
+        finally:
+            free(batch.extents)
+        return ret
+
+    def diff_iterate_batched(self, offset, length, from_snapshot, iterate_cb,
+                             include_parent=True, whole_object=False,
+                             batch_size=4096):
+        """
+        Iterate over the changed extents of an image, in batches.
+
+        Like :meth:`diff_iterate`, but extents are gathered without
+        holding the GIL and iterate_cb is called once per ``batch_size``
+        extents with a list of (offset, length, exists) tuples, which
+        makes diffing heavily fragmented images much cheaper.
+
+        iterate_cb may raise an exception, which will abort the diff and will be
+        propagated to the caller.
+
+        :param offset: start offset in bytes
+        :type offset: int
+        :param length: size of region to report on, in bytes
+        :type length: int
+        :param from_snapshot: starting snapshot name, or None
+        :type from_snapshot: str or None
+        :param iterate_cb: function to call for each batch of extents
+        :type iterate_cb: function accepting a list of (offset, length,
+                          exists) tuples
+        :param include_parent: True if full history diff should include parent
+        :type include_parent: bool
+        :param whole_object: True if diff extents should cover whole object
+        :type whole_object: bool
+        :param batch_size: maximum number of extents per batch
+        :type batch_size: int
+        :raises: :class:`InvalidArgument`, :class:`IOError`,
+                 :class:`ImageNotFound`
+        """
+        errors = []
+
+        def deliver(extents):
+            try:
+                ret = iterate_cb(extents)
+            except BaseException as e:
+                errors.append(e)
+                return -errno.EINTR
+            return 0 if ret is None else ret
+
+        ret = self.__diff_iterate_batched(offset, length, from_snapshot,
+                                          include_parent, whole_object,
+                                          batch_size, deliver)
+        if errors:
+            raise errors[0]
+        if ret < 0:
+            msg = 'error generating diff from snapshot %s' % from_snapshot
+            raise make_ex(ret, msg)
+
+    def diff_extents(self, offset, length, from_snapshot,
+                     include_parent=True, whole_object=False,
+                     batch_size=4096):
+        """
+        Generate the changed extents of an image.
+
+        The diff runs in a background thread which hands batches of
+        extents over as they are consumed, see
+        :meth:`diff_iterate_batched`.  Closing the generator early stops
+        the diff.
+
+        :param offset: start offset in bytes
+        :type offset: int
+        :param length: size of region to report on, in bytes
+        :type length: int
+        :param from_snapshot: starting snapshot name, or None
+        :type from_snapshot: str or None
+        :param include_parent: True if full history diff should include parent
+        :type include_parent: bool
+        :param whole_object: True if diff extents should cover whole object
+        :type whole_object: bool
+        :param batch_size: maximum number of extents per batch
+        :type batch_size: int
+        :returns: generator of (offset, length, exists) tuples
+        :raises: :class:`InvalidArgument`, :class:`IOError`,
+                 :class:`ImageNotFound`
+        """
+        batches = queue.Queue(2)
+        stop = threading.Event()
+        done = object()
+        errors = []
+
+        def deliver(extents):
+            if stop.is_set():
+                return -errno.EINTR
+            batches.put(extents)
+            return 0
+
+        def run():
+            try:
+                ret = self.__diff_iterate_batched(offset, length,
+                                                  from_snapshot,
+                                                  include_parent,
+                                                  whole_object, batch_size,
+                                                  deliver)
+                if ret < 0 and not stop.is_set():
+                    msg = 'error generating diff from snapshot %s' % from_snapshot
+                    errors.append(make_ex(ret, msg))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                batches.put(done)
+
+        worker = threading.Thread(target=run)
+        worker.daemon = True
+        worker.start()
+
+        extents = None
+        try:
+            while True:
+                extents = batches.get()
+                if extents is done:
+                    break
+                for extent in extents:
+                    yield extent
+        finally:
+            # let the diff run into the stop flag if we were closed early
+            stop.set()
+            while extents is not done:
+                extents = batches.get()
+        if errors:
+            raise errors[0]
+
     def write(self, data, offset, fadvise_flags=0):
         """
         Write data to the image. Raises :class:`InvalidArgument` if
@@ -2112,6 +2589,61 @@ cdef class Image(object):
 returned %d, but %d was the maximum number of bytes it could have \
 written." % (self.name, ret, length))
 
+    def writev(self, buffers, offset):
+        """
+        Write a sequence of buffers to the image back to back, as a single
+        request, without joining them first. Raises :class:`InvalidArgument`
+        if part of the write would fall outside the image.
+
+        :param buffers: the data to be written
+        :type buffers: sequence of bytes-like objects
+        :param offset: where to start writing data
+        :type offset: int
+        :returns: int - the number of bytes written
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        buffers = list(buffers)
+        cdef:
+            uint64_t _offset = offset
+            int iovcnt = len(buffers)
+            ssize_t length = 0
+            Py_buffer *views = rados.get_buffer_views(buffers, PyBUF_SIMPLE)
+        try:
+            for i in xrange(iovcnt):
+                length += views[i].len
+            ret = vectored_io(self.image, views, iovcnt, _offset, True)
+            if ret < 0:
+                raise make_ex(ret, "error writing to %s" % (self.name,))
+            return length
+        finally:
+            rados.release_buffer_views(views, iovcnt)
+
+    def readv(self, buffers, offset):
+        """
+        Read data from the image into a sequence of buffers, filled back to
+        back, as a single request. Raises :class:`InvalidArgument` if part
+        of the range is outside the image.
+
+        :param buffers: writable buffers to read into
+        :type buffers: sequence of bytearray, memoryview or other buffers
+        :param offset: the offset to start reading at
+        :type offset: int
+        :returns: int - the number of bytes read
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        buffers = list(buffers)
+        cdef:
+            uint64_t _offset = offset
+            int iovcnt = len(buffers)
+            Py_buffer *views = rados.get_buffer_views(buffers, PyBUF_WRITABLE)
+        try:
+            ret = vectored_io(self.image, views, iovcnt, _offset, False)
+            if ret < 0:
+                raise make_ex(ret, 'error reading %s at %ld' % (self.name, offset))
+            return ret
+        finally:
+            rados.release_buffer_views(views, iovcnt)
+
     def discard(self, offset, length):
         """
         Trim the range from the image. It will be logically filled
@@ -2164,14 +2696,30 @@ written." % (self.name, ret, length))
             raise make_ex(ret, 'error getting stripe count for image %s' % (self.name))
         return stripe_count
 
-    def flatten(self):
+    def flatten(self, on_progress=None):
         """
         Flatten clone image (copy all blocks from parent to child)
+
+        ``on_progress(offset, total)`` is called from librbd threads as
+        objects are copied up.  It cannot abort the operation: an exception
+        it raises is propagated once flattening has completed.
+
+        :param on_progress: progress callback
+        :type on_progress: callable
         """
-        with nogil:
-            ret = rbd_flatten(self.image)
+        progress = ProgressCallback(on_progress) if on_progress else None
+        cdef void *_progress = <void *>progress
+        if progress is None:
+            with nogil:
+                ret = rbd_flatten(self.image)
+        else:
+            with nogil:
+                ret = rbd_flatten_with_progress(self.image, &progress_callback,
+                                                _progress)
         if ret < 0:
             raise make_ex(ret, "error flattening %s" % self.name)
+        if progress is not None:
+            progress.check()
 
     def rebuild_object_map(self):
         """
@@ -2718,6 +3266,471 @@ written." % (self.name, ret, length))
         """
         return MetadataIterator(self)
 
+
+class AsyncImage(_AsyncSubmitter):
+    """
+    asyncio front-end for an rbd.Image
+
+    I/O methods submit the matching ``Image.aio_*`` operation and return a
+    coroutine which resolves on ``loop`` once librbd has completed it, so a
+    single event loop thread can keep many requests in flight.  Calls that
+    only exist in blocking form, such as opening, closing and resizing the
+    image, run in the loop's default executor instead.
+
+    No more than ``max_in_flight`` requests are submitted at any time;
+    further callers wait until a slot is released, which bounds the queue
+    depth seen by the cluster and pushes back on the producers.
+
+    :param image: the image to issue requests on
+    :type image: :class:`Image`
+    :param loop: the event loop results are delivered on, defaults to
+        the current event loop
+    :type loop: :class:`asyncio.AbstractEventLoop`
+    :param max_in_flight: maximum number of outstanding requests
+    :type max_in_flight: int
+
+    :raises: :class:`LogicError` if asyncio is not available
+    """
+    def __init__(self, image, loop=None, max_in_flight=128):
+        if asyncio is None:
+            raise LogicError("AsyncImage requires asyncio")
+        if max_in_flight < 1:
+            raise InvalidArgument(errno.EINVAL,
+                                  "max_in_flight must be positive")
+        super(AsyncImage, self).__init__(loop, max_in_flight)
+        self.image = image
+
+    @classmethod
+    async def open(cls, ioctx, name, snapshot=None, read_only=False,
+                   loop=None, max_in_flight=128):
+        """
+        Open an image without blocking the event loop
+
+        :param ioctx: determines which RADOS pool the image is in
+        :type ioctx: :class:`rados.Ioctx`
+        :param name: the name of the image
+        :type name: str
+        :param snapshot: which snapshot to read from
+        :type snapshot: str
+        :param read_only: whether to open the image in read-only mode
+        :type read_only: bool
+        :param loop: the event loop results are delivered on
+        :type loop: :class:`asyncio.AbstractEventLoop`
+        :param max_in_flight: maximum number of outstanding requests
+        :type max_in_flight: int
+        :returns: :class:`AsyncImage`
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        image = await loop.run_in_executor(None, Image, ioctx, name,
+                                           snapshot, read_only)
+        return cls(image, loop, max_in_flight)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type_, value, traceback):
+        await self.close()
+        return False
+
+    def _make_ex(self, ret, msg):
+        return make_ex(ret, msg)
+
+    async def read(self, offset, length, fadvise_flags=0):
+        """
+        Read data from the image
+
+        :param offset: the offset to start reading at
+        :type offset: int
+        :param length: how many bytes to read
+        :type length: int
+        :param fadvise_flags: fadvise flags for this read
+        :type fadvise_flags: int
+        :returns: bytes - the data read
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        data, = await self._submit(
+            lambda oncomplete: self.image.aio_read(offset, length, oncomplete,
+                                                   fadvise_flags),
+            'error reading %s %d~%d' % (self.image.name, offset, length))
+        return data
+
+    async def write(self, data, offset, fadvise_flags=0):
+        """
+        Write data to the image
+
+        :param data: the data to be written
+        :type data: bytes
+        :param offset: where to start writing data
+        :type offset: int
+        :param fadvise_flags: fadvise flags for this write
+        :type fadvise_flags: int
+        :returns: int - the number of bytes written
+        :raises: :class:`IncompleteWriteError`, :class:`LogicError`,
+                 :class:`InvalidArgument`, :class:`IOError`
+        """
+        await self._submit(
+            lambda data, oncomplete: self.image.aio_write(data, offset,
+                                                          oncomplete,
+                                                          fadvise_flags),
+            'error writing %s %d~%d' % (self.image.name, offset, len(data)),
+            data)
+        return len(data)
+
+    async def discard(self, offset, length):
+        """
+        Trim the range from the image. It will be logically filled
+        with zeroes.
+
+        :param offset: the offset to start discarding at
+        :type offset: int
+        :param length: how many bytes to discard
+        :type length: int
+        :raises: :class:`InvalidArgument`, :class:`IOError`
+        """
+        await self._submit(self.image.aio_discard,
+                           'error discarding %s %d~%d' %
+                           (self.image.name, offset, length),
+                           offset, length)
+
+    async def flush(self):
+        """
+        Wait until all writes are fully flushed if caching is enabled.
+
+        :raises: :class:`IOError`
+        """
+        await self._submit(self.image.aio_flush,
+                           'error flushing %s' % self.image.name)
+
+    async def resize(self, size):
+        """
+        Change the size of the image, in the loop's default executor.
+
+        :param size: the new size of the image
+        :type size: int
+        """
+        await self.loop.run_in_executor(None, self.image.resize, size)
+
+    async def stat(self):
+        """
+        Get information about the image, in the loop's default executor.
+
+        :returns: dict - see :meth:`Image.stat`
+        """
+        return await self.loop.run_in_executor(None, self.image.stat)
+
+    async def close(self):
+        """
+        Close the image, in the loop's default executor.
+        """
+        await self.loop.run_in_executor(None, self.image.close)
+
+
+
+class _WatchDispatcher(object):
+    """
+    Runs the callbacks of many watches on a single thread
+
+    It stands in for the event loop :meth:`rados.Ioctx.watch` accepts, so
+    that watches share this thread rather than each starting its own.
+    """
+    def __init__(self):
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def call_soon_threadsafe(self, callback, *args):
+        self.events.put((callback, args))
+
+    def stop(self):
+        self.events.put(None)
+
+    def run(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            callback, args = event
+            try:
+                callback(*args)
+            except Exception:
+                traceback.print_exc()
+
+
+class CachedImage(object):
+    def __init__(self, key, image):
+        self.key = key
+        self.image = image
+        self.watch = None
+        self.users = 0
+        self.last_used = time.time()
+        self.valid = True
+
+    def close(self):
+        try:
+            if self.watch is not None:
+                self.watch.close()
+        finally:
+            self.image.close()
+
+
+class ImageCache(object):
+    """
+    Cache of read-only :class:`Image` handles
+
+    Opening an image reads its header and snapshot context from the
+    cluster, so callers that repeatedly open the same images for short
+    reads or stat calls can check handles out of a cache instead::
+
+        with cache.open(ioctx, 'myimage') as image:
+            image.stat()
+
+    Handles are keyed by cluster handle, pool, namespace, image name and
+    snapshot and may be used by several threads at once.  At most ``max_images`` handles are
+    kept, idle ones being closed least recently used first, and handles
+    left unused for ``idle_timeout`` seconds are closed on the next call
+    into the cache.
+
+    Images are opened through an io context the cache opens itself for
+    each pool and namespace, so the one passed by the caller may be closed
+    as soon as :meth:`open` returns; its :class:`rados.Rados` handle must
+    stay connected for as long as images opened through it are cached.
+
+    Read-only images do not watch their header, so unless
+    ``watch_header`` is False the cache watches it itself and stops
+    handing out an image once it is resized, snapshotted, removed or
+    otherwise changes.  The callbacks of all these watches run on a single
+    thread.
+
+    :param max_images: maximum number of open images
+    :type max_images: int
+    :param idle_timeout: seconds after which an unused image is closed,
+                         or None to keep it until evicted
+    :type idle_timeout: float
+    :param watch_header: whether to drop images whose header changes
+    :type watch_header: bool
+    """
+    def __init__(self, max_images=128, idle_timeout=300, watch_header=True):
+        if max_images < 1:
+            raise InvalidArgument(errno.EINVAL, 'max_images must be positive')
+        self.max_images = max_images
+        self.idle_timeout = idle_timeout
+        self.watch_header = watch_header
+        self.lock = threading.Lock()
+        # least recently used first
+        self.entries = OrderedDict()
+        self.retired = []
+        # io context and number of images using it, by pool key
+        self.ioctxs = {}
+        self.dispatcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_, value, traceback):
+        self.clear()
+        return False
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    @contextmanager
+    def open(self, ioctx, name, snapshot=None):
+        """
+        Check out a read-only handle to an image, opening it if it is not
+        cached yet.
+
+        The handle must not be closed by the caller and must not be used
+        once the ``with`` block has exited.
+
+        :param ioctx: determines which RADOS pool the image is in
+        :type ioctx: :class:`rados.Ioctx`
+        :param name: the name of the image
+        :type name: str
+        :param snapshot: which snapshot to read from
+        :type snapshot: str
+        :raises: :class:`ImageNotFound`
+        """
+        entry = self.__acquire(ioctx, name, snapshot)
+        try:
+            yield entry.image
+        finally:
+            self.__release(entry)
+
+    def invalidate(self, ioctx, name, snapshot=None):
+        """
+        Drop an image from the cache, e.g. after changing it through
+        another handle while header watches are disabled.
+
+        :param ioctx: determines which RADOS pool the image is in
+        :type ioctx: :class:`rados.Ioctx`
+        :param name: the name of the image
+        :type name: str
+        :param snapshot: which snapshot the image was opened at
+        :type snapshot: str
+        """
+        with self.lock:
+            entry = self.entries.get(self.__key(ioctx, name, snapshot))
+            if entry is not None:
+                self.__retire(entry)
+        self.__close_retired()
+
+    def clear(self):
+        """
+        Close all cached images that are not in use, and the others as
+        soon as they are released.
+        """
+        with self.lock:
+            for entry in list(self.entries.values()):
+                self.__retire(entry)
+            dispatcher, self.dispatcher = self.dispatcher, None
+        self.__close_retired()
+        if dispatcher is not None:
+            dispatcher.stop()
+
+    def __key(self, ioctx, name, snapshot):
+        # the cache holds a reference to the Rados handle for as long as
+        # the key is in use, so its id() cannot be reused meanwhile
+        return (id(ioctx.rados), ioctx.name, ioctx.get_namespace(), name,
+                snapshot)
+
+    def __get_ioctx(self, ioctx, pool_key):
+        with self.lock:
+            pool = self.ioctxs.get(pool_key)
+            if pool is not None:
+                pool[1] += 1
+                return pool[0]
+
+        own = ioctx.rados.open_ioctx(ioctx.name)
+        try:
+            own.set_namespace(ioctx.get_namespace())
+        except:
+            own.close()
+            raise
+
+        with self.lock:
+            pool = self.ioctxs.get(pool_key)
+            if pool is None:
+                pool = self.ioctxs[pool_key] = [own, 0]
+                own = None
+            pool[1] += 1
+        if own is not None:
+            # opened concurrently by another caller
+            own.close()
+        return pool[0]
+
+    def __put_ioctx(self, pool_key):
+        with self.lock:
+            pool = self.ioctxs[pool_key]
+            pool[1] -= 1
+            if pool[1]:
+                return
+            del self.ioctxs[pool_key]
+        pool[0].close()
+
+    def __retire(self, entry):
+        # called with the lock held
+        entry.valid = False
+        if self.entries.get(entry.key) is entry:
+            del self.entries[entry.key]
+        if entry.users == 0:
+            self.retired.append(entry)
+
+    def __close_retired(self):
+        with self.lock:
+            retired, self.retired = self.retired, []
+        for entry in retired:
+            try:
+                entry.close()
+            finally:
+                self.__put_ioctx(entry.key[:3])
+
+    def __trim(self):
+        # called with the lock held
+        now = time.time()
+        excess = len(self.entries) - self.max_images
+        for entry in list(self.entries.values()):
+            if entry.users:
+                continue
+            if excess > 0:
+                excess -= 1
+            elif (self.idle_timeout is None or
+                  now - entry.last_used < self.idle_timeout):
+                continue
+            self.__retire(entry)
+
+    def __acquire(self, ioctx, name, snapshot):
+        key = self.__key(ioctx, name, snapshot)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                entry.users += 1
+                self.entries[key] = entry
+            self.__trim()
+        self.__close_retired()
+        if entry is not None:
+            return entry
+
+        own = self.__get_ioctx(ioctx, key[:3])
+        try:
+            cached = CachedImage(key, Image(own, name, snapshot,
+                                            read_only=True))
+        except:
+            self.__put_ioctx(key[:3])
+            raise
+        try:
+            if self.watch_header:
+                with self.lock:
+                    if self.dispatcher is None:
+                        self.dispatcher = _WatchDispatcher()
+                    dispatcher = self.dispatcher
+                changed = lambda *args: self.__changed(cached)
+                cached.watch = own.watch(self.__header_oid(cached.image),
+                                         changed, changed, loop=dispatcher)
+        except:
+            try:
+                cached.close()
+            finally:
+                self.__put_ioctx(key[:3])
+            raise
+
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                # opened concurrently by another caller
+                self.retired.append(cached)
+            else:
+                entry = cached
+            self.entries[key] = entry
+            entry.users += 1
+            self.__trim()
+        self.__close_retired()
+        return entry
+
+    def __release(self, entry):
+        with self.lock:
+            entry.users -= 1
+            entry.last_used = time.time()
+            if not entry.valid and entry.users == 0:
+                self.retired.append(entry)
+            self.__trim()
+        self.__close_retired()
+
+    def __changed(self, entry):
+        # runs on the dispatcher thread, which must not block on closing
+        # the watch, so the image is closed on the next call into the cache
+        with self.lock:
+            if entry.valid:
+                self.__retire(entry)
+
+    def __header_oid(self, image):
+        if image.old_format():
+            return decode_cstr(image.name) + '.rbd'
+        return 'rbd_header.' + image.id()
+
+
 cdef class LockOwnerIterator(object):
     """
     Iterator over managed lock owners for an image
@@ -2929,3 +3942,525 @@ cdef class TrashIterator(object):
         if self.entries:
             free(self.entries)
 
+
+RBD_DIFF_BANNER = b'rbd diff v1\n'
+
+
+def _read_diff_record(fileobj, length):
+    data = fileobj.read(length)
+    if len(data) != length:
+        raise IOError(errno.EIO, 'unexpected end of diff stream')
+    return data
+
+
+def export_diff(image, fileobj, from_snapshot=None, to_snapshot=None,
+                whole_object=False, parallel=16):
+    """
+    Write the changes made to an image since a snapshot in the format of
+    ``rbd export-diff``.
+
+    The image is diffed at the snapshot it was opened at, or set with
+    :meth:`Image.set_snap`.  Changed extents are read with up to
+    ``parallel`` concurrent :meth:`Image.aio_read` calls and written out in
+    the order the reads complete, which the format allows.
+
+    :param image: the image to export
+    :type image: :class:`Image`
+    :param fileobj: where to write the diff, e.g. a file or a pipe
+    :type fileobj: writable binary file object
+    :param from_snapshot: starting snapshot name, or None to export all
+                          allocated extents
+    :type from_snapshot: str or None
+    :param to_snapshot: snapshot name recorded as the end of the diff,
+                        which :func:`import_diff` creates
+    :type to_snapshot: str or None
+    :param whole_object: True if diff extents should cover whole object
+    :type whole_object: bool
+    :param parallel: maximum number of reads in flight
+    :type parallel: int
+    :raises: :class:`InvalidArgument`, :class:`IOError`,
+             :class:`ImageNotFound`
+    """
+    if parallel <= 0:
+        raise InvalidArgument(errno.EINVAL, 'parallel must be positive')
+
+    size = image.size()
+    header = [RBD_DIFF_BANNER]
+    for tag, snap in ((b'f', from_snapshot), (b't', to_snapshot)):
+        if snap is not None:
+            snap = cstr(snap, 'snapshot')
+            header.append(tag + struct.pack('<I', len(snap)) + snap)
+    header.append(b's' + struct.pack('<Q', size))
+    fileobj.write(b''.join(header))
+
+    done = queue.Queue()
+    errors = []
+    in_flight = 0
+
+    def oncomplete(offset):
+        return lambda completion, data: done.put(
+            (offset, completion.get_return_value(), data))
+
+    def write_extent():
+        offset, ret, data = done.get()
+        if errors:
+            return
+        if ret < 0:
+            errors.append(make_ex(ret, 'error reading %s at %d' %
+                                  (image.name, offset)))
+        elif data.count(b'\0') == len(data):
+            fileobj.write(b'z' + struct.pack('<QQ', offset, len(data)))
+        else:
+            fileobj.write(b'w' + struct.pack('<QQ', offset, len(data)))
+            fileobj.write(data)
+
+    extents = image.diff_extents(0, size, from_snapshot,
+                                 whole_object=whole_object)
+    try:
+        for offset, length, exists in extents:
+            if errors:
+                break
+            if not exists:
+                fileobj.write(b'z' + struct.pack('<QQ', offset, length))
+                continue
+            while in_flight >= parallel:
+                write_extent()
+                in_flight -= 1
+            image.aio_read(offset, length, oncomplete(offset))
+            in_flight += 1
+    finally:
+        extents.close()
+        while in_flight:
+            write_extent()
+            in_flight -= 1
+    if errors:
+        raise errors[0]
+    fileobj.write(b'e')
+
+
+def import_diff(image, fileobj, parallel=16):
+    """
+    Apply a diff in the format of ``rbd export-diff`` to an image.
+
+    Extents are written or discarded with up to ``parallel`` concurrent
+    asynchronous requests while the stream is being read.  If the diff
+    records an end snapshot, it is created once all changes are applied.
+
+    :param image: the image to apply the diff to
+    :type image: :class:`Image`
+    :param fileobj: where to read the diff from, e.g. a file or a pipe
+    :type fileobj: readable binary file object
+    :param parallel: maximum number of writes in flight
+    :type parallel: int
+    :raises: :class:`InvalidArgument` if the stream is not a valid diff or
+             its start snapshot does not exist,
+             :class:`ImageExists` if its end snapshot already exists,
+             :class:`IOError`
+    """
+    if parallel <= 0:
+        raise InvalidArgument(errno.EINVAL, 'parallel must be positive')
+    if _read_diff_record(fileobj, len(RBD_DIFF_BANNER)) != RBD_DIFF_BANNER:
+        raise InvalidArgument(errno.EINVAL, 'invalid banner in diff stream')
+
+    to_snapshot = None
+    done = queue.Queue()
+    errors = []
+    in_flight = 0
+
+    def oncomplete(offset, data=None):
+        # data is referenced until the write completes
+        return lambda completion: done.put(
+            (offset, completion.get_return_value(), data))
+
+    def reap():
+        offset, ret, data = done.get()
+        if ret < 0 and not errors:
+            errors.append(make_ex(ret, 'error writing %s at %d' %
+                                  (image.name, offset)))
+
+    try:
+        while not errors:
+            tag = _read_diff_record(fileobj, 1)
+            if tag == b'e':
+                break
+            elif tag == b'f' or tag == b't':
+                length, = struct.unpack('<I', _read_diff_record(fileobj, 4))
+                name = decode_cstr(_read_diff_record(fileobj, length))
+                exists = any(snap['name'] == name
+                             for snap in image.list_snaps())
+                if tag == b'f' and not exists:
+                    raise InvalidArgument(errno.EINVAL, "start snapshot '%s' "
+                                          "does not exist in the image" % name)
+                elif tag == b't':
+                    if exists:
+                        raise ImageExists(errno.EEXIST, "end snapshot '%s' "
+                                          "already exists" % name)
+                    to_snapshot = name
+            elif tag == b's':
+                size, = struct.unpack('<Q', _read_diff_record(fileobj, 8))
+                while in_flight:
+                    reap()
+                    in_flight -= 1
+                if image.size() != size:
+                    image.resize(size)
+            elif tag == b'w' or tag == b'z':
+                offset, length = struct.unpack('<QQ',
+                                               _read_diff_record(fileobj, 16))
+                while in_flight >= parallel:
+                    reap()
+                    in_flight -= 1
+                if tag == b'w':
+                    data = _read_diff_record(fileobj, length)
+                    image.aio_write(data, offset, oncomplete(offset, data))
+                else:
+                    image.aio_discard(offset, length, oncomplete(offset))
+                in_flight += 1
+            else:
+                raise InvalidArgument(errno.EINVAL, 'unrecognized tag %r in '
+                                      'diff stream' % tag)
+    finally:
+        while in_flight:
+            reap()
+            in_flight -= 1
+    if errors:
+        raise errors[0]
+    if to_snapshot is not None:
+        image.create_snap(to_snapshot)
+
+
+def copy_sparse(src, dest, parallel=16, on_progress=None):
+    """
+    Copy the data of an image into another, skipping unallocated objects.
+
+    Allocated objects are found with :meth:`Image.diff_extents` and copied
+    with up to ``parallel`` concurrent asynchronous reads and writes.
+    Extents which read back as zeroes are not written either, so only real
+    data is moved and ``dest``, which should be a newly created image, stays
+    thin.  ``dest`` is resized to the size of ``src`` first.
+
+    ``on_progress(offset, total)`` is called as extents are copied, with
+    the end of the furthest extent done so far.
+
+    :param src: the image to copy from
+    :type src: :class:`Image`
+    :param dest: the image to copy to
+    :type dest: :class:`Image`
+    :param parallel: maximum number of requests in flight
+    :type parallel: int
+    :param on_progress: progress callback
+    :type on_progress: callable
+    :raises: :class:`InvalidArgument`, :class:`IOError`
+    """
+    if parallel <= 0:
+        raise InvalidArgument(errno.EINVAL, 'parallel must be positive')
+
+    size = src.size()
+    if dest.size() != size:
+        dest.resize(size)
+
+    done = queue.Queue()
+    errors = []
+    in_flight = 0
+    position = [0]
+
+    def read_complete(offset):
+        return lambda completion, data: done.put(
+            (src, offset, completion.get_return_value(), data))
+
+    def write_complete(offset, data):
+        # data is referenced until the write completes
+        return lambda completion: done.put(
+            (dest, offset, completion.get_return_value(), data))
+
+    def reap():
+        # returns False if the request was followed up by a write; errors,
+        # including those of on_progress, are recorded rather than raised so
+        # that the requests still in flight are always drained
+        image, offset, ret, data = done.get()
+        if errors:
+            return True
+        if ret < 0:
+            errors.append(make_ex(ret, 'error copying %s to %s at %d' %
+                                  (src.name, dest.name, offset)))
+            return True
+        try:
+            if image is src and data.count(b'\0') != len(data):
+                dest.aio_write(data, offset, write_complete(offset, data))
+                return False
+            if on_progress is not None and offset + len(data) > position[0]:
+                position[0] = offset + len(data)
+                on_progress(position[0], size)
+        except BaseException as e:
+            errors.append(e)
+        return True
+
+    extents = src.diff_extents(0, size, None, whole_object=True)
+    try:
+        for offset, length, exists in extents:
+            if errors:
+                break
+            if not exists:
+                continue
+            while in_flight >= parallel:
+                if reap():
+                    in_flight -= 1
+            src.aio_read(offset, length, read_complete(offset))
+            in_flight += 1
+    except BaseException as e:
+        # stop following up reads with writes while draining
+        errors.append(e)
+        raise
+    finally:
+        extents.close()
+        while in_flight:
+            if reap():
+                in_flight -= 1
+    if errors:
+        raise errors[0]
+    if on_progress is not None:
+        on_progress(size, size)
+
+
+MANIFEST_BANNER = b'rbd manifest v1\n'
+
+
+class Manifest(object):
+    """
+    Checksums of the fixed size blocks of an image
+
+    Digests are kept back to back in a single bytearray, so a manifest
+    costs a few bytes per block however large the image is, and two
+    manifests of the same image taken at different times can be compared
+    to find the changed blocks without reading the image again.
+
+    Use :func:`checksum_image` to create one.
+
+    :param size: size of the image in bytes
+    :type size: int
+    :param block_size: size of each block in bytes
+    :type block_size: int
+    :param algorithm: name of the hashlib algorithm used
+    :type algorithm: str
+    :param digests: concatenated digests, by default those of zeroes
+    :type digests: bytearray
+    """
+    def __init__(self, size, block_size, algorithm='sha1', digests=None):
+        if block_size <= 0:
+            raise InvalidArgument(errno.EINVAL, 'block_size must be positive')
+        self.size = size
+        self.block_size = block_size
+        self.algorithm = algorithm
+        try:
+            self.digest_size = hashlib.new(algorithm).digest_size
+        except ValueError:
+            raise InvalidArgument(errno.EINVAL,
+                                  'unknown checksum algorithm %s' % algorithm)
+        num_blocks = (size + block_size - 1) // block_size
+        if digests is None:
+            self.digests = bytearray(self.zero_digest(block_size) * num_blocks)
+            if size % block_size:
+                self[num_blocks - 1] = self.zero_digest(size % block_size)
+        elif len(digests) == num_blocks * self.digest_size:
+            self.digests = digests
+        else:
+            raise InvalidArgument(errno.EINVAL, 'expected %d digests' %
+                                  num_blocks)
+
+    def zero_digest(self, length):
+        return hashlib.new(self.algorithm, b'\0' * length).digest()
+
+    def __len__(self):
+        return len(self.digests) // self.digest_size
+
+    def __getitem__(self, index):
+        start = index * self.digest_size
+        return bytes(self.digests[start:start + self.digest_size])
+
+    def __setitem__(self, index, digest):
+        start = index * self.digest_size
+        self.digests[start:start + self.digest_size] = digest
+
+    def __eq__(self, other):
+        return (isinstance(other, Manifest) and self.size == other.size and
+                self.block_size == other.block_size and
+                self.algorithm == other.algorithm and
+                self.digests == other.digests)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def blocks(self):
+        """
+        Iterate over the blocks of the image
+
+        :returns: iterator of ``(offset, length, digest)`` tuples
+        """
+        for index in range(len(self)):
+            offset = index * self.block_size
+            yield (offset, min(self.block_size, self.size - offset),
+                   self[index])
+
+    def diff(self, other):
+        """
+        Find the extents where the image differs from an earlier manifest
+
+        Adjacent changed blocks are merged, and anything beyond the end of
+        the smaller image counts as changed.
+
+        :param other: manifest to compare with
+        :type other: :class:`Manifest`
+        :returns: list of ``(offset, length)`` tuples
+        :raises: :class:`InvalidArgument` if the manifests do not use the
+                 same block size and algorithm
+        """
+        if (self.block_size != other.block_size or
+                self.algorithm != other.algorithm):
+            raise InvalidArgument(errno.EINVAL, 'manifests use different '
+                                  'block sizes or algorithms')
+        extents = []
+        for index in range(max(len(self), len(other))):
+            if (index < len(self) and index < len(other) and
+                    self[index] == other[index]):
+                continue
+            offset = index * self.block_size
+            end = min(offset + self.block_size, max(self.size, other.size))
+            if extents and extents[-1][0] + extents[-1][1] == offset:
+                extents[-1] = (extents[-1][0], end - extents[-1][0])
+            else:
+                extents.append((offset, end - offset))
+        return extents
+
+    def save(self, fileobj):
+        """
+        Write the manifest to a file
+
+        :param fileobj: where to write the manifest
+        :type fileobj: writable binary file object
+        """
+        algorithm = cstr(self.algorithm, 'algorithm')
+        fileobj.write(MANIFEST_BANNER +
+                      struct.pack('<QQB', self.size, self.block_size,
+                                  len(algorithm)) + algorithm)
+        fileobj.write(self.digests)
+
+    @classmethod
+    def load(cls, fileobj):
+        """
+        Read a manifest written by :meth:`save`
+
+        :param fileobj: where to read the manifest from
+        :type fileobj: readable binary file object
+        :returns: :class:`Manifest`
+        :raises: :class:`InvalidArgument` if this is not a valid manifest
+        """
+        if fileobj.read(len(MANIFEST_BANNER)) != MANIFEST_BANNER:
+            raise InvalidArgument(errno.EINVAL, 'invalid manifest banner')
+        header = fileobj.read(struct.calcsize('<QQB'))
+        if len(header) != struct.calcsize('<QQB'):
+            raise InvalidArgument(errno.EINVAL, 'truncated manifest')
+        size, block_size, length = struct.unpack('<QQB', header)
+        algorithm = decode_cstr(fileobj.read(length))
+        return cls(size, block_size, algorithm, bytearray(fileobj.read()))
+
+
+def checksum_image(image, block_size=None, algorithm='sha1', parallel=16):
+    """
+    Compute the checksums of the blocks of an image
+
+    Only blocks holding allocated extents, as found with
+    :meth:`Image.diff_extents`, are read, with up to ``parallel``
+    concurrent :meth:`Image.aio_read` calls; the others are known to
+    contain zeroes.  The image is read at the snapshot it was opened at, or
+    set with :meth:`Image.set_snap`.
+
+    :param image: the image to checksum
+    :type image: :class:`Image`
+    :param block_size: size of each block in bytes, by default the object
+                       size of the image
+    :type block_size: int
+    :param algorithm: name of a hashlib algorithm
+    :type algorithm: str
+    :param parallel: maximum number of reads in flight
+    :type parallel: int
+    :returns: :class:`Manifest`
+    :raises: :class:`InvalidArgument`, :class:`IOError`
+    """
+    if parallel <= 0:
+        raise InvalidArgument(errno.EINVAL, 'parallel must be positive')
+    stat = image.stat()
+    if block_size is None:
+        block_size = stat['obj_size']
+    size = stat['size']
+    manifest = Manifest(size, block_size, algorithm)
+
+    done = queue.Queue()
+    errors = []
+    in_flight = 0
+
+    def oncomplete(index):
+        return lambda completion, data: done.put(
+            (index, completion.get_return_value(), data))
+
+    def reap():
+        index, ret, data = done.get()
+        if errors:
+            return
+        if ret < 0:
+            errors.append(make_ex(ret, 'error reading %s at %d' %
+                                  (image.name, index * block_size)))
+        else:
+            manifest[index] = hashlib.new(algorithm, data).digest()
+
+    extents = image.diff_extents(0, size, None)
+    next_index = 0
+    try:
+        for offset, length, exists in extents:
+            if errors:
+                break
+            if not exists:
+                continue
+            # read every block the extent touches, once
+            for index in range(max(next_index, offset // block_size),
+                               (offset + length - 1) // block_size + 1):
+                while in_flight >= parallel:
+                    reap()
+                    in_flight -= 1
+                block_offset = index * block_size
+                image.aio_read(block_offset,
+                               min(block_size, size - block_offset),
+                               oncomplete(index))
+                in_flight += 1
+                next_index = index + 1
+    finally:
+        extents.close()
+        while in_flight:
+            reap()
+            in_flight -= 1
+    if errors:
+        raise errors[0]
+    return manifest
+
+
+def find_duplicates(manifests):
+    """
+    Find blocks with the same contents within and across images
+
+    Blocks of zeroes are left out.
+
+    :param manifests: manifests of the images, which must use the same
+                      algorithm
+    :type manifests: list of :class:`Manifest`
+    :returns: dict - lists of ``(manifest index, offset, length)`` tuples
+              keyed by digest, for digests seen more than once
+    """
+    blocks = {}
+    for i, manifest in enumerate(manifests):
+        tail = manifest.size % manifest.block_size or manifest.block_size
+        zero_digests = set([manifest.zero_digest(manifest.block_size),
+                            manifest.zero_digest(tail)])
+        for offset, length, digest in manifest.blocks():
+            if digest in zero_digests:
+                continue
+            blocks.setdefault(digest, []).append((i, offset, length))
+    return dict((digest, found) for digest, found in blocks.items()
+                if len(found) > 1)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark for ceph_argparse command validation
+
+This runs against the real command set as dumped by the
+get_command_descriptions test binary, found in $CEPH_BIN like the one
+test_ceph_argparse.py uses, and needs no cluster:
+
+    CEPH_BIN=./bin python bench_ceph_argparse.py --ops 2000
+"""
+from __future__ import print_function
+import argparse
+import os
+import sys
+import time
+
+from ceph_argparse import parse_json_funcsigs, validate_command
+from legacy_ceph_argparse import legacy_validate_command
+
+COMMANDS = [
+    ['status'],
+    ['health', 'detail'],
+    ['osd', 'tree'],
+    ['osd', 'pool', 'get', 'rbd', 'size'],
+    ['osd', 'pool', 'set', 'rbd', 'size', '3'],
+    ['osd', 'crush', 'reweight', 'osd.1', '0.5'],
+    ['pg', 'dump', 'pgs_brief'],
+    ['auth', 'get-or-create', 'client.foo', 'mon', 'allow r'],
+    ['osd', 'pool', 'nosuchcommand'],
+]
+
+
+def report(name, ops, elapsed):
+    print("%-28s %10d ops %8.2fs %12.0f ops/s" %
+          (name, ops, elapsed, ops / elapsed if elapsed else 0))
+
+
+def quiet_validate_command(sigdict, args):
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        return validate_command(sigdict, args)
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+
+def run_calls(name, func, sigdict, ops):
+    start = time.time()
+    for i in range(ops):
+        func(sigdict, COMMANDS[i % len(COMMANDS)])
+    report(name, ops, time.time() - start)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--what', default='all',
+                        help='command set to dump, e.g. all or mon')
+    parser.add_argument('--ops', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    ceph_bin = os.environ.get('CEPH_BIN') or '.'
+    descriptions = os.popen(ceph_bin + '/get_command_descriptions --' +
+                            args.what).read()
+    start = time.time()
+    sigdict = parse_json_funcsigs(descriptions, 'cli')
+    print('parsed %d commands in %.3fs' % (len(sigdict), time.time() - start))
+
+    for cmd in COMMANDS:
+        if legacy_validate_command(sigdict, cmd) != \
+           quiet_validate_command(sigdict, cmd):
+            print('results differ for', ' '.join(cmd), file=sys.stderr)
+            return 1
+
+    run_calls('legacy validate_command', legacy_validate_command, sigdict,
+              args.ops)
+    run_calls('validate_command', quiet_validate_command, sigdict, args.ops)
+    run_calls('dict, index built per call', quiet_validate_command,
+              dict(sigdict), args.ops)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the rados Python binding
+
+These need a running cluster, e.g. one started with vstart.sh, and create
+a scratch pool which is deleted afterwards:
+
+    python bench_rados.py aio --ops 100000 --window 128
+    python bench_rados.py requires --ops 1000000
+"""
+from __future__ import print_function
+import argparse
+import sys
+import threading
+import time
+from itertools import chain
+
+from rados import Rados, requires
+
+
+def report(name, ops, elapsed):
+    print("%-24s %10d ops %8.2fs %12.0f ops/s" %
+          (name, ops, elapsed, ops / elapsed if elapsed else 0))
+
+
+def run_aio(name, submit, ops, window):
+    """
+    Issue ``ops`` asynchronous operations with at most ``window`` of them
+    in flight and report the rate at which they complete
+
+    :param submit: submit(i, oncomplete) issues the i-th operation
+    """
+    slots = threading.BoundedSemaphore(window)
+
+    def oncomplete(completion, *args):
+        slots.release()
+
+    start = time.time()
+    for i in range(ops):
+        slots.acquire()
+        submit(i, oncomplete)
+    for _ in range(window):
+        slots.acquire()
+    report(name, ops, time.time() - start)
+
+
+def bench_aio(ioctx, args):
+    data = b'x' * args.size
+    keys = ['bench_%d' % i for i in range(args.objects)]
+
+    run_aio('aio_write_full',
+            lambda i, cb: ioctx.aio_write_full(keys[i % args.objects], data,
+                                               oncomplete=cb),
+            args.ops, args.window)
+    run_aio('aio_read',
+            lambda i, cb: ioctx.aio_read(keys[i % args.objects], args.size,
+                                         0, cb),
+            args.ops, args.window)
+    run_aio('aio_stat',
+            lambda i, cb: ioctx.aio_stat(keys[i % args.objects], cb),
+            args.ops, args.window)
+
+
+def legacy_requires(*types):
+    """The generator based argument validation ``requires`` used to do"""
+    def check_type(val, arg_name, arg_type):
+        if isinstance(arg_type, tuple):
+            if any(val is None if t is None else isinstance(val, t)
+                   for t in arg_type):
+                return
+        elif isinstance(val, arg_type):
+            return
+        raise TypeError(arg_name)
+
+    def wrapper(f):
+        def validate_func(*args, **kwargs):
+            pos_args = zip(args[1:], types)
+            named_args = ((kwargs[name], (name, spec)) for name, spec in types
+                          if name in kwargs)
+            for arg_val, (arg_name, arg_type) in chain(pos_args, named_args):
+                check_type(arg_val, arg_name, arg_type)
+            return f(*args, **kwargs)
+        return validate_func
+    return wrapper
+
+
+class Validated(object):
+    def plain(self, key, data, offset=0):
+        pass
+
+    @legacy_requires(('key', str), ('data', bytes), ('offset', int))
+    def legacy(self, key, data, offset=0):
+        pass
+
+    @requires(('key', str), ('data', bytes), ('offset', int))
+    def compiled(self, key, data, offset=0):
+        pass
+
+
+def run_calls(name, func, ops):
+    start = time.time()
+    for _ in range(ops):
+        func()
+    report(name, ops, time.time() - start)
+
+
+def bench_requires(ioctx, args):
+    obj = Validated()
+    data = b'x' * args.size
+    run_calls('undecorated', lambda: obj.plain('key', data, 0), args.ops)
+    run_calls('legacy requires', lambda: obj.legacy('key', data, 0), args.ops)
+    run_calls('requires', lambda: obj.compiled('key', data, 0), args.ops)
+
+    ioctx.write_full('bench', data)
+    ops = min(args.ops, 10000)
+    run_calls('Ioctx.stat', lambda: ioctx.stat('bench'), ops)
+    run_calls('Ioctx.read', lambda: ioctx.read('bench', args.size), ops)
+    run_calls('Ioctx.write_full', lambda: ioctx.write_full('bench', data), ops)
+
+
+BENCHMARKS = {
+    'aio': bench_aio,
+    'requires': bench_requires,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--conf', default='')
+    parser.add_argument('--pool', default='bench_rados')
+    parser.add_argument('--ops', type=int, default=50000)
+    parser.add_argument('--window', type=int, default=128,
+                        help='operations in flight')
+    parser.add_argument('--objects', type=int, default=1024,
+                        help='number of distinct objects')
+    parser.add_argument('--size', type=int, default=64,
+                        help='object size in bytes')
+    args = parser.parse_args(argv)
+
+    with Rados(conffile=args.conf) as cluster:
+        cluster.create_pool(args.pool)
+        try:
+            with cluster.open_ioctx(args.pool) as ioctx:
+                BENCHMARKS[args.benchmark](ioctx, args)
+        finally:
+            cluster.delete_pool(args.pool)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
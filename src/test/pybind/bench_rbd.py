@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the rbd Python binding
+
+These need a running cluster, e.g. one started with vstart.sh, and create
+a scratch pool which is deleted afterwards:
+
+    python bench_rbd.py list --images 1000 --parallel 32
+"""
+from __future__ import print_function
+import argparse
+import sys
+import time
+
+from rados import Rados
+from rbd import RBD, Image, ImageNotFound
+
+
+def report(name, ops, elapsed):
+    print("%-24s %10d ops %8.2fs %12.0f ops/s" %
+          (name, ops, elapsed, ops / elapsed if elapsed else 0))
+
+
+def naive_list_info(rbd, ioctx):
+    """Gather image metadata the way callers had to before list_info"""
+    result = []
+    for name in rbd.list(ioctx):
+        with Image(ioctx, name) as image:
+            info = image.stat()
+            info['features'] = image.features()
+            try:
+                info['parent'] = image.parent_info()
+            except ImageNotFound:
+                info['parent'] = None
+            info['num_snaps'] = len(list(image.list_snaps()))
+        result.append(info)
+    return result
+
+
+def bench_list(ioctx, args):
+    rbd = RBD()
+    names = ['bench_%d' % i for i in range(args.images)]
+    for name in names:
+        rbd.create(ioctx, name, args.size)
+    try:
+        start = time.time()
+        naive_list_info(rbd, ioctx)
+        report('open/stat loop', args.images, time.time() - start)
+
+        start = time.time()
+        rbd.list_info(ioctx, parallel=args.parallel)
+        report('list_info(parallel=%d)' % args.parallel, args.images,
+               time.time() - start)
+    finally:
+        for name in names:
+            rbd.remove(ioctx, name)
+
+
+BENCHMARKS = {
+    'list': bench_list,
+}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--conf', default='')
+    parser.add_argument('--pool', default='bench_rbd')
+    parser.add_argument('--images', type=int, default=200,
+                        help='number of images to create')
+    parser.add_argument('--size', type=int, default=1 << 30,
+                        help='image size in bytes')
+    parser.add_argument('--parallel', type=int, default=16,
+                        help='images opened at a time')
+    args = parser.parse_args(argv)
+
+    with Rados(conffile=args.conf) as cluster:
+        cluster.create_pool(args.pool)
+        try:
+            with cluster.open_ioctx(args.pool) as ioctx:
+                BENCHMARKS[args.benchmark](ioctx, args)
+        finally:
+            cluster.delete_pool(args.pool)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
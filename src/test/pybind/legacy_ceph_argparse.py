@@ -0,0 +1,57 @@
+"""
+Reference implementation of ceph_argparse command validation
+
+This is validate_command() as it was before commands were looked up
+through a prefix index: every command of the sigdict is scored against
+the arguments.  test_ceph_argparse.py checks the index against it and
+bench_ceph_argparse.py measures the difference.
+"""
+import copy
+
+from ceph_argparse import ArgumentError, ArgumentPrefix, ArgumentTooFew, \
+    cmdsiglen, validate, validate_one
+
+
+def legacy_matchnum(args, signature, partial=False):
+    """matchnum as it was, validating a copy of the signature"""
+    words = args[:]
+    mysig = copy.deepcopy(signature)
+    matchcnt = 0
+    for desc in mysig:
+        setattr(desc, 'numseen', 0)
+        while desc.numseen < desc.n:
+            if not words:
+                return matchcnt
+            word = words.pop(0)
+            try:
+                validate_one(word, desc, partial and (len(words) == 0))
+            except ArgumentError:
+                if not desc.req:
+                    words.insert(0, word)
+                    break
+                return matchcnt
+        if desc.req:
+            matchcnt += 1
+    return matchcnt
+
+
+def legacy_validate_command(sigdict, args):
+    """validate_command as it was, scoring every command, without output"""
+    best_match_cnt = 0
+    bestcmds = []
+    for cmdtag, cmd in sigdict.items():
+        matched = legacy_matchnum(args, cmd['sig'], partial=True)
+        if matched > best_match_cnt:
+            best_match_cnt = matched
+            bestcmds = [{cmdtag: cmd}]
+        elif matched == best_match_cnt:
+            bestcmds.append({cmdtag: cmd})
+    for cmdsig in sorted(bestcmds, key=cmdsiglen):
+        for cmd in cmdsig.values():
+            try:
+                return validate(args, cmd['sig'], flags=cmd.get('flags', 0))
+            except (ArgumentPrefix, ArgumentTooFew):
+                pass
+            except ArgumentError:
+                return {}
+    return None
@@ -18,8 +18,11 @@
 from nose.tools import eq_ as eq
 from nose.tools import *
 
-from ceph_argparse import validate_command, parse_json_funcsigs
+from ceph_argparse import validate_command, parse_json_funcsigs, \
+    RadosExecutor, run_in_thread, MDSClient, MDSClientCache
+from legacy_ceph_argparse import legacy_validate_command
 
+import errno
 import os
 import re
 import json
@@ -40,6 +43,67 @@ def test_parse_json_funcsigs():
 
 sigdict = parse_json_funcsigs(get_command_descriptions("all"), 'cli')
 
+def test_prefix_index():
+    commands = [['osd', 'pool', 'get', 'rbd', 'size'],
+                ['osd', 'po'],
+                ['osd', 'tree', 'toomany'],
+                ['pg', 'dump']]
+    # the index must not change what scoring every command would find
+    for args in commands:
+        eq(legacy_validate_command(sigdict, args),
+           validate_command(sigdict, args))
+
+    # changing the commands throws the index away
+    cmds = parse_json_funcsigs(get_command_descriptions("all"), 'cli')
+    for cmdtag, cmd in list(cmds.items()):
+        if [str(desc) for desc in cmd['sig'][:2]] == ['pg', 'dump']:
+            del cmds[cmdtag]
+    assert_is_none(validate_command(cmds, ['pg', 'dump']))
+
+
+def test_run_in_thread():
+    eq(run_in_thread(lambda: 42), 42)
+
+    def exit():
+        raise SystemExit(3)
+    assert_raises(SystemExit, run_in_thread, exit)
+
+    executor = RadosExecutor()
+    future = executor.submit(exit)
+    assert future.wait(10)
+    assert isinstance(future.exception, SystemExit)
+    eq(executor.busy, 0)
+    # the worker survived, to take the next call
+    eq(executor.workers, 1)
+    future = executor.submit(lambda: 42)
+    assert future.wait(10)
+    eq((future.retval, executor.workers), (42, 1))
+
+
+class FakeFilesystem(object):
+
+    def __init__(self, ret):
+        self.ret = ret
+        self.state = "initialized"
+
+    def mds_command(self, mds_spec, cmd, inbuf):
+        return self.ret, b'', ''
+
+    def shutdown(self):
+        self.state = "shutdown"
+
+
+def test_mds_client_cache():
+    cluster = object()
+    for ret, kept in ((0, True), (-errno.ENOENT, True),
+                      (-errno.ENOTCONN, False), (-errno.ETIMEDOUT, False)):
+        cache = MDSClientCache()
+        filesystem = FakeFilesystem(ret)
+        cache.clients[id(cluster)] = MDSClient(cluster, filesystem)
+        eq(cache.mds_command(cluster, '*', '{}', b'')[0], ret)
+        eq(id(cluster) in cache.clients, kept)
+        eq(filesystem.state, "initialized" if kept else "shutdown")
+
 
 class TestArgparse:
 
@@ -2,7 +2,9 @@
 from nose.tools import assert_raises, assert_equal, with_setup
 import cephfs as libcephfs
 import fcntl
+import io
 import os
+import shutil
 
 cephfs = None
 
@@ -97,6 +99,92 @@ def test_walk_dir():
         cephfs.rmdir(i)
     cephfs.closedir(handler)
 
+@with_setup(setup_test)
+def test_scandir():
+    cephfs.mkdir(b"/dir-1", 0o755)
+    names = [("file-%d" % i).encode() for i in range(10)]
+    for name in names:
+        fd = cephfs.open(b"/dir-1/" + name, 'w', 0o644)
+        cephfs.write(fd, name, 0)
+        cephfs.close(fd)
+    cephfs.mkdir(b"/dir-1/dir-2", 0o755)
+
+    entries = list(cephfs.scandir(b"/dir-1", batch_size=3))
+    assert_equal(sorted(e.name for e in entries), sorted(names + [b"dir-2"]))
+    for entry in entries:
+        assert_equal(entry.path, b"/dir-1/" + entry.name)
+        if entry.name == b"dir-2":
+            assert(entry.is_dir())
+        else:
+            assert(entry.is_file())
+            assert_equal(entry.stat().st_size, len(entry.name))
+            assert_equal(entry.inode(), cephfs.stat(entry.path).st_ino)
+
+    with cephfs.scandir(b"/dir-1/", batch_size=1) as it:
+        assert_equal(next(it).path[:7], b"/dir-1/")
+    assert_equal(list(it), [])
+    assert_equal(list(cephfs.scandir(b"/dir-1/dir-2")), [])
+    assert_raises(libcephfs.ObjectNotFound, cephfs.scandir, b"/dir-3")
+
+    cephfs.rmdir(b"/dir-1/dir-2")
+    for name in names:
+        cephfs.unlink(b"/dir-1/" + name)
+    cephfs.rmdir(b"/dir-1")
+
+@with_setup(setup_test)
+def test_tree_walk():
+    files = []
+    for d in [b"/tree", b"/tree/a", b"/tree/a/b", b"/tree/c"]:
+        cephfs.mkdir(d, 0o750)
+        for i in range(3):
+            path = d + ("/file-%d" % i).encode()
+            fd = cephfs.open(path, 'w', 0o640)
+            cephfs.write(fd, path, 0)
+            cephfs.close(fd)
+            files.append(path)
+    cephfs.symlink(b"/tree/a", b"/tree/c/link")
+
+    usage = libcephfs.du(cephfs, b"/tree", parallel=2)
+    assert_equal(usage, (sum(len(f) for f in files) + len(b"/tree/a"),
+                         len(files) + 1, 3))
+
+    seen = []
+    done = []
+    libcephfs.TreeWalker(cephfs, parallel=3).walk(
+        b"/tree", lambda entry: seen.append(entry.path), done.append,
+        prune=lambda entry: entry.name == b"a")
+    assert(b"/tree/a" in seen)
+    assert(b"/tree/a/file-0" not in seen)
+    assert_equal(sorted(done), [b"/tree", b"/tree/c"])
+
+    def fail(entry):
+        raise ValueError()
+    assert_raises(ValueError, libcephfs.TreeWalker(cephfs).walk, b"/tree",
+                  fail)
+
+    def exit(entry):
+        raise SystemExit()
+    assert_raises(SystemExit, libcephfs.TreeWalker(cephfs).walk, b"/tree",
+                  exit)
+
+    cephfs.chmod(b"/tree/c", 0o555)
+    libcephfs.copytree(cephfs, b"/tree", b"/copy")
+    assert_equal(libcephfs.du(cephfs, b"/copy").files, len(files) + 1)
+    assert_equal(cephfs.stat(b"/copy/c").st_mode & 0o777, 0o555)
+    cephfs.chmod(b"/tree/c", 0o755)
+    cephfs.chmod(b"/copy/c", 0o755)
+    assert_equal(cephfs.stat(b"/copy/a/b").st_mode & 0o777, 0o750)
+    assert_equal(cephfs.readlink(b"/copy/c/link", 64), b"/tree/a")
+    fd = cephfs.open(b"/copy/a/b/file-2", 'r')
+    assert_equal(cephfs.read(fd, 0, 64), b"/tree/a/b/file-2")
+    cephfs.close(fd)
+
+    libcephfs.rmtree(cephfs, b"/copy")
+    libcephfs.rmtree(cephfs, b"/tree")
+    assert_raises(libcephfs.ObjectNotFound, cephfs.stat, b"/tree")
+    assert_raises(libcephfs.ObjectNotFound, libcephfs.rmtree, cephfs,
+                  b"/tree")
+
 @with_setup(setup_test)
 def test_xattr():
     assert_raises(libcephfs.OperationNotSupported, cephfs.setxattr, "/", "key", b"value", 0)
@@ -147,6 +235,51 @@ def test_open():
     assert_raises(libcephfs.OperationNotSupported, cephfs.open, b'file-1', 'a')
     cephfs.unlink(b'file-1')
 
+@with_setup(setup_test)
+def test_readinto():
+    fd = cephfs.open(b'file-1', 'w+', 0o755)
+    cephfs.write(fd, b"asdfzxcv", 0)
+    buf = bytearray(16)
+    assert_equal(cephfs.readinto(fd, buf, 0), 8)
+    assert_equal(bytes(buf[:8]), b"asdfzxcv")
+    assert_equal(cephfs.readinto(fd, memoryview(buf)[12:], 4), 4)
+    assert_equal(bytes(buf[12:]), b"zxcv")
+    cephfs.close(fd)
+    cephfs.unlink(b'file-1')
+
+@with_setup(setup_test)
+def test_open_file():
+    assert_raises(libcephfs.ObjectNotFound, cephfs.open_file, b'file-1')
+    assert_raises(ValueError, cephfs.open_file, b'file-1', 'rw')
+    with cephfs.open_file(b'file-1', 'w') as f:
+        f.write(u'line one\nline two\n')
+    with cephfs.open_file(b'file-1') as f:
+        assert_equal(list(f), [u'line one\n', u'line two\n'])
+    with cephfs.open_file(b'file-1', 'ab', buffering=4) as f:
+        f.write(b'0123456789')
+    assert_equal(cephfs.stat(b'file-1').st_size, 28)
+    with cephfs.open_file(b'file-1', 'r+b') as f:
+        assert_equal(f.read(4), b'line')
+        f.seek(-10, os.SEEK_END)
+        f.write(b'abc')
+        f.seek(0)
+        assert_equal(f.read()[-10:], b'abc3456789')
+    with cephfs.open_file(b'file-1', 'rb', buffering=0) as f:
+        buf = bytearray(4)
+        assert_equal(f.readinto(buf), 4)
+        assert_equal(bytes(buf), b'line')
+        assert_equal(f.tell(), 4)
+        assert_raises(io.UnsupportedOperation, f.write, b'x')
+    assert_raises(libcephfs.ObjectExists, cephfs.open_file, b'file-1', 'x')
+
+    with cephfs.open_file(b'file-1', 'rb') as src:
+        with cephfs.open_file(b'file-2', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+    with cephfs.open_file(b'file-2', 'rb') as f:
+        assert_equal(f.read(), b'line one\nline two\nabc3456789')
+    cephfs.unlink(b'file-1')
+    cephfs.unlink(b'file-2')
+
 @with_setup(setup_test)
 def test_link():
     fd = cephfs.open(b'file-1', 'w', 0o755)
@@ -1,14 +1,17 @@
 from __future__ import print_function
+from nose import SkipTest
 from nose.tools import eq_ as eq, ok_ as ok, assert_raises
 from rados import (Rados, Error, RadosStateError, Object, ObjectExists,
-                   ObjectNotFound, ObjectBusy, requires, opt,
+                   ObjectNotFound, ObjectBusy, AsyncIoctx, requires, opt,
                    ANONYMOUS_AUID, ADMIN_AUID, LIBRADOS_ALL_NSPACES, WriteOpCtx, ReadOpCtx,
                    LIBRADOS_SNAP_HEAD, LIBRADOS_OPERATION_BALANCE_READS, LIBRADOS_OPERATION_SKIPRWLOCKS, MonitorLog)
 import time
 import threading
 import json
 import errno
+import os
 import sys
+import tempfile
 
 # Are we running Python 2.x
 _python2 = sys.version_info[0] < 3
@@ -350,6 +353,27 @@ class TestIoctx(object):
         object_names = [obj.key for obj in self.ioctx.list_objects()]
         eq(sorted(object_names), ['a', 'b', 'c', 'd'])
 
+    def test_list_objects_parallel(self):
+        keys = ['obj%d' % i for i in range(50)]
+        for key in keys:
+            self.ioctx.write(key, b'')
+        object_names = [obj.key for obj in
+                        self.ioctx.list_objects(parallel=4, batch_size=8)]
+        eq(sorted(object_names), sorted(keys))
+        assert_raises(Error, self.ioctx.list_objects, parallel=0)
+        assert_raises(TypeError, self.ioctx.list_objects, parallel='4')
+
+    def test_list_objects_shard(self):
+        keys = ['obj%d' % i for i in range(50)]
+        for key in keys:
+            self.ioctx.write(key, b'')
+        object_names = []
+        for shard in range(5):
+            object_names.extend(obj.key for obj in
+                                self.ioctx.list_objects_shard(shard, 5, 7))
+        eq(sorted(object_names), sorted(keys))
+        assert_raises(Error, self.ioctx.list_objects_shard, 5, 5)
+
     def test_list_ns_objects(self):
         self.ioctx.write('a', b'')
         self.ioctx.write('b', b'foo')
@@ -564,6 +588,24 @@ class TestIoctx(object):
             with assert_raises(ObjectNotFound):
                 self.ioctx.operate_read_op(read_op, "no_such")
 
+    def test_get_omap_pages(self):
+        keys = tuple("key%02d" % i for i in range(10))
+        values = tuple(("val%02d" % i).encode() for i in range(10))
+        with WriteOpCtx(self.ioctx) as write_op:
+            self.ioctx.set_omap(write_op, keys, values)
+            self.ioctx.operate_write_op(write_op, "hw")
+        pages = list(self.ioctx.get_omap_pages("hw", page_size=3))
+        eq([len(page) for page in pages], [3, 3, 3, 1])
+        eq(sum(pages, []), list(zip(keys, values)))
+        pages = list(self.ioctx.get_omap_pages("hw", page_size=4, prefetch=False))
+        eq(sum(pages, []), list(zip(keys, values)))
+        eq(list(self.ioctx.iterate_omap("hw", start_after="key07", page_size=2)),
+           list(zip(keys, values))[8:])
+        eq(list(self.ioctx.iterate_omap("hw", filter_prefix="key0")),
+           list(zip(keys, values))[:10])
+        assert_raises(ObjectNotFound, list, self.ioctx.iterate_omap("no_such"))
+        eq(list(self.ioctx.get_omap_pages("hw", start_after="key09")), [])
+
     def test_clear_omap(self):
         keys = ("1", "2", "3")
         values = (b"aaa", b"bbb", b"ccc")
@@ -798,6 +840,44 @@ class TestIoctx(object):
 
         [i.remove() for i in self.ioctx.list_objects()]
 
+    def test_aio_get_xattr(self):
+        retval = [None]
+        def cb(_, value):
+            retval[0] = value
+        self.ioctx.write("foo", b"")
+        self.ioctx.set_xattr("foo", "a", b"1234")
+        comp = self.ioctx.aio_get_xattr("foo", "a", cb)
+        comp.wait_for_complete_and_cb()
+        eq(retval[0], b"1234")
+        [i.remove() for i in self.ioctx.list_objects()]
+
+    def test_batch(self):
+        self.ioctx.write("foo", b"foo")
+        self.ioctx.set_xattr("foo", "a", b"x")
+        results = self.ioctx.batch([("bar", "write_full", b"barbaz"),
+                                    ("foo", "stat"),
+                                    ("foo", "read"),
+                                    ("foo", "read", 2, 1),
+                                    ("foo", "get_xattr", "a"),
+                                    ("no_such", "read")], window=2)
+        eq(results[0], 0)
+        eq(results[1][0], 3)
+        eq(results[2:5], [b"foo", b"oo", b"x"])
+        ok(isinstance(results[5], ObjectNotFound))
+        eq(self.ioctx.batch([("foo", "remove"), ("bar", "remove")]),
+           [True, True])
+        assert_raises(Error, self.ioctx.batch, [("foo", "frob")])
+        # nothing is submitted when a later descriptor is malformed
+        assert_raises(Error, self.ioctx.batch,
+                      [("baz", "write_full", b"baz"), ("foo",)])
+        assert_raises(Error, self.ioctx.batch,
+                      [("baz", "write_full", b"baz"), ("foo", "stat", 1)])
+        assert_raises(ObjectNotFound, self.ioctx.stat, "baz")
+        # and a bad argument halfway through leaves nothing in flight
+        assert_raises(TypeError, self.ioctx.batch,
+                      [("baz", "write_full", b"baz"), ("foo", "write", 1)])
+        self.ioctx.remove_object("baz")
+
     def test_lock(self):
         self.ioctx.lock_exclusive("foo", "lock", "locker", "desc_lock",
                                   10000, 0)
@@ -819,6 +899,48 @@ class TestIoctx(object):
         assert_raises(ObjectNotFound, self.ioctx.unlock, "foo", "lock", "locker1")
         assert_raises(ObjectNotFound, self.ioctx.unlock, "foo", "lock", "locker2")
 
+    def test_readinto(self):
+        self.ioctx.write("foo", b"barbaz")
+        buf = bytearray(16)
+        eq(self.ioctx.readinto("foo", buf), 6)
+        eq(bytes(buf[:6]), b"barbaz")
+        view = memoryview(buf)[8:]
+        eq(self.ioctx.readinto("foo", view, 3), 3)
+        eq(bytes(buf[8:11]), b"baz")
+        assert_raises(ObjectNotFound, self.ioctx.readinto, "no_such", buf)
+        assert_raises((TypeError, BufferError), self.ioctx.readinto, "foo", b"ro")
+
+    def test_writev_readv(self):
+        self.ioctx.writev("foo", [b"bar", bytearray(b"baz"), memoryview(b"qux")])
+        eq(self.ioctx.read("foo"), b"barbazqux")
+        self.ioctx.writev("foo", (b"B", b"A"), 3)
+        eq(self.ioctx.read("foo"), b"barBAzqux")
+        bufs = [bytearray(2), bytearray(4), bytearray(8)]
+        eq(self.ioctx.readv("foo", bufs, 1), 8)
+        eq([bytes(b) for b in bufs], [b"ar", b"BAzq", b"ux\0\0\0\0\0\0"])
+        assert_raises(ObjectNotFound, self.ioctx.readv, "no_such", bufs)
+
+    def test_write_op_writev(self):
+        with WriteOpCtx(self.ioctx) as write_op:
+            write_op.writev([b"foo", b"bar"], 2)
+            self.ioctx.operate_write_op(write_op, "foo")
+        eq(self.ioctx.read("foo"), b"\0\0foobar")
+
+    def test_aio_readinto(self):
+        retval = [None]
+        lock = threading.Condition()
+        def cb(_, nread):
+            with lock:
+                retval[0] = nread
+                lock.notify()
+        self.ioctx.write("foo", b"barbaz")
+        buf = bytearray(4)
+        comp = self.ioctx.aio_readinto("foo", buf, 2, cb)
+        comp.wait_for_complete_and_cb()
+        eq(retval[0], 4)
+        eq(bytes(buf), b"rbaz")
+        [i.remove() for i in self.ioctx.list_objects()]
+
     def test_execute(self):
         self.ioctx.write("foo", b"") # ensure object exists
 
@@ -859,6 +981,118 @@ class TestIoctx(object):
 
         [i.remove() for i in self.ioctx.list_objects()]
 
+    def test_async_ioctx(self):
+        if _python2:
+            raise SkipTest
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            aioctx = AsyncIoctx(self.ioctx, loop=loop, max_in_flight=4)
+            names = ["foo%d" % i for i in range(16)]
+            loop.run_until_complete(asyncio.gather(
+                *[aioctx.write_full(name, name.encode()) for name in names]))
+            data = loop.run_until_complete(asyncio.gather(
+                *[aioctx.read(name) for name in names]))
+            eq(data, [name.encode() for name in names])
+            size, _ = loop.run_until_complete(aioctx.stat("foo0"))
+            eq(size, 4)
+            assert_raises(ObjectNotFound, loop.run_until_complete,
+                          aioctx.stat("no_such"))
+            loop.run_until_complete(asyncio.gather(
+                *[aioctx.remove_object(name) for name in names]))
+            eq(list(self.ioctx.list_objects()), [])
+
+            # a cancelled write keeps its slot until it has completed
+            task = loop.create_task(aioctx.write_full("cancelled", b"x"))
+            loop.run_until_complete(asyncio.sleep(0))
+            task.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            eq(aioctx.throttle._value, 3)
+            while aioctx.throttle._value < 4:
+                loop.run_until_complete(asyncio.sleep(0.01))
+            self.ioctx.remove_object("cancelled")
+        finally:
+            loop.close()
+
+    def test_watch_notify(self):
+        self.ioctx.write_full('watched', b'')
+        received = []
+        dispatched = threading.Event()
+
+        def callback(notify_id, notifier_id, watch_id, data):
+            received.append(data)
+            dispatched.set()
+            return b'ack'
+
+        with self.ioctx.watch('watched', callback) as watch:
+            ok(watch.check() >= 0)
+            eq(self.ioctx.notify('watched', b'hello'), True)
+            ok(dispatched.wait(10))
+            eq(received, [b'hello'])
+
+            completions = []
+            lock = threading.Condition()
+            def cb(completion):
+                with lock:
+                    completions.append(completion.get_return_value())
+                    lock.notify()
+            self.ioctx.aio_notify('watched', b'again', oncomplete=cb)
+            with lock:
+                while not completions:
+                    lock.wait()
+            eq(completions, [0])
+            eq(received, [b'hello', b'again'])
+        eq(watch.state, "closed")
+
+        # a bad reply is reported, but the notify is still acknowledged
+        with self.ioctx.watch('watched', lambda *args: 42):
+            eq(self.ioctx.notify('watched', b'bad'), True)
+
+    def test_aio_watch(self):
+        self.ioctx.write_full('watched', b'')
+        received = threading.Event()
+        registered = threading.Event()
+        watches = []
+
+        def oncomplete(completion, watch):
+            eq(completion.get_return_value(), 0)
+            watches.append(watch)
+            registered.set()
+
+        self.ioctx.aio_watch('watched', lambda *args: received.set(),
+                             oncomplete=oncomplete)
+        ok(registered.wait(10))
+        self.ioctx.notify('watched')
+        ok(received.wait(10))
+        watches[0].close()
+
+    def test_upload_download_file(self):
+        data = os.urandom(10 * 1024 + 123)
+        src = tempfile.NamedTemporaryFile()
+        dst = tempfile.NamedTemporaryFile()
+        try:
+            src.write(data)
+            src.flush()
+            self.ioctx.write_full('file', b'x' * (len(data) + 100))
+            eq(self.ioctx.upload_file('file', src.name, chunk_size=1024,
+                                      parallel=3), len(data))
+            eq(self.ioctx.read('file', len(data) + 1), data)
+            eq(self.ioctx.download_file('file', dst.name, chunk_size=1000,
+                                        parallel=4), len(data))
+            with open(dst.name, 'rb') as f:
+                eq(f.read(), data)
+            # an exact number of chunks ends with a read past the end
+            self.ioctx.write_full('file', data[:2000])
+            eq(self.ioctx.download_file('file', dst.name, chunk_size=1000,
+                                        parallel=4), 2000)
+            with open(dst.name, 'rb') as f:
+                eq(f.read(), data[:2000])
+            assert_raises(ObjectNotFound, self.ioctx.download_file,
+                          'no_such', dst.name)
+        finally:
+            src.close()
+            dst.close()
+
 class TestObject(object):
 
     def setUp(self):
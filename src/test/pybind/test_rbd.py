@@ -1,5 +1,6 @@
 # vim: expandtab smarttab shiftwidth=4 softtabstop=4
 import functools
+import io
 import socket
 import os
 import time
@@ -12,7 +13,7 @@ from rados import (Rados,
                    LIBRADOS_OP_FLAG_FADVISE_DONTNEED,
                    LIBRADOS_OP_FLAG_FADVISE_NOCACHE,
                    LIBRADOS_OP_FLAG_FADVISE_RANDOM)
-from rbd import (RBD, Image, ImageNotFound, InvalidArgument, ImageExists,
+from rbd import (RBD, Image, AsyncImage, ImageCache, ImageNotFound, InvalidArgument, ImageExists,
                  ImageBusy, ImageHasSnapshots, ReadOnlyImage,
                  FunctionNotSupported, ArgumentOutOfRange,
                  DiskQuotaExceeded, ConnectionShutdown, PermissionError,
@@ -21,7 +22,8 @@ from rbd import (RBD, Image, ImageNotFound, InvalidArgument, ImageExists,
                  RBD_MIRROR_MODE_DISABLED, RBD_MIRROR_MODE_IMAGE,
                  RBD_MIRROR_MODE_POOL, RBD_MIRROR_IMAGE_ENABLED,
                  RBD_MIRROR_IMAGE_DISABLED, MIRROR_IMAGE_STATUS_STATE_UNKNOWN,
-                 RBD_LOCK_MODE_EXCLUSIVE)
+                 RBD_LOCK_MODE_EXCLUSIVE, export_diff, import_diff,
+                 copy_sparse, checksum_image, find_duplicates, Manifest)
 
 rados = None
 ioctx = None
@@ -272,6 +274,87 @@ def test_list_empty():
 def test_list():
     eq([image_name], RBD().list(ioctx))
 
+@with_setup(create_image, remove_image)
+def test_list_info():
+    rbd = RBD()
+    eq([], rbd.list_info(ioctx, names=['no_such_image']))
+    info, = rbd.list_info(ioctx)
+    eq(info['name'], image_name)
+    check_stat(info, IMG_SIZE, IMG_ORDER)
+    eq(info['parent'], None)
+    eq(info['num_snaps'], 0)
+    with Image(ioctx, image_name) as image:
+        eq(info['features'], image.features())
+        eq(info['old_format'], image.old_format())
+        image.create_snap('snap1')
+    eq([{'name': image_name, 'size': IMG_SIZE, 'num_snaps': 1}],
+       rbd.list_info(ioctx, fields=['size', 'num_snaps'], parallel=1))
+    with Image(ioctx, image_name) as image:
+        image.remove_snap('snap1')
+    assert_raises(InvalidArgument, rbd.list_info, ioctx, fields=['bogus'])
+
+@with_setup(create_image, remove_image)
+def test_image_cache():
+    def wait_for_len(cache, expected):
+        for _ in range(50):
+            if len(cache) == expected:
+                break
+            time.sleep(0.1)
+        eq(len(cache), expected)
+
+    with ImageCache(max_images=1, idle_timeout=None) as cache:
+        with cache.open(ioctx, image_name) as image:
+            eq(image.size(), IMG_SIZE)
+            first = image
+            with cache.open(ioctx, image_name) as image:
+                assert image is first
+        eq(len(cache), 1)
+
+        with Image(ioctx, image_name) as image:
+            image.resize(IMG_SIZE * 2)
+        wait_for_len(cache, 0)
+        with cache.open(ioctx, image_name) as image:
+            assert image is not first
+            eq(image.size(), IMG_SIZE * 2)
+            first = image
+
+        with Image(ioctx, image_name) as image:
+            image.create_snap('snap1')
+        wait_for_len(cache, 0)
+        with cache.open(ioctx, image_name) as image:
+            first = image
+        with cache.open(ioctx, image_name, 'snap1') as image:
+            eq(image.size(), IMG_SIZE * 2)
+        eq(len(cache), 1)
+        with cache.open(ioctx, image_name) as image:
+            assert image is not first
+        assert_raises(ImageNotFound, cache.open(ioctx, 'no_such').__enter__)
+
+        # the caller's io context may be closed while the image is cached
+        cache.clear()
+        with rados.open_ioctx(pool_name) as other:
+            with cache.open(other, image_name) as image:
+                eq(image.size(), IMG_SIZE * 2)
+        eq(len(cache), 1)
+        with Image(ioctx, image_name) as image:
+            image.resize(IMG_SIZE)
+        wait_for_len(cache, 0)
+
+        # images opened through another connection are cached apart
+        other_rados = Rados(conffile='')
+        other_rados.connect()
+        try:
+            with other_rados.open_ioctx(pool_name) as other:
+                with cache.open(other, image_name) as image:
+                    with cache.open(ioctx, image_name) as mine:
+                        assert image is not mine
+            cache.clear()
+        finally:
+            other_rados.shutdown()
+    eq(len(cache), 0)
+    with Image(ioctx, image_name) as image:
+        image.remove_snap('snap1')
+
 @with_setup(create_image, remove_image)
 def test_rename():
     rbd = RBD()
@@ -386,6 +469,26 @@ class TestImage(object):
         read = self.image.read(offset, 256)
         eq(data, read)
 
+    def test_readinto(self):
+        data = rand_data(256)
+        self.image.write(data, 50)
+        buf = bytearray(256)
+        eq(self.image.readinto(buf, 50), 256)
+        eq(bytes(buf), data)
+        view = memoryview(buf)[:16]
+        eq(self.image.readinto(view, 0), 16)
+        eq(bytes(buf[:16]), b'\0' * 16)
+        assert_raises(InvalidArgument, self.image.readinto, buf, IMG_SIZE + 1)
+
+    def test_writev_readv(self):
+        data = [rand_data(256), bytearray(rand_data(100)), memoryview(rand_data(20))]
+        eq(self.image.writev(data, 50), 376)
+        eq(self.image.read(50, 376), b''.join(bytes(d) for d in data))
+        bufs = [bytearray(6), bytearray(370)]
+        eq(self.image.readv(bufs, 50), 376)
+        eq(b''.join(bytes(b) for b in bufs), b''.join(bytes(d) for d in data))
+        assert_raises(InvalidArgument, self.image.readv, bufs, IMG_SIZE + 1)
+
     def test_read_bad_offset(self):
         assert_raises(InvalidArgument, self.image.read, IMG_SIZE + 1, IMG_SIZE)
 
@@ -467,6 +570,84 @@ class TestImage(object):
         self._test_copy(features, self.image.stat()['order'],
                         self.image.stripe_unit(), self.image.stripe_count())
 
+    def test_copy_progress(self):
+        global ioctx
+        self.image.write(rand_data(256), 0)
+        progress = []
+        dst_name = get_temp_image_name()
+        self.image.copy(ioctx, dst_name,
+                        on_progress=lambda *args: progress.append(args))
+        assert progress
+        eq(progress[-1], (IMG_SIZE, IMG_SIZE))
+
+        def fail(offset, total):
+            raise ValueError(offset)
+        with Image(ioctx, dst_name) as dst:
+            assert_raises(ValueError, copy_sparse, self.image, dst,
+                          on_progress=fail)
+        self.rbd.remove(ioctx, dst_name)
+
+        def cb(offset, total):
+            raise ValueError()
+        assert_raises(ValueError, self.image.copy, ioctx, dst_name,
+                      on_progress=cb)
+        self.rbd.remove(ioctx, dst_name)
+
+    def test_copy_sparse(self):
+        global ioctx
+        object_size = 1 << IMG_ORDER
+        data = rand_data(256)
+        self.image.write(b'\0' * 256, 0)
+        self.image.write(data, object_size)
+        dst_name = get_temp_image_name()
+        self.rbd.create(ioctx, dst_name, object_size, IMG_ORDER)
+        progress = []
+        with Image(ioctx, dst_name) as dst:
+            copy_sparse(self.image, dst, parallel=1,
+                        on_progress=lambda *args: progress.append(args))
+            eq(dst.size(), IMG_SIZE)
+            eq(dst.read(0, 256), b'\0' * 256)
+            eq(dst.read(object_size, 256), data)
+            eq([object_size], [offset for offset, _, _ in
+                               dst.diff_extents(0, IMG_SIZE, None)])
+        eq(progress[-1], (IMG_SIZE, IMG_SIZE))
+
+        def fail(offset, total):
+            raise ValueError(offset)
+        with Image(ioctx, dst_name) as dst:
+            assert_raises(ValueError, copy_sparse, self.image, dst,
+                          on_progress=fail)
+        self.rbd.remove(ioctx, dst_name)
+
+    def test_checksum_image(self):
+        object_size = 1 << IMG_ORDER
+        block_size = object_size // 4
+        empty = checksum_image(self.image, block_size)
+        eq(len(empty), IMG_SIZE // block_size)
+        eq(empty, checksum_image(self.image, block_size, parallel=1))
+
+        data = rand_data(256)
+        self.image.write(data, 0)
+        self.image.write(data, object_size + block_size)
+        manifest = checksum_image(self.image, block_size)
+        eq([(0, block_size), (object_size + block_size, block_size)],
+           manifest.diff(empty))
+        eq([[(0, 0, block_size), (0, object_size + block_size, block_size)]],
+           list(find_duplicates([manifest]).values()))
+        eq({}, find_duplicates([empty]))
+        assert_raises(InvalidArgument, manifest.diff,
+                      checksum_image(self.image))
+
+        saved = io.BytesIO()
+        manifest.save(saved)
+        saved.seek(0)
+        eq(manifest, Manifest.load(saved))
+        assert_raises(InvalidArgument, Manifest.load, io.BytesIO(b'bogus'))
+        saved = io.BytesIO()
+        Manifest(IMG_SIZE, block_size).save(saved)
+        assert_raises(InvalidArgument, Manifest.load,
+                      io.BytesIO(saved.getvalue().replace(b'sha1', b'nope')))
+
     def test_create_snap(self):
         global ioctx
         self.image.create_snap('snap1')
@@ -761,6 +942,110 @@ class TestImage(object):
         self.image.remove_snap('snap1')
         self.image.remove_snap('snap2')
 
+    def test_diff_iterate_batched(self):
+        object_size = 1 << IMG_ORDER
+        num_objects = IMG_SIZE // object_size
+        for i in range(num_objects):
+            self.image.write(b'a' * 256, i * object_size)
+        expected = [(i * object_size, 256, True) for i in range(num_objects)]
+
+        batches = []
+        self.image.diff_iterate_batched(0, IMG_SIZE, None, batches.append,
+                                        batch_size=1)
+        eq(batches, [[extent] for extent in expected])
+        batches = []
+        self.image.diff_iterate_batched(0, IMG_SIZE, None, batches.append)
+        eq(batches, [expected])
+
+        def cb(extents):
+            raise ValueError()
+        assert_raises(ValueError, self.image.diff_iterate_batched, 0,
+                      IMG_SIZE, None, cb)
+        assert_raises(InvalidArgument, self.image.diff_iterate_batched, 0,
+                      IMG_SIZE, None, cb, batch_size=0)
+
+        eq(list(self.image.diff_extents(0, IMG_SIZE, None, batch_size=1)),
+           expected)
+        extents = self.image.diff_extents(0, IMG_SIZE, None, batch_size=1)
+        eq(next(extents), expected[0])
+        extents.close()
+
+    def test_export_import_diff(self):
+        object_size = 1 << IMG_ORDER
+        self.image.write(b'a' * 256, 0)
+        self.image.create_snap('snap1')
+        full = io.BytesIO()
+        with Image(ioctx, image_name, 'snap1', read_only=True) as snap:
+            export_diff(snap, full, to_snapshot='snap1')
+        self.image.write(b'b' * 256, object_size)
+        self.image.write(b'\0' * 256, 0)
+        self.image.create_snap('snap2')
+        diff = io.BytesIO()
+        with Image(ioctx, image_name, 'snap2', read_only=True) as snap:
+            export_diff(snap, diff, 'snap1', 'snap2', parallel=1)
+
+        dst_name = get_temp_image_name()
+        self.rbd.create(ioctx, dst_name, object_size, IMG_ORDER)
+        with Image(ioctx, dst_name) as dst:
+            diff.seek(0)
+            assert_raises(InvalidArgument, import_diff, dst, diff)
+            diff.seek(0)
+            full.seek(0)
+            import_diff(dst, full)
+            eq(dst.size(), IMG_SIZE)
+            eq(dst.read(0, 256), b'a' * 256)
+            import_diff(dst, diff)
+            eq(dst.read(0, 256), b'\0' * 256)
+            eq(dst.read(object_size, 256), b'b' * 256)
+            eq(['snap1', 'snap2'], [snap['name'] for snap in dst.list_snaps()])
+            diff.seek(0)
+            assert_raises(ImageExists, import_diff, dst, diff)
+            assert_raises(InvalidArgument, import_diff, dst,
+                          io.BytesIO(b'not a diff stream'))
+            for snap in dst.list_snaps():
+                dst.remove_snap(snap['name'])
+        self.rbd.remove(ioctx, dst_name)
+        self.image.remove_snap('snap1')
+        self.image.remove_snap('snap2')
+
+    def test_async_image(self):
+        if sys.version_info < (3, 5):
+            raise SkipTest
+        import asyncio
+        loop = asyncio.new_event_loop()
+        try:
+            aimage = AsyncImage(self.image, loop=loop, max_in_flight=4)
+            offsets = [i * 4096 for i in range(16)]
+            eq(loop.run_until_complete(asyncio.gather(
+                *[aimage.write(b'a' * 512, off) for off in offsets])),
+               [512] * len(offsets))
+            loop.run_until_complete(aimage.flush())
+            eq(loop.run_until_complete(asyncio.gather(
+                *[aimage.read(off, 512) for off in offsets])),
+               [b'a' * 512] * len(offsets))
+            loop.run_until_complete(aimage.discard(0, 512))
+            eq(loop.run_until_complete(aimage.read(0, 512)), b'\0' * 512)
+            assert_raises(InvalidArgument, loop.run_until_complete,
+                          aimage.read(IMG_SIZE, 512))
+            loop.run_until_complete(aimage.resize(IMG_SIZE * 2))
+            eq(loop.run_until_complete(aimage.stat())['size'], IMG_SIZE * 2)
+
+            # a cancelled write keeps its slot until it has completed
+            task = loop.create_task(aimage.write(b'b' * 512, 0))
+            loop.run_until_complete(asyncio.sleep(0))
+            task.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            eq(aimage.throttle._value, 3)
+            while aimage.throttle._value < 4:
+                loop.run_until_complete(asyncio.sleep(0.01))
+
+            aimage = loop.run_until_complete(
+                AsyncImage.open(ioctx, image_name, read_only=True, loop=loop))
+            eq(loop.run_until_complete(aimage.read(4096, 512)), b'a' * 512)
+            loop.run_until_complete(aimage.close())
+        finally:
+            loop.close()
+
     def test_aio_read(self):
         # this is a list so that the local cb() can modify it
         retval = [None]
@@ -1114,6 +1399,19 @@ class TestClone(object):
     def test_flatten_larger_order(self):
         self.check_flatten_with_order(IMG_ORDER + 2)
 
+    def test_flatten_progress(self):
+        global ioctx
+        global features
+        clone_name2 = get_temp_image_name()
+        self.rbd.clone(ioctx, image_name, 'snap1', ioctx, clone_name2,
+                       features, IMG_ORDER)
+        progress = []
+        with Image(ioctx, clone_name2) as clone:
+            clone.flatten(on_progress=lambda *args: progress.append(args))
+            eq(0, clone.overlap())
+        assert progress
+        self.rbd.remove(ioctx, clone_name2)
+
     def test_flatten_drops_cache(self):
         global ioctx
         global features
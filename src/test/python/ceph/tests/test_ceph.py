@@ -1,3 +1,11 @@
+import argparse
+import errno
+import json
+import os
+import sys
+import threading
+import time
+
 import ceph
 
 # This file tests nothing (yet) except for being able to import ceph
@@ -8,3 +16,212 @@ class TestCeph(object):
 
     def test_basic(self):
         assert True
+
+
+DESCRIPTIONS = json.dumps({
+    'cmd000': {'sig': ['status'], 'help': 'show cluster status',
+               'module': 'mon', 'perm': 'r', 'avail': 'cli,rest'},
+    'cmd001': {'sig': ['osd', 'tree'], 'help': 'print OSD tree',
+               'module': 'osd', 'perm': 'r', 'avail': 'cli,rest'},
+})
+
+
+def sigs(sigdict):
+    return dict((cmdtag, ceph.concise_sig(cmd['sig']))
+                for cmdtag, cmd in sigdict.items())
+
+
+class TestCommandDescriptionCache(object):
+
+    def cache(self, tmpdir, ttl=300):
+        return ceph.CommandDescriptionCache(str(tmpdir), 'fsid', ttl)
+
+    def test_put_get(self, tmpdir):
+        cache = self.cache(tmpdir)
+        assert cache.get('mon') is None
+        sigdict = cache.put('mon', DESCRIPTIONS)
+        assert sorted(sigdict) == ['cmd000', 'cmd001']
+        assert sigs(cache.get('mon')) == sigs(sigdict)
+        assert cache.get('osd') is None
+        assert os.stat(cache.path).st_mode & 0o777 == 0o700
+
+    def test_ttl(self, tmpdir):
+        cache = self.cache(tmpdir)
+        cache.put('mon', DESCRIPTIONS)
+        with open(cache.index_path('mon')) as f:
+            index = json.load(f)
+        index['time'] = time.time() - 301
+        cache.write(cache.index_path('mon'), json.dumps(index).encode())
+        assert cache.get('mon') is None
+
+    def test_from_env(self, tmpdir, monkeypatch):
+        monkeypatch.setenv('CEPH_CLI_CACHE_DIR', str(tmpdir))
+        monkeypatch.setenv('CEPH_CLI_CACHE_TTL', '0')
+        assert ceph.CommandDescriptionCache.from_env('fsid') is None
+        monkeypatch.setenv('CEPH_CLI_CACHE_TTL', '60')
+        cache = ceph.CommandDescriptionCache.from_env('fsid')
+        assert cache.path == os.path.join(str(tmpdir), 'fsid')
+        assert cache.ttl == 60
+
+    def test_not_private(self, tmpdir):
+        cache = self.cache(tmpdir)
+        cache.put('mon', DESCRIPTIONS)
+        os.chmod(cache.path, 0o777)
+        assert cache.get('mon') is None
+        os.chmod(cache.path, 0o700)
+        assert cache.get('mon') is not None
+
+        with open(cache.index_path('mon')) as f:
+            digest = json.load(f)['digest']
+        pickle_path = cache.sigs_path('mon', digest)
+        os.chmod(pickle_path, 0o666)
+        assert cache.get('mon') is None
+        os.chmod(pickle_path, 0o600)
+
+        # a link could point at a file someone else controls
+        os.rename(pickle_path, str(tmpdir.join('elsewhere')))
+        os.symlink(str(tmpdir.join('elsewhere')), pickle_path)
+        assert cache.get('mon') is None
+
+    def test_cached_sigdict(self, tmpdir):
+        cache = self.cache(tmpdir)
+        assert ceph.cached_sigdict(None, 'mon', ['status']) is None
+        assert ceph.cached_sigdict(cache, 'mon', ['status']) is None
+        sigdict = cache.put('mon', DESCRIPTIONS)
+        assert sigs(ceph.cached_sigdict(cache, 'mon', ['status'])) == \
+            sigs(sigdict)
+        assert sigs(ceph.cached_sigdict(cache, 'mon', [])) == sigs(sigdict)
+        # a command the cached descriptions lack may be new to the daemon
+        assert ceph.cached_sigdict(cache, 'mon', ['osd', 'new']) is None
+
+
+class FakeCluster(object):
+    """
+    Stands in for json_command and send_command, answering
+    get_command_descriptions, osd metadata and commands per target
+    """
+
+    def __init__(self, versions, descriptions=None, replies=None):
+        self.versions = versions
+        self.descriptions = descriptions or {}
+        self.replies = replies or {}
+        self.fetched = []
+        self.sent = []
+
+    def json_command(self, cluster, target=('mon', ''), prefix=None,
+                     argdict=None, inbuf=b'', timeout=0, verbose=False):
+        if prefix == 'osd metadata':
+            return 0, json.dumps([{'id': int(osd), 'ceph_version': version}
+                                  for osd, version in self.versions.items()
+                                  if version]).encode(), ''
+        if prefix == 'get_command_descriptions':
+            self.fetched.append(target)
+            answer = self.descriptions.get(target, DESCRIPTIONS)
+            if isinstance(answer, list):
+                answer = answer.pop(0)
+            if isinstance(answer, int):
+                return answer, b'', 'failed'
+            return 0, answer.encode(), ''
+        self.sent.append((target, argdict['prefix']))
+        reply = self.replies.get(target)
+        if callable(reply):
+            return reply()
+        return 0, 'out {0}'.format(target[1]).encode(), ''
+
+    def send_command(self, cluster, target=('mon', ''), cmd=None, inbuf=b'',
+                     timeout=0, verbose=False):
+        self.sent.append((target, ' '.join(cmd)))
+        return -errno.EINVAL, b'', 'unknown command'
+
+
+class TestWildcardCommand(object):
+
+    def cluster(self, monkeypatch, versions, **kwargs):
+        cluster = FakeCluster(versions, **kwargs)
+        monkeypatch.setattr(ceph, 'json_command', cluster.json_command)
+        monkeypatch.setattr(ceph, 'send_command', cluster.send_command)
+        monkeypatch.setattr(ceph, 'raw_write',
+                            lambda buf: sys.stdout.write(buf.decode()))
+        return cluster
+
+    def args(self, **kwargs):
+        args = dict(tell_parallel=4, tell_timeout=None,
+                    tell_as_completed=False, output_file=None,
+                    output_format=None)
+        args.update(kwargs)
+        return argparse.Namespace(**args)
+
+    def test_group_by_version(self, monkeypatch):
+        self.cluster(monkeypatch, {'0': 'v1', '1': 'v2', '2': 'v1', '3': None})
+        targets = [('osd', str(i)) for i in range(4)]
+        assert ceph.group_by_version(targets) == [
+            [('osd', '0'), ('osd', '2')], [('osd', '1')], [('osd', '3')]]
+
+    def test_fetch_descriptions(self, monkeypatch):
+        self.cluster(monkeypatch, {}, descriptions={
+            ('osd', '0'): -errno.ETIMEDOUT, ('osd', '2'): -errno.EINVAL})
+        answer, failed = ceph.fetch_descriptions(
+            [('osd', '0'), ('osd', '1')], None)
+        assert answer[:2] == (('osd', '1'), 0)
+        assert list(failed) == [('osd', '0')]
+        assert failed[('osd', '0')][0] == -errno.ETIMEDOUT
+        answer, failed = ceph.fetch_descriptions([('osd', '2')], None)
+        assert answer[:2] == (('osd', '2'), -errno.EINVAL)
+        assert failed == {}
+
+    def test_fallback(self, monkeypatch, capsys):
+        cluster = self.cluster(monkeypatch, {'0': 'v1', '1': 'v1'},
+                               descriptions={('osd', '0'): -errno.ETIMEDOUT})
+        targets = [('osd', '0'), ('osd', '1')]
+        ret = ceph.wildcard_command(self.args(), ['osd', 'tree'], targets,
+                                    b'', None, None)
+        assert ret == errno.ETIMEDOUT
+        assert cluster.fetched == targets
+        assert cluster.sent == [(('osd', '1'), 'osd tree')]
+        out, err = capsys.readouterr()
+        assert out.splitlines() == ['osd.1: out 1']
+        assert 'osd.0: Error ETIMEDOUT' in err
+
+    def test_output_order(self, monkeypatch, capsys):
+        # osd.0 answers only once osd.1 has
+        answered = threading.Event()
+
+        def slow():
+            assert answered.wait(10)
+            return 0, b'out 0', ''
+
+        def fast():
+            answered.set()
+            return 0, b'out 1', ''
+
+        targets = [('osd', '0'), ('osd', '1')]
+        for as_completed, order in [(False, ['0', '1']), (True, ['1', '0'])]:
+            answered.clear()
+            cluster = self.cluster(monkeypatch, {'0': 'v1', '1': 'v1'},
+                                   replies={targets[0]: slow,
+                                            targets[1]: fast})
+            ret = ceph.wildcard_command(
+                self.args(tell_as_completed=as_completed), ['osd', 'tree'],
+                targets, b'', None, None)
+            assert ret == 0
+            # one fetch for the version both run
+            assert len(cluster.fetched) == 1
+            out, _ = capsys.readouterr()
+            assert out.splitlines() == ['osd.{0}: out {0}'.format(osd)
+                                        for osd in order]
+
+    def test_compat_upgrade(self, monkeypatch, capsys):
+        # an old daemon, upgraded before the command reaches it
+        target = ('osd', '0')
+        cluster = self.cluster(monkeypatch, {'0': 'v1', '1': 'v2'},
+                               descriptions={
+                                   target: [-errno.EINVAL, DESCRIPTIONS],
+                                   ('osd', '1'): [-errno.EINVAL, 'garbage']})
+        ret = ceph.wildcard_command(self.args(), ['osd', 'tree'],
+                                    [target, ('osd', '1')], b'', None, None)
+        assert cluster.sent.count((target, 'osd tree')) == 2
+        out, err = capsys.readouterr()
+        assert out.splitlines() == ['osd.0: out 0']
+        # failing to parse the new descriptions still ends the command
+        assert ret == errno.EIO
+        assert 'osd.1: Error EIO' in err